@@ -0,0 +1,59 @@
+"""
+python bench_instancenorm.py --repeat 5
+
+U-Net 안의 InstanceNormalization 레이어마다 기존 구현과 FusedInstanceNormalization의
+실행 시간과 출력 차이를 비교합니다.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+from keras import backend as K
+
+import model.model_ver_contour as contour
+
+
+def time_op(sess, op, feed, repeat):
+    sess.run(op, feed)  # warm-up
+    start = time.time()
+    for _ in range(repeat):
+        out = sess.run(op, feed)
+    return (time.time() - start) / repeat, out
+
+
+def main(repeat, atol):
+    sess = K.get_session()
+    layers = [l for l in contour.model.layers if isinstance(l, contour.InstanceNormalization)]
+    print(f"🔬 {len(layers)} InstanceNormalization layers")
+
+    total_ref, total_fused, worst = 0.0, 0.0, 0.0
+    for layer in layers:
+        shape = (1,) + tuple(layer.input_shape[1:])
+        x = tf.compat.v1.placeholder(tf.float32, shape=shape)
+        ref_op = contour.InstanceNormalization.call(layer, x)
+        fused_op = contour.FusedInstanceNormalization.call(layer, x)
+
+        feed = {x: np.random.randn(*shape).astype(np.float32)}
+        t_ref, out_ref = time_op(sess, ref_op, feed, repeat)
+        t_fused, out_fused = time_op(sess, fused_op, feed, repeat)
+        diff = float(np.max(np.abs(out_ref - out_fused)))
+
+        total_ref += t_ref
+        total_fused += t_fused
+        worst = max(worst, diff)
+        print(f"   {layer.name:<28} {str(shape[1:]):<22} "
+              f"ref {t_ref * 1000:8.1f}ms  fused {t_fused * 1000:8.1f}ms  "
+              f"x{t_ref / max(t_fused, 1e-9):4.2f}  max|diff| {diff:.2e}")
+
+    print(f"   ⏱️ total: ref {total_ref * 1000:.1f}ms, fused {total_fused * 1000:.1f}ms")
+    print("🎉 PASS" if worst <= atol else f"❌ FAIL (max|diff| {worst:.2e} > {atol})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+    main(args.repeat, args.atol)
@@ -0,0 +1,97 @@
+"""
+python bench_intermediate.py --input ./raw_data --work ./processed/bench_intermediate
+python bench_intermediate.py --input ./raw_data --work /scratch/bench --patients P001 P002 --repeat 2
+
+to3d.py -> run_defacer.py 전체 파이프라인을 중간 결과 형식만 바꿔 비교합니다.
+- gz  : 기존처럼 .nii.gz 중간 결과 (run_defacer가 전체를 압축 해제해야 voxel 접근 가능)
+- nii : to3d.py --uncompressed, 비압축 .nii 중간 결과 (run_defacer는 memmap으로 필요한 부분만 읽음)
+두 경우 모두 최종 defaced 결과는 .nii.gz 로 압축 저장됩니다.
+모델은 한 번만 로드해 두 설정에서 같이 사용하므로 로드 시간은 비교에 포함되지 않습니다.
+"""
+
+import argparse
+import os
+import shutil
+import time
+from pathlib import Path
+
+import to3d
+import run_defacer
+
+MODES = [("gz", True), ("nii", False)]
+
+
+def tree_size(path):
+    total = 0
+    for root, _, files in os.walk(str(path)):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run_once(input_dir, work_dir, compress, defacer, patients):
+    if work_dir.exists():
+        shutil.rmtree(work_dir)
+    nifti_dir = work_dir / "3d_input"
+    defaced_dir = work_dir / "defaced_output"
+
+    start = time.time()
+    to3d.process_to_nifti(input_dir, nifti_dir, patients=patients, compress=compress)
+    t_convert = time.time() - start
+
+    start = time.time()
+    run_defacer.main(nifti_dir, defaced_dir, patients=patients, defacer=defacer)
+    t_deface = time.time() - start
+
+    return {
+        "convert": t_convert,
+        "deface": t_deface,
+        "total": t_convert + t_deface,
+        "intermediate_mb": tree_size(nifti_dir) / float(1 << 20),
+        "output_mb": tree_size(defaced_dir) / float(1 << 20),
+    }
+
+
+def main(input_dir, work_dir, engine, repeat, patients=None, keep=False):
+    from defacer import Defacer
+
+    input_dir = Path(input_dir)
+    work_dir = Path(work_dir)
+
+    print("   ⏳ Loading DL Model...")
+    defacer = Defacer(engine=engine)
+
+    results = {}
+    for name, compress in MODES:
+        runs = []
+        for i in range(repeat):
+            print(f"\n🏁 [{name}] run {i + 1}/{repeat}")
+            runs.append(run_once(input_dir, work_dir / name, compress, defacer, patients))
+        # 반복 중 가장 빠른 실행 (파일 캐시/디스크 상태 영향 최소화)
+        results[name] = min(runs, key=lambda r: r["total"])
+
+    print("\n📊 End-to-end wall time (best of {})".format(repeat))
+    print(f"   {'format':<6} {'to3d':>9} {'deface':>9} {'total':>9} {'3d_input':>11} {'defaced':>11}")
+    for name, _ in MODES:
+        r = results[name]
+        print(f"   {name:<6} {r['convert']:8.1f}s {r['deface']:8.1f}s {r['total']:8.1f}s "
+              f"{r['intermediate_mb']:9.1f}MB {r['output_mb']:9.1f}MB")
+    base, fast = results["gz"], results["nii"]
+    print(f"   ⏱️ uncompressed intermediates: x{base['total'] / max(fast['total'], 1e-9):.2f} end-to-end, "
+          f"x{fast['intermediate_mb'] / max(base['intermediate_mb'], 1e-9):.1f} intermediate disk")
+
+    if not keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed vs uncompressed intermediate NIfTI benchmark")
+    parser.add_argument("--input", required=True, help="Path to raw DICOM data")
+    parser.add_argument("--work", required=True, help="벤치마크 작업 폴더 (실행마다 삭제 후 다시 생성)")
+    parser.add_argument("--engine", default="keras", choices=["keras", "frozen", "frozen_fp16", "frozen_int8"])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--patients", nargs="*", default=None, help="특정 환자만 (기본: 전체)")
+    parser.add_argument("--keep", action="store_true", help="벤치마크 결과 폴더를 지우지 않음")
+    args = parser.parse_args()
+    main(args.input, args.work, args.engine, args.repeat, args.patients, args.keep)
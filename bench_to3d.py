@@ -0,0 +1,213 @@
+"""
+python bench_to3d.py --work ./bench/to3d --generate --patients 4 --series 3 --slices 96
+python bench_to3d.py --work ./bench/to3d --generate --syntaxes explicit rle deflated --missing-slices 1 --duplicates 0.2 --mixed --junk 3
+python bench_to3d.py --work ./bench/to3d --input ./bench/raw_synth --repeat 3
+
+to3d.py 단계별 처리량 벤치마크 (files/s, MB/s).
+- organize : organize_dicom_folder (헤더 스캔 + 중복 제거 + 촬영 단위 복사), 입력 환자 폴더 전체 기준
+- convert  : convert_series 중 dicom2nifti로 바로 변환된 시리즈
+- rescued  : convert_series 중 dicom2nifti 실패 후 구조 모드로 변환된 시리즈 (실패한 1차 시도 시간 포함)
+- failed   : 변환하지 못한 시리즈
+- rescue   : 모든 시리즈에 attempt_rescue_conversion만 단독 실행 (구조 모드 자체 처리량)
+- end2end  : process_to_nifti 전체 (QC 기록, 임시 폴더 정리 포함)
+입력이 synth_dicom.py로 만든 코호트면 manifest.json의 기대값(중복 수, 시리즈별 결과)과 비교합니다.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import to3d
+
+STAGES = ["organize", "convert", "rescued", "failed", "rescue", "end2end"]
+
+
+def tree_stats(path):
+    files, size = 0, 0
+    for root, _, names in os.walk(str(path)):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+
+class StageStats(object):
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds, files, size):
+        st = self.stages.setdefault(stage, {"n": 0, "seconds": 0.0, "files": 0, "bytes": 0})
+        st["n"] += 1
+        st["seconds"] += seconds
+        st["files"] += files
+        st["bytes"] += size
+
+    def print_table(self, title):
+        print(f"\n📊 {title}")
+        print(f"   {'stage':<9} {'n':>4} {'files':>7} {'MB':>9} {'seconds':>9} {'files/s':>9} {'MB/s':>8}")
+        for stage in STAGES:
+            st = self.stages.get(stage)
+            if not st:
+                continue
+            seconds = max(st["seconds"], 1e-9)
+            mb = st["bytes"] / float(1 << 20)
+            print(f"   {stage:<9} {st['n']:>4} {st['files']:>7} {mb:>9.1f} {st['seconds']:>9.2f} "
+                  f"{st['files'] / seconds:>9.1f} {mb / seconds:>8.1f}")
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """to3d 함수들의 진행 출력과 dicom2nifti traceback 숨김 (벤치마크 표만 보이도록)"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def bench_stages(input_dir, work_dir, compress, verbose):
+    """환자/시리즈별로 to3d 단계를 직접 호출해 시간 측정. 반환: (StageStats, 환자별 결과)"""
+    stats = StageStats()
+    temp_base = work_dir / "_temp_organized"
+    out_dir = work_dir / "3d_input"
+    rescue_dir = work_dir / "_rescue"
+    ext = ".nii.gz" if compress else ".nii"
+    results = {}
+
+    for patient_dir in sorted(p for p in input_dir.iterdir() if p.is_dir()):
+        patient_id = patient_dir.name
+        files, size = tree_stats(patient_dir)
+
+        start = time.time()
+        with quiet(not verbose):
+            organized, duplicates = to3d.organize_dicom_folder(patient_dir, temp_base)
+        stats.add("organize", time.time() - start, files, size)
+
+        outcome = {"duplicates": duplicates, "converted": 0, "rescued": 0, "failed": 0}
+        for series_dir in sorted(d for d in organized.iterdir() if d.is_dir()):
+            s_files, s_size = tree_stats(series_dir)
+            save_name = f"{patient_id}_{series_dir.name}{ext}"
+            final_path = out_dir / patient_id / save_name
+            final_path.parent.mkdir(parents=True, exist_ok=True)
+
+            start = time.time()
+            with quiet(not verbose):
+                status = to3d.convert_series(series_dir, final_path, patient_id, save_name, compress)
+            stage = {"converted": "convert", "rescued": "rescued"}.get(status, "failed")
+            stats.add(stage, time.time() - start, s_files, s_size)
+            outcome[status or "failed"] += 1
+
+            rescue_dir.mkdir(parents=True, exist_ok=True)
+            start = time.time()
+            with quiet(not verbose):
+                to3d.attempt_rescue_conversion(str(series_dir), str(rescue_dir), compress=compress)
+            stats.add("rescue", time.time() - start, s_files, s_size)
+            shutil.rmtree(str(rescue_dir), ignore_errors=True)
+        results[patient_id] = outcome
+
+    return stats, results
+
+
+def bench_end_to_end(input_dir, work_dir, compress, verbose):
+    stats = StageStats()
+    files, size = tree_stats(input_dir)
+    start = time.time()
+    with quiet(not verbose):
+        to3d.process_to_nifti(input_dir, work_dir / "3d_input", compress=compress)
+    stats.add("end2end", time.time() - start, files, size)
+    return stats
+
+
+def check_manifest(input_dir, results):
+    """synth_dicom.py manifest의 기대값과 실제 결과 비교. 반환: 불일치 수"""
+    manifest_path = input_dir / "manifest.json"
+    if not manifest_path.exists():
+        return 0
+    with open(str(manifest_path)) as f:
+        manifest = json.load(f)
+
+    mismatches = 0
+    print("\n🔎 Manifest check")
+    for record in manifest["patients"]:
+        patient_id = record["patient_id"]
+        got = results.get(patient_id)
+        if got is None:
+            print(f"   ❌ {patient_id}: not processed")
+            mismatches += 1
+            continue
+        expected = {"duplicates": record["duplicates"], "converted": 0, "rescued": 0, "failed": 0}
+        for series in record["series"]:
+            expected[series["expected"]] += 1
+        diff = {k: (expected[k], got[k]) for k in expected if expected[k] != got[k]}
+        if diff:
+            mismatches += 1
+            print(f"   ❌ {patient_id}: " + ", ".join(f"{k} expected {e}, got {g}" for k, (e, g) in diff.items()))
+        else:
+            print(f"   ✅ {patient_id}: {got['converted']} converted, {got['rescued']} rescued, "
+                  f"{got['failed']} failed, {got['duplicates']} duplicates dropped")
+    return mismatches
+
+
+def main(work, input_dir=None, generate=False, generate_kwargs=None, repeat=1, compress=True, verbose=False):
+    work = Path(work)
+    if generate:
+        from synth_dicom import generate_cohort
+
+        input_dir = work / "raw_synth"
+        if input_dir.exists():
+            shutil.rmtree(str(input_dir))
+        generate_cohort(input_dir, **(generate_kwargs or {}))
+    if input_dir is None:
+        raise ValueError("--input 또는 --generate 중 하나가 필요합니다")
+    input_dir = Path(input_dir)
+
+    mismatches = 0
+    for i in range(repeat):
+        run_dir = work / "run"
+        if run_dir.exists():
+            shutil.rmtree(str(run_dir))
+        print(f"\n🏁 Run {i + 1}/{repeat} ({'.nii.gz' if compress else '.nii'})")
+
+        stats, results = bench_stages(input_dir, run_dir / "stages", compress, verbose)
+        e2e = bench_end_to_end(input_dir, run_dir / "e2e", compress, verbose)
+        stats.stages.update(e2e.stages)
+        stats.print_table(f"to3d stage throughput (run {i + 1})")
+        if i == 0:
+            mismatches = check_manifest(input_dir, results)
+        shutil.rmtree(str(run_dir), ignore_errors=True)
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="to3d stage benchmark (files/s, MB/s)")
+    parser.add_argument("--work", required=True, help="벤치마크 작업 폴더 (실행마다 결과 삭제)")
+    parser.add_argument("--input", default=None, help="raw DICOM 폴더 (기본: --generate 로 만든 합성 코호트)")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--uncompressed", action="store_true", help="NIfTI를 비압축 .nii 로 저장")
+    parser.add_argument("--verbose", action="store_true", help="to3d 진행 출력 표시")
+
+    gen = parser.add_argument_group("synthetic cohort (--generate, 옵션은 synth_dicom.py 와 같음)")
+    gen.add_argument("--generate", action="store_true", help="<work>/raw_synth 에 합성 코호트를 만들어 사용")
+    gen.add_argument("--patients", type=int, default=4)
+    gen.add_argument("--series", type=int, default=3)
+    gen.add_argument("--slices", type=int, default=64)
+    gen.add_argument("--size", type=int, default=256)
+    gen.add_argument("--syntaxes", nargs="+", default=["explicit"])
+    gen.add_argument("--missing-slices", type=int, default=0)
+    gen.add_argument("--duplicates", type=float, default=0.0)
+    gen.add_argument("--mixed", action="store_true")
+    gen.add_argument("--junk", type=int, default=0)
+    gen.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_kwargs = dict(patients=args.patients, series=args.series, slices=args.slices, size=args.size,
+                           syntaxes=args.syntaxes, missing_slices=args.missing_slices,
+                           duplicates=args.duplicates, mixed=args.mixed, junk=args.junk, seed=args.seed)
+    mismatches = main(args.work, args.input, args.generate, generate_kwargs, args.repeat,
+                      not args.uncompressed, args.verbose)
+    raise SystemExit(1 if mismatches else 0)
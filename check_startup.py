@@ -0,0 +1,81 @@
+"""
+python check_startup.py
+python check_startup.py --budget 1.5 --repeat 3
+
+CLI 진입점의 import 시간 점검. 각 모듈을 새 프로세스에서 import해 걸린 시간과,
+그 단계에서 불러오면 안 되는 무거운 패키지(TensorFlow, Keras, pandas 등)가 로드됐는지 확인합니다.
+예산 초과 또는 금지 패키지 로드가 있으면 exit code 1 (CI/배포 전 점검용).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 진입점 -> import 만으로는 로드되면 안 되는 패키지
+ENTRY_POINTS = {
+    "run_defacer": ["tensorflow", "keras", "pandas", "skimage", "nibabel.processing", "matplotlib"],
+    "to3d": ["tensorflow", "keras", "pandas", "dicom2nifti", "matplotlib"],
+    "watch_ingest": ["tensorflow", "keras", "pandas", "dicom2nifti", "nibabel"],
+    "serve_defacer": ["tensorflow", "keras", "pandas", "nibabel"],
+    "sharding": ["pandas"],
+    "defacer": ["tensorflow", "keras", "skimage", "matplotlib"],
+    "model.defacer": ["tensorflow", "keras", "matplotlib"],
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = [m for m in {forbidden!r} if m in sys.modules]
+print(json.dumps({{"seconds": seconds, "loaded": heavy}}))
+"""
+
+
+def probe(module, forbidden):
+    code = PROBE.format(module=module, forbidden=forbidden)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(budget, repeat, modules=None):
+    failures = 0
+    print(f"⏱️ Import-time budget: {budget:.2f}s per entry point (best of {repeat})")
+    for module, forbidden in ENTRY_POINTS.items():
+        if modules and module not in modules:
+            continue
+        try:
+            results = [probe(module, forbidden) for _ in range(repeat)]
+        except Exception as e:
+            print(f"   ❌ {module:<14} import error: {e}")
+            failures += 1
+            continue
+
+        seconds = min(r["seconds"] for r in results)
+        loaded = sorted(set(m for r in results for m in r["loaded"]))
+        ok = seconds <= budget and not loaded
+        failures += 0 if ok else 1
+        status = "✅" if ok else "❌"
+        print(f"   {status} {module:<14} {seconds:6.2f}s" + (f"  loaded eagerly: {', '.join(loaded)}" if loaded else ""))
+
+    if failures:
+        print(f"❌ {failures} entry point(s) over budget or importing heavy dependencies")
+    else:
+        print("✅ All entry points start fast")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time budget check for CLI entry points")
+    parser.add_argument("--budget", type=float, default=2.0, help="진입점별 import 시간 상한 (초)")
+    parser.add_argument("--repeat", type=int, default=3, help="반복 측정 후 최솟값 사용 (파일 캐시 영향 제거)")
+    parser.add_argument("modules", nargs="*", help="점검할 진입점 (기본: 전체)")
+    args = parser.parse_args()
+    sys.exit(main(args.budget, args.repeat, args.modules))
@@ -1,25 +1,88 @@
-import tensorflow as tf
 import os
-import sys
-import glob
+import shutil
 import numpy as np
 import nibabel as nib
-import pydicom
 from scipy import ndimage
-from skimage.measure import label, regionprops
-from skimage.morphology import remove_small_objects
-from keras.utils import to_categorical
 
-# 모델 임포트 (경로 주의)
-import model.model_ver_contour as model
+# TensorFlow/Keras/skimage/모델은 실제로 필요한 시점에 import (--help, dry-run 등은 빠르게 시작)
+# 모델 로드는 load_engine (model/inference_engine.py) 에서 수행
+from model.fill_engine import FILL_MODES, fill_box, noise_level
+from prediction_cache import PredictionCache
+
+class MemmapCopy(object):
+    """
+    memmap_copy 결과. data에 쓰면 임시 복사본 파일이 직접 수정됨.
+    commit(): flush 후 dest_path로 rename (마스크 적용이 끝난 뒤에만 결과 이름이 생김)
+    discard(): 임시 복사본 삭제 (실패 시 원본과 같은 내용의 결과 파일이 남지 않도록)
+    """
+
+    def __init__(self, img, data, temp_path, dest_path):
+        self.img = img
+        self.data = data
+        self.temp_path = temp_path
+        self.dest_path = dest_path
+
+    def commit(self):
+        self.data.flush()
+        os.replace(self.temp_path, self.dest_path)
+
+    def discard(self):
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+
+def memmap_copy(src_path, dest_path):
+    """
+    비압축 .nii 를 임시 이름으로 그대로 복사하고, 복사본의 voxel 영역을 쓰기 가능한 memmap으로 엽니다.
+    반환: MemmapCopy (전체 배열을 메모리에 올리지 않음).
+    gzip 파일이거나 scl_slope/inter 스케일링이 있어 memmap이 불가능하면 None.
+    """
+    src_path, dest_path = str(src_path), str(dest_path)
+    if not (src_path.lower().endswith(".nii") and dest_path.lower().endswith(".nii")):
+        return None
+    img = nib.load(src_path, mmap="r")
+    if not isinstance(np.asanyarray(img.dataobj), np.memmap):
+        return None
+
+    # nib.load의 mmap 옵션에는 쓰기 모드(r+)가 없으므로 헤더 정보로 직접 memmap을 엶
+    temp_path = dest_path + ".tmp"
+    shutil.copyfile(src_path, temp_path)
+    try:
+        data = np.memmap(temp_path, mode="r+", dtype=img.get_data_dtype(), shape=img.shape,
+                         offset=int(img.dataobj.offset), order="F")
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return MemmapCopy(img, data, temp_path, dest_path)
 
-# [설정] TF 1.14 그래프 초기화
-try:
-    graph = tf.compat.v1.get_default_graph()
-except AttributeError:
-    graph = None
 
 class Defacer(object):
+    def __init__(self, engine="keras", intra_op_threads=0, inter_op_threads=0,
+                 cache_dir=None, cache_max_mb=1024, box_wth=1.3, shield_range=(0.3, 0.7),
+                 fill_mode="zero"):
+        # engine: "keras" | "frozen" | "frozen_fp16" | "frozen_int8" (model/inference_engine.py)
+        # engine=None 이면 모델을 로드하지 않음 (저장된 라벨맵으로 re-deface 할 때)
+        self.engine = None
+        if engine is not None:
+            from model.inference_engine import load_engine
+            self.engine = load_engine(engine, intra_op_threads, inter_op_threads)
+
+        # 후처리 파라미터: 박스 확장 배율, 뇌 내부 방어막 범위(비율)
+        self.box_wth = box_wth
+        self.shield_range = shield_range
+        # 박스 채우기 방식: "zero" | "noise" | "smooth" (model/fill_engine.py)
+        if fill_mode not in FILL_MODES:
+            raise ValueError(f"Unknown fill mode: {fill_mode} (choices: {', '.join(FILL_MODES)})")
+        self.fill_mode = fill_mode
+
+        # cache_dir 지정 시 같은 추론 입력은 predict 없이 캐시된 라벨맵 사용
+        self.cache = None
+        if cache_dir is not None and self.engine is not None:
+            self.cache = PredictionCache(cache_dir, self.engine.identity,
+                                         max_bytes=int(cache_max_mb * 1024 * 1024))
+
     def onehot2label(self, onehot_array):
         onehot_array = np.argmax(onehot_array, axis=-1)
         label = onehot_array[..., np.newaxis]
@@ -30,7 +93,20 @@ class Defacer(object):
         data = ndimage.zoom(data, resize_factor, order=0, mode='constant', cval=0.0)
         return data
 
+    def sample_resize(self, data, img_dep=128, img_cols=128, img_rows=128):
+        """
+        resize(order=0)와 같은 nearest-neighbor 격자의 voxel만 골라 128^3 배열을 만듭니다.
+        data가 memmap(또는 그 view)이면 필요한 voxel만 읽힙니다.
+        """
+        size = (img_dep, img_cols, img_rows)
+        index = [np.floor(np.arange(n) * ((s - 1) / float(n - 1)) + 0.5).astype(np.intp)
+                 for n, s in zip(size, data.shape)]
+        return np.ascontiguousarray(data[np.ix_(*index)])
+
     def bounding_box(self, results):
+        from skimage.measure import label, regionprops
+        from skimage.morphology import remove_small_objects
+
         boxes = list()
         # results shape: (depth, height, width, channels)
         # channels: 0(배경), 1(눈), 2(코), 3(귀), 4(입)
@@ -56,14 +132,6 @@ class Defacer(object):
                 
         return boxes
 
-    def _cast_to_original_dtype(self, data, dtype):
-        if np.issubdtype(dtype, np.integer):
-            info = np.iinfo(dtype)
-            data = np.rint(data)
-            data = np.clip(data, info.min, info.max)
-            return data.astype(dtype)
-        return data.astype(dtype)
-
     # def box_blur(self, im_array, box, wth=1):
     #     # 박스 크기를 wth 배 만큼 확장
     #     if wth != 1:
@@ -77,25 +145,29 @@ class Defacer(object):
     #     im_array[box[0]:box[3], box[1]:box[4], box[2]:box[5]] = 0
     #     return im_array
 
-    def box_blur(self, im_array, box, wth=1):
+    def is_brain_interior(self, shape, box):
         # 🛡️ [핵심 방어막] 뇌 내부 오작동 감지 로직 🛡️
-        z_max, y_max, x_max = im_array.shape
-        
+        z_max, y_max, x_max = shape
+
         # AI가 찾은 '얼굴 추정' 박스의 중심 좌표 계산
         center_z = (box[0] + box[3]) / 2
         center_y = (box[1] + box[4]) / 2
         center_x = (box[2] + box[5]) / 2
-        
-        # 중심 좌표가 전체 이미지의 핵심 뇌 영역(30% ~ 70% 깊이)에 있는지 확인
+
+        # 중심 좌표가 전체 이미지의 핵심 뇌 영역(기본 30% ~ 70% 깊이)에 있는지 확인
+        lo, hi = self.shield_range
         is_deep_inside = (
-            (0.3 * z_max < center_z < 0.7 * z_max) and 
-            (0.3 * y_max < center_y < 0.7 * y_max) and 
-            (0.3 * x_max < center_x < 0.7 * x_max)
+            (lo * z_max < center_z < hi * z_max) and 
+            (lo * y_max < center_y < hi * y_max) and 
+            (lo * x_max < center_x < hi * x_max)
         )
-        
-        # 뇌 정중앙이라면 AI의 헛것(오작동)이므로 지우지 않고 원본 그대로 살려줌
         if is_deep_inside:
             print(f"      🛡️ [Shield] 뇌 내부 오류 감지! 머리 빵꾸를 막기 위해 무시합니다. (Center: {int(center_z)}, {int(center_y)}, {int(center_x)})")
+        return is_deep_inside
+
+    def box_blur(self, im_array, box, wth=1, shield=True, fill_mode="zero", noise_scale=None):
+        # 뇌 정중앙이라면 AI의 헛것(오작동)이므로 지우지 않고 원본 그대로 살려줌
+        if shield and self.is_brain_interior(im_array.shape, box):
             return im_array
 
         # --- 아래는 정상적인 얼굴 위치일 때만 실행되는 블러링 로직 ---
@@ -106,12 +178,19 @@ class Defacer(object):
                 box[c] = int(max(0, mean_ - half_len))
                 box[c+3] = int(min(im_array.shape[c], mean_ + half_len))
 
-        # 해당 영역을 0으로 채움 (확실한 익명화)
-        im_array[box[0]:box[3], box[1]:box[4], box[2]:box[5]] = 0
+        # 해당 영역을 0으로 채움 (확실한 익명화), fill_mode에 따라 노이즈/평활 값으로 채움
+        # im_array가 view여도 원본 배열에 그대로 반영됨
+        if fill_mode == "zero":
+            im_array[box[0]:box[3], box[1]:box[4], box[2]:box[5]] = 0
+        else:
+            fill_box(im_array, box, fill_mode, noise_scale=noise_scale)
         return im_array
     
 
     def label_denoising(self, results):
+        from skimage.measure import label, regionprops
+        from skimage.morphology import remove_small_objects
+
         # 결과 맵 정제 (노이즈 제거)
         for ch in range(1, results.shape[-1]):
             result = np.round(results[..., ch])
@@ -134,94 +213,129 @@ class Defacer(object):
     # =========================================================================
     # [핵심 수정 2] 메인 실행 함수 (NIfTI 전용 + 디버깅 강화)
     # =========================================================================
-    def Deidentification_image_nii(self, where, nfti_path, dest_path, prefix="defaced", Model=model):
-        config = {"resizing": True, "input_shape": [128, 128, 128, 1]}
+    def predict_labels(self, array_img_transposed):
+        """(Z, Y, X) 배열을 128^3으로 줄여 추론하고 128^3 라벨맵(uint8)을 반환"""
+        if self.engine is None:
+            raise RuntimeError("No inference engine loaded (Defacer(engine=None)); a saved label map is required")
+        array_img_re = self.resize(array_img_transposed)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(array_img_re)
+            labels = self.cache.get(cache_key)
+            if labels is not None:
+                print("      ♻️ [Cache] Prediction reused")
+                return labels
+
+        array_img_input = np.reshape(array_img_re, (1, 128, 128, 128, 1))
+
+        results = self.engine.predict(array_img_input)
+        results = np.round(results)
+
+        results = self.onehot2label(results)
+        labels = np.reshape(results, (128, 128, 128)).astype(np.uint8)
+
+        if cache_key is not None:
+            self.cache.put(cache_key, labels)
+        return labels
+
+    def boxes_from_labels(self, labels, shape):
+        """128^3 라벨맵을 (Z, Y, X) shape으로 복원한 뒤 얼굴 부위 박스를 추출"""
+        # 원본 크기로 복원 (순서 주의: Z, Y, X)
+        results = ndimage.zoom(labels,
+                               (shape[0]/128, shape[1]/128, shape[2]/128),
+                               order=0, mode='nearest')
+
+        # # ★ [중요] 디버깅용 마스크 저장 (확인용)
+        # # 이 파일이 생성되면 ITK-SNAP에서 원본 위에 얹어보세요.
+        # # 모델이 어디를 눈/코/입으로 인식했는지 바로 알 수 있습니다.
+        # debug_mask = results.transpose(2, 1, 0) # 저장 위해 다시 (X,Y,Z)로 복구
+        # debug_path = os.path.join(verif_path, f"MASK_{os.path.basename(nfti_path)}")
+        # nib.save(nib.Nifti1Image(debug_mask.astype('int16'), raw_img.affine), debug_path)
+        # print(f"      💾 [Debug] Mask saved to: {os.path.basename(debug_path)}")
+
+        from keras.utils import to_categorical
+        results = to_categorical(results, num_classes=5)
+
+        # 박스 추출 (Transposed 상태에서 진행)
+        results = self.label_denoising(results)
+        # class index: 0=bg, 1=eyes, 2=nose, 3=ears, 4=mouth
+        # 귀 박스 제거로 인한 뇌 영역 손상 방지를 위해 ears 채널은 비활성화
+        results[..., 3] = 0
+        return self.bounding_box(results[..., 1:])
+
+    def deface_array(self, array_img, where=(1, 1, 1, 1), labels=None):
+        """
+        (X, Y, Z) 배열의 얼굴 영역을 in-place로 0으로 채웁니다.
+        array_img는 원본 배열의 strided view여도 되며, 이 경우 원본 배열이 직접 수정됩니다.
+        labels(predict_labels 결과, 128^3)가 주어지면 추론 없이 후처리만 수행합니다.
+        실제로 지운 박스들을 array_img 기준 (x0, y0, z0, x1, y1, z1) 좌표로 반환합니다.
+        """
+        # [중요] 축 변환: (X, Y, Z) -> (Z, Y, X)
+        # 모델이 학습된 방향으로 데이터 회전 (복사 없는 view)
+        array_img_transposed = array_img.transpose(2, 1, 0)
+
+        if labels is None:
+            labels = self.predict_labels(array_img_transposed)
+        boxes = self.boxes_from_labels(labels, array_img_transposed.shape)
+
+        print(f"      👀 Detected Features: {len(boxes)} boxes found.")
+
+        # [핵심 수정 3] 안전한 블러링 (인덱스 초과 에러 방지)
+        # *참고: 위 bounding_box 함수는 채널 0(눈) -> 1(코) -> 2(귀) -> 3(입) 순서로 돕니다.*
+        # 모든 박스를 살짝 확장해서 지웁니다 (얼굴 부위이므로).
+        noise_scale = None
+        if self.fill_mode == "noise":
+            noise_scale = noise_level(array_img_transposed)
+
+        applied = []
+        if where[0]:
+            for b in boxes:
+                if self.is_brain_interior(array_img_transposed.shape, b):
+                    continue
+                self.box_blur(array_img_transposed, b, wth=self.box_wth, shield=False,
+                              fill_mode=self.fill_mode, noise_scale=noise_scale)
+                # (Z, Y, X) 박스를 (X, Y, Z) 기준으로 변환
+                applied.append([b[2], b[1], b[0], b[5], b[4], b[3]])
+
+        return applied
+
+    def Deidentification_image_nii(self, where, nfti_path, dest_path, prefix="defaced", Model=None,
+                                   out_of_core=False):
         if "{}" not in prefix: prefix += "_{}"
 
         try:
             print(f"   🔎 [Processing] Reading: {os.path.basename(nfti_path)}")
-            
-            # 1. 파일 로드
             os.makedirs(dest_path, exist_ok=True)
+            save_name = prefix.format(os.path.basename(nfti_path))
+            save_path = os.path.join(dest_path, save_name)
+
+            # out_of_core: 비압축 .nii 는 복사본을 memmap으로 열어 박스 영역만 덮어씀
+            patch = memmap_copy(nfti_path, save_path) if out_of_core else None
+            if patch is not None:
+                try:
+                    array_img = patch.data
+                    labels = self.predict_labels(self.sample_resize(array_img.transpose(2, 1, 0)))
+                    boxes = self.deface_array(array_img, where, labels=labels)
+                    patch.commit()
+                except BaseException:
+                    patch.discard()
+                    raise
+                return {"success": True, "path": save_path, "boxes": boxes}
+
+            # 1. 파일 로드 (원본 dtype 그대로, float64 사본 없이)
             raw_img = nib.load(nfti_path)
-            array_img = raw_img.get_fdata()
-            original_dtype = np.asanyarray(raw_img.dataobj).dtype
-            original_shape = array_img.shape
-            
-            # [중요] 축 변환: (X, Y, Z) -> (Z, Y, X)
-            # 모델이 학습된 방향으로 데이터 회전
-            array_img_transposed = array_img.transpose(2, 1, 0)
-            
-            # 2. 전처리
-            array_img_re = self.resize(array_img_transposed)
-            array_img_input = np.reshape(array_img_re, (1, 128, 128, 128, 1))
-
-            # 3. 모델 추론 (Inference)
-            if graph is not None:
-                with graph.as_default():
-                    results = model.model.predict(array_img_input)
-            else:
-                results = model.model.predict(array_img_input)
-            results = np.round(results)
-
-            # 4. 후처리 및 복원
-            if config["resizing"]:
-                results = self.onehot2label(results)
-                results = np.reshape(results, (128, 128, 128))
-                
-                # 원본 크기로 복원 (순서 주의: Z, Y, X)
-                results = ndimage.zoom(results, 
-                                     (original_shape[2]/128, original_shape[1]/128, original_shape[0]/128), 
-                                     order=0, mode='nearest')
-                
-                # # ★ [중요] 디버깅용 마스크 저장 (확인용)
-                # # 이 파일이 생성되면 ITK-SNAP에서 원본 위에 얹어보세요.
-                # # 모델이 어디를 눈/코/입으로 인식했는지 바로 알 수 있습니다.
-                # debug_mask = results.transpose(2, 1, 0) # 저장 위해 다시 (X,Y,Z)로 복구
-                # debug_path = os.path.join(verif_path, f"MASK_{os.path.basename(nfti_path)}")
-                # nib.save(nib.Nifti1Image(debug_mask.astype('int16'), raw_img.affine), debug_path)
-                # print(f"      💾 [Debug] Mask saved to: {os.path.basename(debug_path)}")
-
-                results = to_categorical(results, num_classes=5)
-            else:
-                results = results[0, ...]
-
-            # 5. 박스 추출 및 블러링 (Transposed 상태에서 진행)
-            results = self.label_denoising(results)
-            # class index: 0=bg, 1=eyes, 2=nose, 3=ears, 4=mouth
-            # 귀 박스 제거로 인한 뇌 영역 손상 방지를 위해 ears 채널은 비활성화
-            results[..., 3] = 0
-            boxes = self.bounding_box(results[..., 1:])
-            
-            print(f"      👀 Detected Features: {len(boxes)} boxes found.")
+            array_img = np.asanyarray(raw_img.dataobj)
+            if not array_img.flags.writeable:
+                array_img = array_img.copy()
 
-            # [핵심 수정 3] 안전한 블러링 (인덱스 초과 에러 방지)
-            # 순서: 눈(Label 1) -> 코(Label 2) -> 귀(Label 3) -> 입(Label 4)
-            # boxes 리스트에 담기는 순서는 bounding_box 함수 로직에 따라 [눈, 눈, 코, 귀, 귀, 입] 순서일 가능성이 높음
-            # 하지만 안전하게 하기 위해, 단순히 박스가 존재하면 앞에서부터 순차적으로 적용하거나
-            # 채널별로 박스를 구하는 것이 더 안전함. 여기서는 간단히 수정된 bounding_box 로직을 따름.
-            
-            # *참고: 위 bounding_box 함수는 채널 0(눈) -> 2(귀) -> 1(코) -> 3(입) 순서로 돕니다 (defacer 원본 로직)*
-            # 따라서 boxes 리스트 순서는 [눈..., 귀..., 코..., 입...] 순서입니다.
-            
-            # 눈 (Eyes)
-            if where[0]:
-                for b in boxes:
-                    # 크기나 위치로 대략 눈인지 판단하거나, 모든 박스를 다 지워도 무방함 (얼굴 부위이므로)
-                    # 여기서는 안전하게 모델이 찾은 '모든' 박스를 살짝 확장해서 지웁니다.
-                    array_img_transposed = self.box_blur(array_img_transposed, b, wth=1.3)
-
-            # 6. 최종 저장 (축 복구)
-            # (Z, Y, X) -> (X, Y, Z)
-            array_img_final = array_img_transposed.transpose(2, 1, 0)
-            array_img_final = self._cast_to_original_dtype(array_img_final, original_dtype)
+            # 2. 추론 및 얼굴 영역 제거 (in-place)
+            boxes = self.deface_array(array_img, where)
 
-            save_name = prefix.format(os.path.basename(nfti_path))
-            save_path = os.path.join(dest_path, save_name)
-            
-            nib.save(nib.Nifti1Image(array_img_final, raw_img.affine, raw_img.header), save_path)
+            # 3. 최종 저장
+            nib.save(nib.Nifti1Image(array_img, raw_img.affine, raw_img.header), save_path)
 
-            return {"success": True, "path": save_path}
+            return {"success": True, "path": save_path, "boxes": boxes}
 
         except Exception as ex:
             import traceback
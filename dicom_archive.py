@@ -0,0 +1,113 @@
+"""
+PACS export 압축 파일(zip / tar / tar.gz 등)을 풀지 않고 안의 DICOM을 직접 읽기 위한 helper.
+
+- 환자(archive) 하나당 한 번만 열고, 멤버 목록도 한 번만 만듦
+- 헤더 스캔은 멤버마다 pixel data 직전까지만 읽고 내용은 보관하지 않음
+- tar 계열: 항상 앞으로만 읽음 (헤더 스캔 1회 + 변환할 멤버 읽기 1회, 시리즈 수와 무관)
+  (getmembers()는 전체 압축을 한 번 풀고, 이후 앞쪽 멤버를 열면 처음부터 다시 풀어야 하므로 사용하지 않음)
+- zip: 멤버별로 바로 열 수 있으므로 변환할 시리즈의 멤버만 시리즈 단위로 읽음
+- 디스크에 압축을 풀거나 임시 파일로 복사하지 않음
+"""
+
+import tarfile
+import zipfile
+from pathlib import Path
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(path):
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def archive_stem(path):
+    """SA00013.tar.gz -> SA00013 (환자 ID로 사용)"""
+    name = Path(path).name
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+class DicomArchive(object):
+    """zip/tar 멤버 목록 + 멤버 스트림 열기 (with 문으로 사용)"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._order = None      # 일반 파일 멤버 이름 (archive 순서), tar는 한 번 다 훑은 뒤 채워짐
+        self._members = {}
+        if str(self.path).lower().endswith(".zip"):
+            self._zip = zipfile.ZipFile(str(self.path))
+            self._tar = None
+            infos = [i for i in self._zip.infolist() if not i.is_dir()]
+            self._members = {i.filename: i for i in infos}
+            self._order = [i.filename for i in infos]
+        else:
+            self._zip = None
+            self._tar = tarfile.open(str(self.path), "r:*")
+
+    @property
+    def sequential(self):
+        """True: 멤버를 archive 순서로 한 번만 읽어야 함 (tar)"""
+        return self._tar is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def _infos(self):
+        """멤버 정보를 archive 순서로. tar는 처음 한 번은 앞에서부터 헤더를 읽어 가며 목록을 만듦"""
+        if self._order is not None:
+            for name in self._order:
+                yield self._members[name]
+            return
+        order = []
+        for m in self._tar:
+            if m.isfile():
+                self._members[m.name] = m
+                order.append(m.name)
+                yield m
+        self._order = order
+
+    def names(self):
+        """일반 파일 멤버 이름 (archive 순서)"""
+        if self._order is None:
+            for _ in self._infos():
+                pass
+        return list(self._order)
+
+    def size(self, name):
+        m = self._members[name]
+        return m.file_size if self._zip is not None else m.size
+
+    def _open(self, info):
+        if self._zip is not None:
+            return self._zip.open(info)
+        return self._tar.extractfile(info)
+
+    def open(self, name):
+        """멤버 스트림 (필요한 만큼만 읽힘). tar에서 앞쪽 멤버를 다시 열면 압축을 처음부터 다시 풂"""
+        self.names()
+        return self._open(self._members[name])
+
+    def iter_open(self, names=None):
+        """(name, 스트림)을 archive 순서로 (tar는 앞으로만 읽음)"""
+        wanted = None if names is None else set(names)
+        for info in self._infos():
+            name = info.filename if self._zip is not None else info.name
+            if wanted is not None and name not in wanted:
+                continue
+            fp = self._open(info)
+            try:
+                yield name, fp
+            finally:
+                fp.close()
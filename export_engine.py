@@ -0,0 +1,111 @@
+"""
+python export_engine.py export --precision fp32
+python export_engine.py export --precision fp16
+python export_engine.py check --engine frozen_fp16 --input ./processed/3d_input --max-files 20
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import nibabel as nib
+
+from model.inference_engine import ENGINE_PATHS, export_frozen_graph
+
+
+def box_iou(a, b):
+    inter = 1
+    for c in range(3):
+        lo = max(a[c], b[c])
+        hi = min(a[c + 3], b[c + 3])
+        if hi <= lo:
+            return 0.0
+        inter *= hi - lo
+    vol_a = np.prod([a[c + 3] - a[c] for c in range(3)])
+    vol_b = np.prod([b[c + 3] - b[c] for c in range(3)])
+    return inter / float(vol_a + vol_b - inter)
+
+
+def match_boxes(ref_boxes, cand_boxes):
+    """기준 박스마다 가장 많이 겹치는 후보 박스의 IoU (개수가 다르면 None)"""
+    if len(ref_boxes) != len(cand_boxes):
+        return None
+    if not ref_boxes:
+        return 1.0
+    return min(max(box_iou(r, c) for c in cand_boxes) for r in ref_boxes)
+
+
+def predict_boxes(defacer, nifti_file):
+    from run_defacer import canonical_view
+
+    img = nib.load(str(nifti_file))
+    data, _ = canonical_view(np.asanyarray(img.dataobj), img.affine)
+    data_zyx = data.transpose(2, 1, 0)
+
+    start = time.time()
+    labels = defacer.predict_labels(data_zyx)
+    elapsed = time.time() - start
+    return defacer.boxes_from_labels(labels, data_zyx.shape), elapsed
+
+
+def check_engine(engine, input_dir, max_files, min_iou):
+    from defacer import Defacer
+    from run_defacer import list_nifti_files
+
+    files = list_nifti_files(Path(input_dir))[:max_files]
+    if not files:
+        print("❌ No NIfTI files found in input.")
+        return False
+
+    print(f"🔬 Accuracy gate: keras vs {engine} ({len(files)} files, IoU >= {min_iou})")
+    baseline = Defacer(engine="keras")
+    candidate = Defacer(engine=engine)
+
+    passed = True
+    ref_time, cand_time = 0.0, 0.0
+    for f in files:
+        ref_boxes, t_ref = predict_boxes(baseline, f)
+        cand_boxes, t_cand = predict_boxes(candidate, f)
+        ref_time += t_ref
+        cand_time += t_cand
+
+        iou = match_boxes(ref_boxes, cand_boxes)
+        if iou is None:
+            print(f"   ❌ {f.name}: box count {len(ref_boxes)} -> {len(cand_boxes)}")
+            passed = False
+        elif iou < min_iou:
+            print(f"   ❌ {f.name}: min IoU {iou:.3f}")
+            passed = False
+        else:
+            print(f"   ✅ {f.name}: min IoU {iou:.3f}")
+
+    print(f"   ⏱️ predict: keras {ref_time / len(files):.2f}s/file, {engine} {cand_time / len(files):.2f}s/file")
+    print("🎉 PASS" if passed else "❌ FAIL")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Contour U-Net inference engine export / accuracy gate")
+    sub = parser.add_subparsers(dest="command")
+
+    p_export = sub.add_parser("export", help="model_contour4.h5 -> frozen graph")
+    p_export.add_argument("--precision", choices=["fp32", "fp16", "int8"], default="fp32")
+    p_export.add_argument("--output", default=None, help="저장 경로 (기본: model/model_contour4[_fp16|_int8].pb)")
+
+    p_check = sub.add_parser("check", help="engine 박스 결과를 keras 기준과 비교")
+    p_check.add_argument("--engine", choices=list(ENGINE_PATHS), required=True)
+    p_check.add_argument("--input", required=True, help="Path to NIfTI files")
+    p_check.add_argument("--max-files", type=int, default=20)
+    p_check.add_argument("--min-iou", type=float, default=0.9)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        path = export_frozen_graph(args.precision, args.output)
+        print(f"💾 Exported: {path}")
+    elif args.command == "check":
+        ok = check_engine(args.engine, args.input, args.max_files, args.min_iou)
+        sys.exit(0 if ok else 1)
+    else:
+        parser.print_help()
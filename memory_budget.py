@@ -0,0 +1,122 @@
+"""
+NIfTI 헤더만 읽어 defacing 작업의 최대 메모리 사용량을 추정하고,
+추정치 합이 RAM 예산을 넘지 않는 범위에서만 병렬 작업을 시작시키는 스케줄러.
+"""
+
+import os
+import threading
+
+import numpy as np
+import nibabel as nib
+
+# voxel 당 추가 바이트 (원본 dtype 배열 자체는 별도로 더함)
+# DL: 원본 크기 라벨맵(uint8) + to_categorical(float32 x 5) + label_denoising 중간 배열(float32, int64 라벨, 복사본)
+DL_BYTES_PER_VOXEL = 1 + 20 + 4 + 8 + 8
+# Mask: 원본 dtype 배열(itemsize, 별도로 더함) 외 voxel 당 추가 배열 없음
+MASK_BYTES_PER_VOXEL = 0
+# Mask (공간 voxel 당): resample된 마스크(float64) + bool 마스크
+MASK_BYTES_PER_SPATIAL_VOXEL = 8 + 1
+# 4D 이상 마스크 적용은 볼륨 단위 스트리밍: 볼륨 크기 버퍼 하나를 읽고 그 자리에서 수정해 씀 (원본 dtype, timepoint 수와 무관)
+STREAM_VOLUMES = 1
+
+
+def header_info(nifti_file):
+    """voxel 데이터는 읽지 않고 (shape, dtype, 메모리상 itemsize) 반환"""
+    img = nib.load(str(nifti_file))
+    dtype = np.dtype(img.get_data_dtype())
+    itemsize = dtype.itemsize
+    # scl_slope/inter가 있으면 dataobj는 float로 올라옴
+    slope = getattr(img.dataobj, "slope", 1.0)
+    inter = getattr(img.dataobj, "inter", 0.0)
+    if slope != 1.0 or inter != 0.0:
+        itemsize = max(itemsize, 8)
+    return img.shape, dtype, itemsize
+
+
+def estimate_file_bytes(nifti_file, stage="dl"):
+    """헤더를 읽을 수 없는 파일(손상 등)은 0: 실제 처리 단계에서 오류로 기록됨"""
+    try:
+        shape, dtype, itemsize = header_info(nifti_file)
+    except Exception:
+        return 0
+    voxels = int(np.prod(shape))
+    spatial = int(np.prod(shape[:3]))
+    if stage == "dl":
+        return voxels * itemsize + spatial * DL_BYTES_PER_VOXEL
+    if len(shape) > 3:
+        # raw 값을 그대로 옮기므로 scl_slope가 있어도 원본 dtype 크기
+        return spatial * (STREAM_VOLUMES * np.dtype(dtype).itemsize + MASK_BYTES_PER_SPATIAL_VOXEL)
+    # 마스크 적용은 원본 dtype 배열 하나에서 바로 수정
+    return voxels * (itemsize + MASK_BYTES_PER_VOXEL) + spatial * MASK_BYTES_PER_SPATIAL_VOXEL
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # /proc 가 없으면 (macOS 등) 최대 RSS로 대체
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+class RssMonitor(object):
+    """백그라운드에서 RSS를 주기적으로 샘플링해 구간별 최댓값을 기록"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="rss-monitor", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            with self._lock:
+                self.peak = max(self.peak, rss)
+                for key in self._windows:
+                    self._windows[key][1] = max(self._windows[key][1], rss)
+
+    def begin(self, key):
+        rss = current_rss()
+        with self._lock:
+            self._windows[key] = [rss, rss]
+
+    def end(self, key):
+        """구간 시작 시점 대비 최대 RSS 증가량"""
+        with self._lock:
+            start, peak = self._windows.pop(key)
+        return max(peak, current_rss()) - start
+
+    def stop(self):
+        self._stop.set()
+
+
+class MemoryScheduler(object):
+    """추정 메모리 합이 budget 이하일 때만 작업을 시작 (예산보다 큰 작업은 혼자 실행)"""
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.in_use = 0
+        self.peak_admitted = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, need):
+        with self._cond:
+            while self.in_use > 0 and self.in_use + need > self.budget:
+                self._cond.wait()
+            self.in_use += need
+            self.peak_admitted = max(self.peak_admitted, self.in_use)
+
+    def release(self, need):
+        with self._cond:
+            self.in_use -= need
+            self._cond.notify_all()
+
+
+def fmt_bytes(n):
+    return f"{n / float(1 << 30):.2f} GB" if abs(n) >= 1 << 30 else f"{n / float(1 << 20):.0f} MB"
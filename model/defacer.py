@@ -1,4 +1,3 @@
-import tensorflow as tf
 import os
 import sys
 import glob
@@ -16,32 +15,47 @@ from skimage import morphology
 from skimage import measure
 from skimage.measure import label, regionprops
 from skimage.morphology import remove_small_objects
-import matplotlib.pyplot as plt
-from matplotlib import colors
-from keras.utils import to_categorical
 from skimage.filters import threshold_triangle
 
-import model.model_ver_contour as model
+from model.fill_engine import expand_box, fill_label
+from model.qc_thumbnails import default_writer, label_view_slices, overlay
 
-gpus = tf.config.experimental.list_physical_devices('GPU')
-if gpus:
-  # Restrict TensorFlow to only allocate 1GB of memory on the first GPU
-  try:
-    tf.config.experimental.set_virtual_device_configuration(
-        gpus[0],
-        [tf.config.experimental.VirtualDeviceConfiguration(memory_limit=1024)])
-    logical_gpus = tf.config.experimental.list_logical_devices('GPU')
-    print(len(gpus), "Physical GPUs,", len(logical_gpus), "Logical GPUs")
-  except RuntimeError as e:
-    # Virtual devices must be set before GPUs have been initialized
-    print(e)
+_contour = None
+_graph = None
 
 
-graph = tf.get_default_graph()
+def load_contour_model():
+    """TensorFlow/Keras 와 contour 모델은 첫 추론 시점에 로드 (import만 할 때는 로드하지 않음)"""
+    global _contour, _graph
+    if _contour is not None:
+        return _contour, _graph
+
+    import tensorflow as tf
+
+    gpus = tf.config.experimental.list_physical_devices('GPU')
+    if gpus:
+      # Restrict TensorFlow to only allocate 1GB of memory on the first GPU
+      try:
+        tf.config.experimental.set_virtual_device_configuration(
+            gpus[0],
+            [tf.config.experimental.VirtualDeviceConfiguration(memory_limit=1024)])
+        logical_gpus = tf.config.experimental.list_logical_devices('GPU')
+        print(len(gpus), "Physical GPUs,", len(logical_gpus), "Logical GPUs")
+      except RuntimeError as e:
+        # Virtual devices must be set before GPUs have been initialized
+        print(e)
+
+    import model.model_ver_contour as contour
+    contour.model  # 기본 graph에 가중치 로드
+    _contour, _graph = contour, tf.get_default_graph()
+    return _contour, _graph
 
 
 class Defacer(object):
 
+    # fill mode per label: "zero" | "noise" | "smooth" (model/fill_engine.py)
+    DEFAULT_FILL_MODES = {"eyes": "smooth", "ears": "noise", "mouth": "smooth"}
+
     # onehot results -> argmax
     def onehot2label(self, onehot_array):
         onehot_array = np.argmax(onehot_array, axis=-1)
@@ -154,218 +168,20 @@ class Defacer(object):
     
 
     def dicom_view_label (self, image, labels, boxes, axial_plane, save_path, file_name):
-        boxes =np.array(boxes)
-        centers = (boxes[:,0:3]+boxes[:,3:6])/2 #centers of nose, right ear, left ear
-        
-        pred = np.argmax(labels,axis=-1)
-        
-        ones = np.ones(image.shape)
-        for i in range(len(boxes)):
-            ones = self.box_blur(ones, boxes[i])
-        
-        ones = 1-ones
-        pred = pred*ones
-        
-        cmap = colors.ListedColormap(['None', 'red', 'purple', 'blue', 'yellow', 'green']) #rigt eye 1, left eye 2, nose 3, right ear 4, left ear5
-        bounds=[0,1,2,3,4,5,6]
-        norm = colors.BoundaryNorm(bounds, cmap.N)
-        
-        if axial_plane == 0:
-
-            plt.figure(figsize=(15,10))
-            plt.subplot(2,2,1)
-            slice_num = int((centers[0][axial_plane]+centers[1][axial_plane])/2)
-            plt.title('predicted eyes: axial = {}'.format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,2)
-            slice_num = int(centers[2][axial_plane])
-            plt.title('predicted nose: axial = {}'.format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,3)
-            slice_num = int((centers[3][axial_plane]+centers[4][axial_plane])/2)
-            plt.title('predicted ears: axial = {}' .format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,4)
-            slice_num = int(centers[5][axial_plane])
-            plt.title('predicted mouth: axial = {}'.format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-        elif axial_plane == 1:
-
-            plt.figure(figsize=(15,10))
-
-            plt.subplot(2,2,1)
-            slice_num = int((centers[0][axial_plane]+centers[1][axial_plane])/2)
-            plt.title('predicted eyes: axial = {}'.format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,2)
-            slice_num = int(centers[2][axial_plane])
-            plt.title('predicted nose: axial = {}'.format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,3)
-            slice_num = int((centers[3][axial_plane]+centers[4][axial_plane])/2)
-            plt.title('predicted ears: axial = {}' .format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,4)
-            slice_num = int((centers[5][axial_plane]))
-            plt.title('predicted mouth: axial = {}' .format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-
-
-        elif axial_plane == 2:
-
-            plt.figure(figsize=(15,10))
-
-            plt.subplot(2,2,1)
-            slice_num = int((centers[0][axial_plane]+centers[1][axial_plane])/2)
-            plt.title('predicted eyes: axial = {}'.format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,2)
-            slice_num = int(centers[2][axial_plane])
-            plt.title('predicted nose: axial = {}'.format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,3)
-            slice_num = int((centers[3][axial_plane]+centers[4][axial_plane])/2)
-            plt.title('predicted ears: axial = {}' .format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,4)
-            slice_num = int(centers[5][axial_plane])
-            plt.title('predicted mouth: axial = {}'.format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-    
+        # contact sheet (eyes, nose / ears, mouth) rendered from the arrays on a background thread
         pic_name = os.path.join(save_path,'label_{}.png'.format(os.path.getctime(file_name)))
-        plt.savefig(pic_name, bbox_inches='tight')
-        plt.close('all')
+        slices = label_view_slices(image, labels, boxes, axial_plane)
+        default_writer().submit(pic_name, lambda: [overlay(i, l) for i, l in slices], ncols=2)
 
     # take a pic for users to check areas that this tool has found
     def nifti_view_label (self, image,labels,boxes,path,file_name): 
-        pred = np.argmax(labels,axis=-1)
-        
         boxes =np.array(boxes)
         centers = (boxes[:,0:3]+boxes[:,3:6])/2 #centers of nose, right ear, left ear
         axial_plane = np.argmin(np.var(centers[2:5],axis=0)) # 코와 귀 2개 좌표만 뽑아서 가장 분산이 작은 축을 구함 = axial 축일것이라 예상됨.
-        
-        ones = np.ones(image.shape)
-        for i in range(len(boxes)):
-            ones = self.box_blur(ones,boxes[i])
-        
-        ones = 1-ones
-        pred = pred*ones
-        
-        
-        
-        cmap = colors.ListedColormap(['None', 'red', 'purple', 'blue', 'yellow', 'green']) #rigt eye 1, left eye 2, nose 3, right ear 4, left ear5
-        bounds=[0,1,2,3,4,5,6]
-        norm = colors.BoundaryNorm(bounds, cmap.N)
-        
-        if axial_plane == 0:
-
-            plt.figure(figsize=(15,10))
-
-            plt.subplot(2,2,1)
-            slice_num = int((centers[0][axial_plane]+centers[1][axial_plane])/2)
-            plt.title('predicted eyes: axial = {}'.format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,2)
-            slice_num = int(centers[2][axial_plane])
-            plt.title('predicted nose: axial = {}'.format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,3)
-            slice_num = int((centers[3][axial_plane]+centers[4][axial_plane])/2)
-            plt.title('predicted ears: axial = {}' .format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,4)
-            slice_num = int(centers[5][axial_plane])
-            plt.title('predicted mouth: axial = {}'.format(slice_num))
-            plt.imshow(image[slice_num,:,:],cmap='gray')
-            plt.imshow(pred[slice_num,:,:],alpha=0.5,cmap=cmap, norm=norm)
-
-        elif axial_plane == 1:
-
-            plt.figure(figsize=(15,10))
-
-            plt.subplot(2,2,1)
-            slice_num = int((centers[0][axial_plane]+centers[1][axial_plane])/2)
-            plt.title('predicted eyes: axial = {}'.format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,2)
-            slice_num = int(centers[2][axial_plane])
-            plt.title('predicted nose: axial = {}'.format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,3)
-            slice_num = int((centers[3][axial_plane]+centers[4][axial_plane])/2)
-            plt.title('predicted ears: axial = {}' .format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,4)
-            slice_num = int((centers[5][axial_plane]))
-            plt.title('predicted mouth: axial = {}' .format(slice_num))
-            plt.imshow(image[:,slice_num,:],cmap='gray')
-            plt.imshow(pred[:,slice_num,:],alpha=0.5,cmap=cmap, norm=norm)
-	        
-        elif axial_plane == 2:
-
-            plt.figure(figsize=(15,10))
-
-            plt.subplot(2,2,1)
-            slice_num = int((centers[0][axial_plane]+centers[1][axial_plane])/2)
-            plt.title('predicted eyes: axial = {}'.format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,2)
-            slice_num = int(centers[2][axial_plane])
-            plt.title('predicted nose: axial = {}'.format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,3)
-            slice_num = int((centers[3][axial_plane]+centers[4][axial_plane])/2)
-            plt.title('predicted ears: axial = {}' .format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-
-            plt.subplot(2,2,4)
-            slice_num = int(centers[5][axial_plane])
-            plt.title('predicted mouth: axial = {}'.format(slice_num))
-            plt.imshow(image[:,:,slice_num],cmap='gray')
-            plt.imshow(pred[:,:,slice_num],alpha=0.5,cmap=cmap, norm=norm)
-    
+
         pic_name = os.path.join(path,'label_{}.png'.format(os.path.basename(file_name)))
-        plt.savefig(pic_name, bbox_inches='tight')
-        plt.close('all')
+        slices = label_view_slices(image, labels, boxes, axial_plane)
+        default_writer().submit(pic_name, lambda: [overlay(i, l) for i, l in slices], ncols=2)
 
         
 
@@ -439,7 +255,7 @@ class Defacer(object):
 
 
     # where_do_you_want_to_blur? ex) where = (1,1,1,1) -> blur(eyes, nose, ears, mouth)
-    def Deidentification_image_dcm(self, where, dicom_path, dest_path, verif_path, url, prefix, Model=model):
+    def Deidentification_image_dcm(self, where, dicom_path, dest_path, verif_path, url, prefix, Model=None, fill_modes=None):
         '''
         where : list or tuple. Each position stands for eyes nose ears mouth 
                 If the corresponding position is 1, de-identification process.
@@ -490,8 +306,9 @@ class Defacer(object):
             array_img_re = np.reshape(array_img_re,(1 ,config["input_shape"][0], config["input_shape"][1], config["input_shape"][2] ,1)) # batch, z ,y, x , ch
 
             # load prediction label
+            contour, graph = load_contour_model()
             with graph.as_default():
-            	results = model.model.predict(array_img_re)
+            	results = contour.model.predict(array_img_re)
 
             if superior[arg] < 0 :
                 results=flip_axis(results,(3 - arg)) # +1 : index 0 is batch size
@@ -499,11 +316,12 @@ class Defacer(object):
             
 
             # preprocessing: Size recovery and transform onehot to labels number
+            from keras.utils import to_categorical
             if config["resizing"] == True:
                 results = self.onehot2label(results)
                 # prediction results (batch size, dep, col ,row, ch) -> (dep, col ,row)
                 results = np.reshape(results, config["input_shape"][0:3])
-                results = model.resize(results,
+                results = contour.resize(results,
                                        img_dep=original_shape[0],
                                        img_cols=original_shape[1],
                                        img_rows=original_shape[2])
@@ -530,43 +348,27 @@ class Defacer(object):
                 array_img = self.box_blur(array_img, box, wth=1.33)
 
 
-            if where[0]:  # eyes
-
-                eye_results = results[...,1] 
-                
+            # ROI-local fill: 각 라벨의 bounding sub-volume 안에서만 채움 (전체 크기 임시 배열 없음)
+            fill_modes = dict(self.DEFAULT_FILL_MODES, **(fill_modes or {}))
 
-                if where[1] == False: # If you want to preserve the nose
-                     border = self.box_blur(np.ones(array_img.shape),boxes[2], wth=1.5)
-                     eye_results = border*eye_results
+            # If you want to preserve the nose, labels inside the (1.5x) nose box are not filled
+            def nose_box():
+                return expand_box(boxes[2], 1.5, array_img.shape) if where[1] == False else None
 
-                threshold = np.max(ndimage.gaussian_filter(array_img[eye_results==1],sigma=3))
-                array_img[eye_results==1] = threshold
+            if where[0]:  # eyes
+                fill_label(array_img, results[...,1], fill_modes["eyes"],
+                           noise_scale=thresh*0.8, exclude_box=nose_box())
 
             if where[2]:  # ears
                 '''
                 In order not to see the outline of the ear due to external noise,
                 fill the area of the ear with similar noise
                 '''
-                ear_results = results[...,3]
-                # border = self.box_blur(np.ones(array_img.shape), boxes[3]) #'box_blur' function is based on array_img.shape (nibabel liabrary)
-                # border = self.box_blur(border, boxes[4])
-                # border = 1-border
-                # ear_results = border*ear_results
-
-                noise = np.random.rand(*original_shape)*thresh*0.8 
-                array_img[ear_results == 1] = noise[ear_results == 1] 
+                fill_label(array_img, results[...,3], fill_modes["ears"], noise_scale=thresh*0.8)
 
             if where[3] : # mouth
-
-                mouth_results = results[...,4] 
-                # border = self.box_blur(np.ones(array_img.shape),boxes[5]) #'box_blur' function is based on array_img.shape (nibabel liabrary)
-                # border = 1-border
-                if where[1] == False: # If you want to preserve the nose
-                     border = self.box_blur(np.ones(array_img.shape),boxes[2], wth=1.5)
-                     mouth_results = border*mouth_results
-
-                threshold = np.max(ndimage.gaussian_filter(array_img[mouth_results==1],sigma=3))
-                array_img[mouth_results==1] = threshold
+                fill_label(array_img, results[...,4], fill_modes["mouth"],
+                           noise_scale=thresh*0.8, exclude_box=nose_box())
 
             array_img = np.round(array_img)
             array_img = np.array(array_img, dtype=d_type)
@@ -601,7 +403,7 @@ class Defacer(object):
 
 
     # where_do_you_want_to_blur? ex) where = (1,1,1,1) -> blur(eyes, nose, ears,mouth)
-    def Deidentification_image_nii(self, where, nfti_path, dest_path, verif_path, url, prefix, Model=model):
+    def Deidentification_image_nii(self, where, nfti_path, dest_path, verif_path, url, prefix, Model=None, fill_modes=None):
         '''
         where : list or tuple. Each position stands for eyes nose ears (eyes, nose, ears) 
                 If the corresponding position is 1, de-identification process.
@@ -625,11 +427,13 @@ class Defacer(object):
 
             array_img_re = np.reshape(array_img_re,(1,config["input_shape"][0], config["input_shape"][1], config["input_shape"][2] , 1)) # batch, z ,y, x , ch
 
+            contour, graph = load_contour_model()
             with graph.as_default():
-            	results = model.model.predict(array_img_re)
+            	results = contour.model.predict(array_img_re)
             results = np.round(results)
 
             # preprocessing: Size recovery and transform onehot to labels number
+            from keras.utils import to_categorical
             if config["resizing"] == True:
                 results = self.onehot2label(results)
                 # prediction results (batch size, dep, col ,row, ch) -> (dep, col ,row)
@@ -662,46 +466,28 @@ class Defacer(object):
 
             
 
-            if where[0]:  # eyes
-
-                eye_results = results[...,1] 
-                border = self.box_blur(np.ones(array_img.shape),boxes[0]) 
-                border = self.box_blur(border, boxes[1])
-                border = 1-border
-                if where[1] == False: # If you want to preserve the nose
-                     border = self.box_blur(border,boxes[2], wth=1.5)
+            # ROI-local fill: 각 라벨의 bounding sub-volume 안에서만 채움 (전체 크기 임시 배열 없음)
+            fill_modes = dict(self.DEFAULT_FILL_MODES, **(fill_modes or {}))
 
-                eye_results = border*eye_results
+            # If you want to preserve the nose, labels inside the (1.5x) nose box are not filled
+            def nose_box():
+                return expand_box(boxes[2], 1.5, array_img.shape) if where[1] == False else None
 
-                threshold = np.max(ndimage.gaussian_filter(array_img[eye_results==1],sigma=3))
-                array_img[eye_results==1] = threshold
+            if where[0]:  # eyes
+                fill_label(array_img, results[...,1], fill_modes["eyes"], noise_scale=thresh*0.8,
+                           include_boxes=[boxes[0], boxes[1]], exclude_box=nose_box())
 
             if where[2]:  # ears
                 '''
                 In order not to see the outline of the ear due to external noise,
                 fill the area of the ear with similar noise
                 '''
-                ear_results = results[...,3]
-                border = self.box_blur(np.ones(array_img.shape), boxes[3]) 
-                border = self.box_blur(border, boxes[4])
-                border = 1-border
-                ear_results = border*ear_results
-                
-                noise = np.random.rand(*original_shape)*thresh*0.8 
-                array_img[ear_results == 1] = noise[ear_results == 1]
+                fill_label(array_img, results[...,3], fill_modes["ears"], noise_scale=thresh*0.8,
+                           include_boxes=[boxes[3], boxes[4]])
 
             if where[3] : # mouth
-            
-	            mouth_results = results[...,4] 
-	            border = self.box_blur(np.ones(array_img.shape),boxes[5]) 
-	            border = 1-border
-	            if where[1] == False: # If you want to preserve the nose
-	                 border = self.box_blur(border,boxes[2], wth=1.5)
-	                    
-	            mouth_results = border*mouth_results
-	            
-	            threshold = np.max(ndimage.gaussian_filter(array_img[mouth_results==1],sigma=3))
-	            array_img[mouth_results==1] = threshold
+                fill_label(array_img, results[...,4], fill_modes["mouth"], noise_scale=thresh*0.8,
+                           include_boxes=[boxes[5]], exclude_box=nose_box())
 	            
 
             array_img = np.round(array_img)
@@ -0,0 +1,295 @@
+"""
+Contour U-Net 추론 엔진
+
+- keras       : 기존 Keras 모델 (model_contour4.h5)을 전용 graph/session에 로드 (InferenceSession, 스레드 공유 가능)
+- frozen      : 추론 전용 frozen graph (.pb, 변수 -> 상수, InstanceNormalization 파라미터 상수 폴딩)
+- frozen_fp16 : frozen graph + float16 가중치 (연산은 float32)
+- frozen_int8 : frozen graph + int8 양자화 가중치 (quantize_weights)
+
+frozen 계열은 export_engine.py 로 먼저 생성해야 합니다.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+KERAS_MODEL_PATH = os.path.join(MODEL_DIR, "model_contour4.h5")
+
+ENGINE_PATHS = {
+    "frozen": os.path.join(MODEL_DIR, "model_contour4.pb"),
+    "frozen_fp16": os.path.join(MODEL_DIR, "model_contour4_fp16.pb"),
+    "frozen_int8": os.path.join(MODEL_DIR, "model_contour4_int8.pb"),
+}
+ENGINES = ["keras"] + list(ENGINE_PATHS)
+
+# batch 축은 가변 (MicroBatcher가 여러 요청을 한 번에 predict)
+INPUT_SHAPE = "-1,128,128,128,1"
+
+
+def engine_meta_path(pb_path):
+    return os.path.splitext(pb_path)[0] + ".json"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class InferenceSession(object):
+    """
+    Keras 모델을 전용 Graph/Session에 로드해 여러 스레드가 가중치 한 벌을 공유하는 추론 객체.
+    TF 1.x/Keras 2.2.4의 model.predict는 전역 graph/session에 묶여 있어 스레드에서 부르면 안전하지 않으므로,
+    predict는 Keras를 거치지 않고 고정(finalize)된 graph에서 sess.run만 실행합니다.
+    - max_concurrent: 동시에 실행하는 sess.run 수 (기본 1 = 직렬화, GPU 메모리 보호)
+    - batch_window > 0: 내부 MicroBatcher로 그 시간 안에 들어온 요청을 하나의 batch로 묶어 실행
+    """
+
+    name = "keras"
+
+    def __init__(self, model_path=KERAS_MODEL_PATH, intra_op_threads=0, inter_op_threads=0,
+                 max_concurrent=1, batch_window=0.0, max_batch=4):
+        from keras import backend as K
+        import model.model_ver_contour as contour
+
+        # 캐시 키 등에 쓰이는 모델 식별자 (엔진 이름 + 가중치 파일 해시)
+        self.identity = f"{self.name}:{file_digest(model_path)}"
+
+        config = tf.compat.v1.ConfigProto(
+            intra_op_parallelism_threads=intra_op_threads,
+            inter_op_parallelism_threads=inter_op_threads,
+        )
+        config.gpu_options.allow_growth = True
+        self.graph = tf.Graph()
+        self.sess = tf.compat.v1.Session(graph=self.graph, config=config)
+        with self.graph.as_default(), self.sess.as_default():
+            # learning_phase는 graph별 설정 (추론 모드 고정 -> feed 불필요)
+            K.set_learning_phase(0)
+            keras_model = contour.load_contour(model_path)
+        self.input = keras_model.inputs[0]
+        self.output = keras_model.outputs[0]
+        # 이후 어떤 스레드도 graph를 수정하지 못하도록 고정 (sess.run은 동시 호출 가능)
+        self.graph.finalize()
+
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._batcher = None
+        if batch_window > 0:
+            self._batcher = MicroBatcher(_SessionRunner(self), window=batch_window, max_batch=max_batch)
+
+    def run(self, x):
+        with self._slots:
+            return self.sess.run(self.output, {self.input: x})
+
+    def predict(self, x):
+        if self._batcher is not None:
+            return self._batcher.predict(x)
+        return self.run(x)
+
+    def close(self):
+        self.sess.close()
+
+
+class _SessionRunner(object):
+    """MicroBatcher가 InferenceSession.run을 직접 호출하도록 하는 adapter (predict -> batcher 재귀 방지)"""
+
+    def __init__(self, session):
+        self.name = session.name
+        self.identity = session.identity
+        self.predict = session.run
+
+
+class FrozenGraphEngine(object):
+    """frozen graph(.pb)를 전용 Graph/Session에서 실행 (학습용 노드 없음)"""
+
+    def __init__(self, pb_path, name="frozen", intra_op_threads=0, inter_op_threads=0):
+        if not os.path.exists(pb_path):
+            raise FileNotFoundError(f"{pb_path} 가 없습니다. 먼저 export_engine.py export 를 실행하세요.")
+        with open(engine_meta_path(pb_path)) as f:
+            meta = json.load(f)
+
+        graph_def = tf.compat.v1.GraphDef()
+        with open(pb_path, "rb") as f:
+            graph_def.ParseFromString(f.read())
+
+        self.name = name
+        self.identity = f"{name}:{file_digest(pb_path)}"
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        self.input = self.graph.get_tensor_by_name(meta["input"] + ":0")
+        self.output = self.graph.get_tensor_by_name(meta["output"] + ":0")
+
+        # 0이면 TF 기본값(코어 수)을 사용
+        config = tf.compat.v1.ConfigProto(
+            intra_op_parallelism_threads=intra_op_threads,
+            inter_op_parallelism_threads=inter_op_threads,
+        )
+        self.sess = tf.compat.v1.Session(graph=self.graph, config=config)
+
+    def predict(self, x):
+        return self.sess.run(self.output, {self.input: x})
+
+
+def load_engine(name="keras", intra_op_threads=0, inter_op_threads=0):
+    if name == "keras":
+        return InferenceSession(intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    if name not in ENGINE_PATHS:
+        raise ValueError(f"Unknown engine: {name} (choices: {', '.join(ENGINES)})")
+    return FrozenGraphEngine(ENGINE_PATHS[name], name=name,
+                             intra_op_threads=intra_op_threads,
+                             inter_op_threads=inter_op_threads)
+
+
+class MicroBatcher(object):
+    """
+    여러 스레드의 predict 요청을 짧은 시간(window) 동안 모아 한 번의 batched predict로 실행.
+    엔진 호출은 전용 스레드 하나에서만 일어나므로 여러 스레드가 같은 Defacer를 공유할 수 있습니다.
+    """
+
+    def __init__(self, engine, window=0.05, max_batch=4):
+        self.engine = engine
+        self.name = engine.name
+        self.identity = engine.identity
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, x):
+        slot = {"x": x, "done": threading.Event()}
+        self._queue.put(slot)
+        slot["done"].wait()
+        if "error" in slot:
+            raise slot["error"]
+        return slot["y"]
+
+    def qsize(self):
+        """batch로 묶이기를 기다리는 predict 요청 수 (queue depth gauge용)"""
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                sizes = [len(s["x"]) for s in batch]
+                results = self.engine.predict(np.concatenate([s["x"] for s in batch], axis=0))
+                start = 0
+                for s, n in zip(batch, sizes):
+                    s["y"] = results[start:start + n]
+                    start += n
+            except Exception as e:
+                for s in batch:
+                    s["error"] = e
+            self.batches += 1
+            self.items += len(batch)
+            for s in batch:
+                s["done"].set()
+
+
+# ============================================================
+# Export
+# ============================================================
+
+def _fp16_weights(graph_def, min_size=1024):
+    """큰 float32 상수를 float16 상수 + Cast(float32) 로 교체 (가중치 저장 크기 절반)"""
+    from tensorflow.python.framework import tensor_util
+
+    out = tf.compat.v1.GraphDef()
+    for node in graph_def.node:
+        if node.op == "Const" and node.attr["dtype"].type == tf.float32.as_datatype_enum:
+            value = tensor_util.MakeNdarray(node.attr["value"].tensor)
+            if value.size >= min_size:
+                half = out.node.add()
+                half.op = "Const"
+                half.name = node.name + "/fp16"
+                half.device = node.device
+                half.attr["dtype"].type = tf.float16.as_datatype_enum
+                half.attr["value"].tensor.CopyFrom(
+                    tensor_util.make_tensor_proto(value.astype(np.float16)))
+
+                cast = out.node.add()
+                cast.op = "Cast"
+                cast.name = node.name
+                cast.device = node.device
+                cast.input.append(half.name)
+                cast.attr["SrcT"].type = tf.float16.as_datatype_enum
+                cast.attr["DstT"].type = tf.float32.as_datatype_enum
+                cast.attr["Truncate"].b = False
+                continue
+        out.node.add().CopyFrom(node)
+    out.versions.CopyFrom(graph_def.versions)
+    return out
+
+
+def export_frozen_graph(precision="fp32", pb_path=None):
+    """
+    model_contour4.h5 -> 추론 전용 frozen graph.
+    precision: "fp32" | "fp16" | "int8"
+    """
+    from keras import backend as K
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    # 추론 모드로 고정한 뒤 모델 로드 (learning_phase 분기 제거)
+    K.clear_session()
+    K.set_learning_phase(0)
+    import model.model_ver_contour as contour
+    keras_model = contour.model
+
+    input_name = keras_model.inputs[0].op.name
+    output_name = keras_model.outputs[0].op.name
+
+    sess = K.get_session()
+    graph_def = tf.compat.v1.graph_util.convert_variables_to_constants(
+        sess, sess.graph.as_graph_def(), [output_name])
+    graph_def = tf.compat.v1.graph_util.remove_training_nodes(graph_def, protected_nodes=[output_name])
+
+    # gamma/beta reshape 등 상수 연산을 미리 계산해 그래프에서 제거
+    transforms = [
+        f'strip_unused_nodes(type=float, shape="{INPUT_SHAPE}")',
+        "fold_constants(ignore_errors=true)",
+        "fold_batch_norms",
+        "fold_old_batch_norms",
+    ]
+    if precision == "int8":
+        transforms.append("quantize_weights")
+    transforms.append("sort_by_execution_order")
+    graph_def = TransformGraph(graph_def, [input_name], [output_name], transforms)
+
+    if precision == "fp16":
+        graph_def = _fp16_weights(graph_def)
+
+    if pb_path is None:
+        key = "frozen" if precision == "fp32" else f"frozen_{precision}"
+        pb_path = ENGINE_PATHS[key]
+
+    with open(pb_path, "wb") as f:
+        f.write(graph_def.SerializeToString())
+    with open(engine_meta_path(pb_path), "w") as f:
+        json.dump({"input": input_name, "output": output_name, "precision": precision}, f, indent=2)
+
+    return pb_path
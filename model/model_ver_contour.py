@@ -3,6 +3,7 @@
 
 
 
+import os
 import numpy as np
 
 import random
@@ -244,7 +245,54 @@ class InstanceNormalization(Layer):
 
 
 
+class FusedInstanceNormalization(InstanceNormalization):
+    """InstanceNormalization 대체 레이어 (가중치/config 동일).
+    기존 K.mean + K.std (std 안에서 mean을 다시 계산)는 feature map 전체 reduction 3회,
+    tf.nn.moments는 mean -> 편차 제곱 평균으로 2회 (한 번에 계산하지는 않음).
+    gamma, beta, mean, stddev는 채널별 scale/shift 하나로 합쳐 feature map에는 곱셈-덧셈 1회만 적용.
+    결과는 InstanceNormalization과 float 오차 범위 내에서 같음 (stddev + epsilon 방식 동일)
+    """
+    def call(self, inputs, training=None):
+        import tensorflow as tf
+
+        input_shape = K.int_shape(inputs)
+        reduction_axes = list(range(0, len(input_shape)))
+
+        if self.axis is not None:
+            del reduction_axes[self.axis]
+
+        del reduction_axes[0]
+
+        mean, variance = tf.nn.moments(inputs, reduction_axes, keep_dims=True)
+        scale = 1. / (K.sqrt(variance) + self.epsilon)
+
+        broadcast_shape = [1] * len(input_shape)
+        if self.axis is not None:
+            broadcast_shape[self.axis] = input_shape[self.axis]
+
+        if self.scale:
+            scale = scale * K.reshape(self.gamma, broadcast_shape)
+        shift = -mean * scale
+        if self.center:
+            shift = shift + K.reshape(self.beta, broadcast_shape)
+        return inputs * scale + shift
+
+
+
 # import model structure and weight
-from keras.models import load_model
-model = load_model('./model/model_contour4.h5',custom_objects={'InstanceNormalization':InstanceNormalization,'dice_loss':dice_loss,'dice_score':dice_score})
+# 저장된 가중치(InstanceNormalization)를 그대로 FusedInstanceNormalization으로 로드
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_contour4.h5')
+
+def load_contour(path=MODEL_PATH):
+    """현재 기본 graph/session에 모델을 새로 로드 (InferenceSession은 전용 graph/session 안에서 호출)"""
+    from keras.models import load_model
+    return load_model(path,custom_objects={'InstanceNormalization':FusedInstanceNormalization,'dice_loss':dice_loss,'dice_score':dice_score})
+
+# 기존 `contour.model` 사용처는 처음 접근할 때 기본 graph에 로드 (import만으로 가중치를 올리지 않음)
+def __getattr__(name):
+    global model
+    if name == 'model':
+        model = load_contour()
+        return model
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
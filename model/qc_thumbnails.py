@@ -0,0 +1,179 @@
+"""
+QC 썸네일 (matplotlib 없이)
+
+배열에서 바로 slice를 잘라 회색조 + 라벨 색 overlay로 합성하고, 여러 장을 한 장의 contact sheet로 붙여
+zlib 기반의 최소 PNG 인코더로 저장합니다. 저장은 백그라운드 스레드에서 수행되어 defacing 루프를 막지 않습니다.
+"""
+
+import atexit
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+# label index -> RGB (0은 투명). 기존 matplotlib cmap ['None', 'red', 'purple', 'blue', 'yellow', 'green'] 과 동일한 순서
+PALETTE = np.array([
+    [0, 0, 0],
+    [255, 0, 0],
+    [128, 0, 128],
+    [0, 0, 255],
+    [255, 255, 0],
+    [0, 128, 0],
+], dtype=np.float32)
+
+
+def encode_png(rgb):
+    """(H, W, 3) uint8 -> PNG bytes (8-bit RGB, filter 없음)"""
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    h, w, _ = rgb.shape
+    rows = np.zeros((h, w * 3 + 1), dtype=np.uint8)  # 각 행 앞의 0 = filter type None
+    rows[:, 1:] = rgb.reshape(h, w * 3)
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+def take_slice(volume, axis, index):
+    index = int(np.clip(index, 0, volume.shape[axis] - 1))
+    return np.take(volume, index, axis=axis)
+
+
+def overlay(image2d, label2d=None, alpha=0.5, max_size=256):
+    """회색조 slice + 라벨 색 합성 -> (H, W, 3) uint8. 큰 slice는 stride로 축소"""
+    step = max(1, int(np.ceil(max(image2d.shape) / float(max_size))))
+    image2d = np.asarray(image2d[::step, ::step], dtype=np.float32)
+
+    lo, hi = np.percentile(image2d, (1, 99))
+    gray = np.clip((image2d - lo) / max(hi - lo, 1e-6), 0, 1) * 255
+    rgb = np.repeat(gray[..., np.newaxis], 3, axis=-1)
+
+    if label2d is not None:
+        label2d = np.asarray(label2d[::step, ::step]).astype(np.intp) % len(PALETTE)
+        m = label2d > 0
+        rgb[m] = (1 - alpha) * rgb[m] + alpha * PALETTE[label2d[m]]
+    return rgb.astype(np.uint8)
+
+
+def contact_sheet(tiles, ncols=3, pad=4):
+    if not tiles:
+        return np.zeros((1, 1, 3), dtype=np.uint8)
+    th = max(t.shape[0] for t in tiles)
+    tw = max(t.shape[1] for t in tiles)
+    nrows = int(np.ceil(len(tiles) / float(ncols)))
+    sheet = np.zeros((nrows * (th + pad) + pad, ncols * (tw + pad) + pad, 3), dtype=np.uint8)
+    for i, t in enumerate(tiles):
+        r, c = divmod(i, ncols)
+        y, x = pad + r * (th + pad), pad + c * (tw + pad)
+        sheet[y:y + t.shape[0], x:x + t.shape[1]] = t
+    return sheet
+
+
+def box_tiles(volume, boxes):
+    """각 박스 중심을 지나는 3방향 slice에 박스 영역을 색으로 표시한 tile 목록"""
+    tiles = []
+    if not boxes:
+        for axis in range(3):
+            tiles.append(overlay(take_slice(volume, axis, volume.shape[axis] // 2)))
+        return tiles
+
+    for i, b in enumerate(boxes):
+        for axis in range(3):
+            center = (b[axis] + b[axis + 3]) // 2
+            img2d = take_slice(volume, axis, center)
+            lab2d = np.zeros(img2d.shape, dtype=np.uint8)
+            other = [a for a in range(3) if a != axis]
+            lab2d[b[other[0]]:b[other[0] + 3], b[other[1]]:b[other[1] + 3]] = i % (len(PALETTE) - 1) + 1
+            tiles.append(overlay(img2d, lab2d))
+    return tiles
+
+
+def label_view_slices(image, labels, boxes, axial_plane):
+    """
+    legacy dicom_view_label/nifti_view_label 과 같은 4장(눈, 코, 귀, 입)의 (영상, 라벨) slice 사본:
+    박스 안의 예측 라벨만 표시. argmax/박스 마스크는 보여줄 slice에서만 계산합니다.
+    이후 image가 수정되어도 되도록 slice는 복사해서 반환합니다 (overlay는 백그라운드에서).
+    """
+    boxes = np.array(boxes)
+    centers = (boxes[:, 0:3] + boxes[:, 3:6]) / 2
+    slice_nums = [
+        int((centers[0][axial_plane] + centers[1][axial_plane]) / 2),  # eyes
+        int(centers[2][axial_plane]),                                     # nose
+        int((centers[3][axial_plane] + centers[4][axial_plane]) / 2),  # ears
+        int(centers[5][axial_plane]),                                     # mouth
+    ]
+    other = [a for a in range(3) if a != axial_plane]
+
+    slices = []
+    for slice_num in slice_nums:
+        img2d = np.array(take_slice(image, axial_plane, slice_num))
+        pred2d = np.argmax(take_slice(labels, axial_plane, slice_num), axis=-1)
+        inside = np.zeros(pred2d.shape, dtype=bool)
+        for b in boxes:
+            if b[axial_plane] <= slice_num < b[axial_plane + 3]:
+                inside[b[other[0]]:b[other[0] + 3], b[other[1]]:b[other[1] + 3]] = True
+        slices.append((img2d, pred2d * inside))
+    return slices
+
+
+class QCThumbnailWriter(object):
+    """PNG 합성/인코딩/저장을 백그라운드 스레드에서 처리 (queue가 차면 submit이 잠시 대기)"""
+
+    def __init__(self, max_pending=4):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._loop, name="qc-thumbnails", daemon=True)
+        self._thread.start()
+        self.written = 0
+        self.failed = 0
+
+    def submit(self, path, make_tiles, ncols=3):
+        """make_tiles: tile 목록을 만드는 함수 (slice 추출도 백그라운드에서 수행)"""
+        self._queue.put((str(path), make_tiles, ncols))
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            path, make_tiles, ncols = item
+            try:
+                png = encode_png(contact_sheet(make_tiles(), ncols=ncols))
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(png)
+                self.written += 1
+            except Exception as e:
+                print(f"   ⚠️ QC thumbnail failed ({os.path.basename(path)}): {e}")
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+_default_writer = None
+_default_lock = threading.Lock()
+
+
+def default_writer():
+    """프로세스 공용 writer (종료 시 남은 작업을 모두 저장)"""
+    global _default_writer
+    with _default_lock:
+        if _default_writer is None:
+            _default_writer = QCThumbnailWriter()
+            atexit.register(_default_writer.flush)
+        return _default_writer
@@ -0,0 +1,100 @@
+"""
+NIfTI 헤더만 읽어 (voxel 데이터 없이) 환자별 처리 비용을 추정하고,
+큰 환자부터 처리하도록 순서를 정하는 planning 단계.
+"""
+
+import heapq
+import os
+
+import numpy as np
+
+from memory_budget import estimate_file_bytes, fmt_bytes, header_info
+
+# 대략적인 CPU 기준 비용 모델 (초). 실제 실행 로그로 보정해서 사용
+PREDICT_SECONDS = 20.0            # 128^3 추론 1회
+DL_SECONDS_PER_MVOXEL = 1.5       # 리사이즈 + 라벨 복원 + 후처리
+MASK_SECONDS_PER_MVOXEL = 0.8     # 로드 + 마스크 resample + 적용
+IO_SECONDS_PER_MB = 0.05          # gzip 해제 + 재압축 저장 (압축된 파일 크기 기준)
+
+
+def plan_file(nifti_file, stage):
+    """헤더를 읽을 수 없는 파일(손상 등)은 비용 0으로 두고 계속 진행 (deface_patient가 오류로 기록)"""
+    try:
+        shape, dtype, _ = header_info(nifti_file)
+        size_mb = os.path.getsize(str(nifti_file)) / float(1 << 20)
+    except Exception as e:
+        return {"file": nifti_file, "stage": stage, "shape": (), "dtype": "?", "size_mb": 0.0,
+                "seconds": 0.0, "mem_bytes": 0, "error": str(e)}
+    voxels = int(np.prod(shape))
+
+    seconds = size_mb * IO_SECONDS_PER_MB
+    if stage == "dl":
+        seconds += PREDICT_SECONDS + voxels / 1e6 * DL_SECONDS_PER_MVOXEL
+    else:
+        seconds += voxels / 1e6 * MASK_SECONDS_PER_MVOXEL
+
+    return {
+        "file": nifti_file,
+        "stage": stage,
+        "shape": tuple(shape),
+        "dtype": str(dtype),
+        "size_mb": size_mb,
+        "seconds": seconds,
+        "mem_bytes": estimate_file_bytes(nifti_file, stage),
+    }
+
+
+def plan_patients(patient_groups, choose_reference, mask_threads=1):
+    """
+    환자별 plan 목록을 예상 비용 내림차순으로 반환.
+    mask_threads > 1 이면 sibling 마스크 적용이 동시에 실행되고 기준 추론 중에 미리 로드되므로
+    peak 메모리는 기준(DL) + 큰 sibling mask_threads개, 시간은 sibling 합을 스레드 수로 나눈 값으로 추정
+    """
+    plans = []
+    for patient_id, nifti_files in patient_groups.items():
+        reference = choose_reference(nifti_files)
+        files = [plan_file(f, "dl" if f == reference else "mask") for f in nifti_files]
+        dl = [p for p in files if p["stage"] == "dl"]
+        masks = [p for p in files if p["stage"] == "mask"]
+        if mask_threads > 1 and masks:
+            threads = min(mask_threads, len(masks))
+            seconds = sum(p["seconds"] for p in dl) + sum(p["seconds"] for p in masks) / threads
+            largest = sorted((p["mem_bytes"] for p in masks), reverse=True)[:threads]
+            mem_bytes = max([p["mem_bytes"] for p in dl] + [0]) + sum(largest)
+        else:
+            seconds = sum(p["seconds"] for p in files)
+            mem_bytes = max(p["mem_bytes"] for p in files)
+        plans.append({
+            "patient_id": patient_id,
+            "files": files,
+            "seconds": seconds,
+            "mem_bytes": mem_bytes,
+        })
+    plans.sort(key=lambda p: (-p["seconds"], p["patient_id"]))
+    return plans
+
+
+def expected_makespan(plans, jobs):
+    """큰 작업부터 가장 한가한 worker에 배정했을 때(LPT)의 예상 전체 시간"""
+    loads = [0.0] * max(1, jobs)
+    for p in plans:
+        heapq.heapreplace(loads, loads[0] + p["seconds"])
+    return max(loads)
+
+
+def print_plan(plans, jobs):
+    total_files = sum(len(p["files"]) for p in plans)
+    total_seconds = sum(p["seconds"] for p in plans)
+    print(f"🗺️ Plan: {len(plans)} patients, {total_files} files (largest first)")
+    for p in plans:
+        print(f"   {p['patient_id']:<36} {len(p['files']):>3} files  "
+              f"~{p['seconds']:7.1f}s  peak mem ~{fmt_bytes(p['mem_bytes'])}")
+        for f in p["files"]:
+            if "error" in f:
+                print(f"      - [{f['stage']:<4}] {f['file'].name}  ⚠️ unreadable header ({f['error']})")
+                continue
+            print(f"      - [{f['stage']:<4}] {f['file'].name}  {'x'.join(map(str, f['shape']))} "
+                  f"{f['dtype']}  {f['size_mb']:.1f} MB  ~{f['seconds']:.1f}s")
+    makespan = expected_makespan(plans, jobs)
+    print(f"   ⏱️ Expected runtime: ~{makespan / 60:.1f} min with {jobs} worker(s) "
+          f"(serial ~{total_seconds / 60:.1f} min)")
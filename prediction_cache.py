@@ -0,0 +1,101 @@
+"""
+128^3 추론 입력 해시 + 모델 식별자를 키로 하는 추론 결과(라벨맵) 디스크 캐시
+
+같은 촬영이 재-export/중복 시리즈/재실행으로 여러 번 들어와도 predict는 한 번만 수행합니다.
+엔트리는 압축된 128^3 uint8 라벨맵(.npz)이며, 전체 용량이 max_bytes를 넘으면
+가장 오래 사용되지 않은(mtime 기준) 엔트리부터 삭제합니다 (LRU).
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+
+import numpy as np
+
+
+class PredictionCache(object):
+    def __init__(self, cache_dir, model_identity, max_bytes=1 << 30):
+        self.cache_dir = str(cache_dir)
+        self.model_identity = model_identity
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def key(self, array_input):
+        array_input = np.ascontiguousarray(array_input)
+        h = hashlib.sha1()
+        h.update(self.model_identity.encode())
+        h.update(str((array_input.shape, array_input.dtype.str)).encode())
+        h.update(array_input.tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                labels = f["labels"]
+            os.utime(path, None)  # LRU: 사용 시각 갱신
+        except (OSError, KeyError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return labels
+
+    def put(self, key, labels):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 다른 프로세스와 동시에 써도 깨지지 않도록 임시 파일 -> rename
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, labels=labels.astype(np.uint8))
+        new_size = os.path.getsize(tmp_path)
+
+        with self._lock:
+            # 같은 key가 이미 있으면 (동시에 miss 난 경우 등) 덮어쓰므로 크기 차이만 더함
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            self._total_bytes += new_size - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        self._total_bytes = total
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return f"{self.hits} hits / {self.misses} misses ({rate:.1f}% hit)"
@@ -3,95 +3,169 @@ python run_defacer.py --input ./processed/3d_input --output ./processed/defaced_
 """
 
 import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import pandas as pd
-import tempfile
 import numpy as np
 import nibabel as nib
-import nibabel.processing
-from defacer import Defacer
-
-
-def make_canonical(input_path, temp_path):
-    orig_img = nib.load(str(input_path))
-    cano_img = nib.as_closest_canonical(orig_img)
-    nib.save(cano_img, str(temp_path))
-    return orig_img, cano_img
-
-
-def restore_original_orientation(defaced_path, orig_img, cano_img, final_path):
-    defaced_img = nib.load(str(defaced_path))
-    orig_ornt = nib.io_orientation(orig_img.affine)
-    cano_ornt = nib.io_orientation(cano_img.affine)
-    transform = nib.orientations.ornt_transform(cano_ornt, orig_ornt)
-    restored_data = nib.orientations.apply_orientation(defaced_img.get_fdata(), transform)
-
-    orig_dtype = np.asanyarray(orig_img.dataobj).dtype
-    if np.issubdtype(orig_dtype, np.integer):
-        info = np.iinfo(orig_dtype)
-        restored_data = np.rint(restored_data)
-        restored_data = np.clip(restored_data, info.min, info.max)
-    restored_data = restored_data.astype(orig_dtype)
-
-    restored_img = nib.Nifti1Image(restored_data, orig_img.affine, orig_img.header)
-    nib.save(restored_img, str(final_path))
-
-
-def apply_mask_to_other_sequence(other_file, mask_img, output_path):
-    target_img = nib.load(str(other_file))
-    target_data = target_img.get_fdata()
-
-    # 마스크를 타겟 영상의 좌표/해상도에 맞춰 nearest-neighbor 보간
-    resampled_mask_img = nib.processing.resample_from_to(mask_img, target_img, order=0)
-    resampled_mask_data = resampled_mask_img.get_fdata() > 0.5
+from memory_budget import MemoryScheduler, RssMonitor, fmt_bytes
+from planner import plan_patients, print_plan
+from run_metrics import RunMetrics, TimedEngine
+from task_budget import BudgetedWorker, TaskTimeout, worker_state
+from sharding import in_shard, parse_shard, qc_report_path
+from scanner import is_nifti, scan_tree
+from model.qc_thumbnails import QCThumbnailWriter, box_tiles
+
+# pandas, nibabel.processing, defacer(TensorFlow/Keras/모델)는 사용하는 단계에서 import
+# (--help, --dry-run 이 모델 로드 없이 바로 실행되도록). 확인: python check_startup.py
+
+
+CANONICAL_ORNT = nib.orientations.axcodes2ornt(("R", "A", "S"))
+
+
+def canonical_view(data, affine):
+    """
+    원본 배열을 복사 없이 canonical(RAS+) 축 순서의 strided view로 변환합니다.
+    (nib.as_closest_canonical과 같은 축 순서, 단 view이므로 쓰기가 원본에 반영됨)
+    """
+    ornt = nib.io_orientation(affine)
+    if np.array_equal(ornt, CANONICAL_ORNT):
+        return data, ornt
+
+    view = data
+    for axis, flip in enumerate(ornt[:, 1]):
+        if flip == -1:
+            view = np.flip(view, axis)
+    perm = list(np.argsort(ornt[:, 0])) + list(range(3, view.ndim))
+    return view.transpose(perm), ornt
+
+
+def canonical_box_to_original(box, ornt, orig_shape):
+    """canonical view 기준 박스 (x0, y0, z0, x1, y1, z1)를 원본 voxel 좌표로 변환"""
+    if np.array_equal(ornt, CANONICAL_ORNT):
+        return list(box)
+
+    lo, hi = [0, 0, 0], [0, 0, 0]
+    for axis in range(3):
+        cano_axis = int(ornt[axis, 0])
+        start, stop = box[cano_axis], box[cano_axis + 3]
+        if ornt[axis, 1] == -1:
+            start, stop = orig_shape[axis] - stop, orig_shape[axis] - start
+        lo[axis], hi[axis] = int(start), int(stop)
+    return lo + hi
+
+
+def load_sequence(nifti_file):
+    """
+    마스크 적용 대상 로드: (img, 쓰기 가능한 원본 dtype 배열).
+    float64 사본(get_fdata) 없이 원본 dtype 그대로 읽음 (.nii.gz 는 여기서 압축 해제).
+    비압축 .nii 는 copy-on-write memmap이라 실제로 읽거나 0으로 바꾼 page만 메모리에 올라옴
+    4D 이상(DWI, fMRI 등)은 마스크 적용 시 볼륨 단위로 스트리밍하므로 데이터를 읽지 않음 (data=None)
+    """
+    target_img = nib.load(str(nifti_file))
+    if len(target_img.shape) > 3:
+        return target_img, None
+    target_data = np.asanyarray(target_img.dataobj)
+    if not target_data.flags.writeable:
+        target_data = target_data.copy()
+    return target_img, target_data
+
+
+def stream_masked_volumes(target_img, mask, output_path):
+    """
+    4D 이상 시퀀스: 3D 볼륨을 하나씩 읽어 원본 dtype 그대로 mask 영역을 0으로 만든 뒤 바로 output에 이어 씀.
+    NIfTI는 Fortran 순서라 볼륨 하나가 파일에서 연속 구간 -> 입력/출력 모두 앞에서부터 순차 I/O (.gz 포함).
+    볼륨 크기 버퍼 하나에 읽어 그 자리에서 수정 후 그대로 씀 -> 최대 메모리는 볼륨 1개 정도 (timepoint 수와 무관). 원본 header(dtype, scl_slope/inter, extension) 유지
+    """
+    from nibabel.openers import ImageOpener
+    from nibabel.volumeutils import seek_tell
+
+    # 로드된 image header는 scaling/offset이 초기화되어 있으므로 파일 기준 값은 dataobj(ArrayProxy)에서 가져옴
+    proxy = target_img.dataobj
+    header = target_img.header.copy()
+    header.set_slope_inter(proxy.slope, proxy.inter)
+    header.set_data_offset(proxy.offset)
+    shape = target_img.shape
+    dtype = header.get_data_dtype()
+    vol_bytes = int(np.prod(shape[:3])) * dtype.itemsize
+    n_vols = int(np.prod(shape[3:]))
+
+    # scl_inter가 있으면 raw 0이 실제 0이 아니므로, 0에 해당하는 raw 값으로 채움
+    fill = -proxy.inter / proxy.slope if proxy.inter else 0
+    if np.issubdtype(dtype, np.integer):
+        fill = np.clip(np.round(fill), np.iinfo(dtype).min, np.iinfo(dtype).max)
+
+    with ImageOpener(target_img.get_filename(), "rb") as src, ImageOpener(str(output_path), "wb") as dst:
+        header.write_to(dst)
+        seek_tell(dst, proxy.offset, write0=True)
+        src.seek(proxy.offset)
+        buf = bytearray(vol_bytes)
+        view = memoryview(buf)
+        # buf를 그대로 보는 Fortran 순서 view: 수정하면 buf(파일 순서 그대로)에 반영됨
+        vol = np.frombuffer(buf, dtype=dtype).reshape(shape[:3], order="F")
+        for t in range(n_vols):
+            filled = 0
+            while filled < vol_bytes:
+                n = src.fobj.readinto(view[filled:])
+                if not n:
+                    raise IOError(f"{target_img.get_filename()}: volume {t} truncated")
+                filled += n
+            vol[mask] = fill
+            dst.write(view)
+
+
+def apply_mask_to_other_sequence(other_file, mask_img, output_path, loaded=None):
+    """loaded: load_sequence 결과 (미리 로드해 둔 경우)"""
+    import nibabel.processing
+
+    target_img, target_data = loaded if loaded is not None else load_sequence(other_file)
+
+    # 마스크를 타겟 영상의 공간 grid(앞 3축)에 맞춰 nearest-neighbor 보간 (4D도 한 번만)
+    resampled_mask_img = nib.processing.resample_from_to(mask_img, (target_img.shape[:3], target_img.affine),
+                                                         order=0)
+    resampled_mask_data = np.asanyarray(resampled_mask_img.dataobj) > 0.5
+
+    if target_data is None:
+        stream_masked_volumes(target_img, resampled_mask_data, output_path)
+        return nib.load(str(output_path))  # header만 읽음
 
     target_data[resampled_mask_data] = 0
 
-    target_dtype = np.asanyarray(target_img.dataobj).dtype
-    if np.issubdtype(target_dtype, np.integer):
-        info = np.iinfo(target_dtype)
-        target_data = np.rint(target_data)
-        target_data = np.clip(target_data, info.min, info.max)
-    target_data = target_data.astype(target_dtype)
-
     final_img = nib.Nifti1Image(target_data, target_img.affine, target_img.header)
     nib.save(final_img, str(output_path))
+    return final_img
 
 
 def list_nifti_files(directory: Path):
-    files = []
-    for p in directory.rglob("*"):
-        if not p.is_file():
-            continue
-        name = p.name.lower()
-        if name.endswith(".nii") or name.endswith(".nii.gz"):
-            files.append(p)
-    return sorted(files)
+    return scan_tree(directory).nifti_files()
+
 
+def discover_patient_groups(input_path: Path, patients=None, shard=None, inventory=None):
+    """
+    환자 폴더 이름 -> NIfTI 파일 목록. 입력 트리는 scanner.scan_tree 로 한 번만 탐색
+    (patients/shard 지정 시 해당 환자 폴더만 탐색, inventory가 주어지면 그대로 사용)
+    """
+    if inventory is None:
+        wanted = set(patients) if patients is not None else None
+        inventory = scan_tree(input_path, select=lambda name: (wanted is None or name in wanted)
+                              and in_shard(name, shard))
 
-def discover_patient_groups(input_path: Path):
     groups = {}
-    direct_files = []
-
-    for child in sorted(input_path.iterdir()):
-        if child.is_dir():
-            nii_files = list_nifti_files(child)
-            if nii_files:
-                groups[child.name] = nii_files
-        elif child.is_file():
-            name = child.name.lower()
-            if name.endswith(".nii") or name.endswith(".nii.gz"):
-                direct_files.append(child)
+    names = inventory.patients()
+    if patients is not None:
+        # patients 지정 시 해당 환자 폴더만 (증분 처리용)
+        names = sorted(n for n in set(patients) if inventory.has_patient(n))
+    for name in names:
+        nii_files = inventory.nifti_files(name)
+        if nii_files:
+            groups[name] = nii_files
 
     # 환자 폴더 없이 파일이 직접 들어있는 경우도 지원
-    if direct_files:
-        groups["_root"] = sorted(direct_files)
-
-    # 하위 구조가 더 깊고, 루트 바로 아래 폴더엔 파일이 없는 경우를 대비한 fallback
-    if not groups:
-        all_files = list_nifti_files(input_path)
-        if all_files:
-            groups["_root"] = all_files
+    if patients is None:
+        direct_files = [p for p in inventory.root_files() if is_nifti(p.name)]
+        if direct_files:
+            groups["_root"] = direct_files
 
     return groups
 
@@ -111,133 +185,492 @@ def choose_reference_t1(nifti_files):
     return candidates[0][2]
 
 
-def run_dl_deface(defacer, input_file: Path, output_file: Path):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_input = Path(temp_dir) / input_file.name
-        orig_img, cano_img = make_canonical(input_file, temp_input)
+def defaced_path(patient_out_dir: Path, nifti_file: Path, out_of_core=False):
+    """
+    결과 파일 경로. 비압축 .nii 중간 결과(to3d.py --uncompressed)도 최종 결과는 .nii.gz 로 압축 저장
+    (out_of_core 는 파일을 복사해 제자리 수정하므로 .nii 유지)
+    """
+    name = nifti_file.name
+    if name.lower().endswith(".nii") and not out_of_core:
+        name += ".gz"
+    return patient_out_dir / f"defaced_{name}"
 
-        result = defacer.Deidentification_image_nii(
-            where=(1, 1, 1, 1),
-            nfti_path=str(temp_input),
-            dest_path=temp_dir,
-            prefix="defaced",
-        )
-        if not result["success"]:
-            raise RuntimeError(result["msg"])
 
-        defaced_temp_file = Path(result["path"])
-        restore_original_orientation(defaced_temp_file, orig_img, cano_img, output_file)
+def label_sidecar_path(output_file: Path):
+    # defaced_X.nii.gz -> defaced_X.labels.npz
+    name = output_file.name
+    for ext in (".nii.gz", ".nii"):
+        if name.lower().endswith(ext):
+            name = name[:-len(ext)]
+            break
+    return output_file.with_name(name + ".labels.npz")
 
-    return nib.load(str(output_file)), nib.load(str(input_file))
 
+def save_label_sidecar(path: Path, labels):
+    np.savez_compressed(str(path), labels=labels.astype(np.uint8))
 
-def build_mask_from_reference(orig_img, defaced_img):
-    # 숫자 오차에 민감하지 않게 threshold 기반 차이 마스크 생성
-    orig_data = orig_img.get_fdata()
-    defaced_data = defaced_img.get_fdata()
-    mask_data = (np.abs(orig_data - defaced_data) > 1e-6).astype(np.float32)
-    return nib.Nifti1Image(mask_data, orig_img.affine)
 
+def load_label_sidecar(path: Path):
+    if not path.exists():
+        raise FileNotFoundError(f"Label sidecar not found: {path.name}")
+    with np.load(str(path)) as f:
+        return f["labels"]
 
-def main(input_dir, output_dir):
-    input_path = Path(input_dir)
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
 
-    qc_csv_path = output_path.parent / "qc_report.csv"
-    if qc_csv_path.exists():
-        qc_df = pd.read_csv(qc_csv_path)
-        for col in ["defacing_target", "defacing_done"]:
-            if col in qc_df.columns:
-                qc_df[col] = qc_df[col].fillna(0).astype(int)
+def run_dl_deface(defacer, input_file: Path, output_file: Path, save_labels=False, from_labels=False,
+                  out_of_core=False):
+    # out_of_core: 비압축 .nii 는 파일을 복사한 뒤 복사본 memmap에서 박스 영역만 덮어씀
+    # (추론 입력은 128^3 격자의 voxel만 읽음, 전체 배열 로드/재저장 없음)
+    from defacer import memmap_copy
+
+    patch = memmap_copy(input_file, output_file) if out_of_core else None
+    try:
+        return _deface_loaded(defacer, input_file, output_file, patch, save_labels, from_labels)
+    except BaseException:
+        # 실패/timeout 시 원본과 같은 내용의 임시 복사본이 결과 폴더에 남지 않도록
+        if patch is not None:
+            patch.discard()
+        raise
+
+
+def _deface_loaded(defacer, input_file, output_file, patch, save_labels, from_labels):
+    if patch is not None:
+        orig_img, data = patch.img, patch.data
     else:
-        qc_df = pd.DataFrame(columns=["case_id", "nifti_conversion", "defacing_target", "defacing_done", "error_files"])
+        orig_img = nib.load(str(input_file))
+        data = np.asanyarray(orig_img.dataobj)
+        if not data.flags.writeable:
+            data = data.copy()
+
+    # canonical view에서 추론 -> view를 통해 원본 방향 배열이 직접 수정됨
+    cano_data, ornt = canonical_view(data, orig_img.affine)
+
+    # 128^3 라벨맵 sidecar: 저장해두면 추론 없이 후처리 파라미터만 바꿔 다시 돌릴 수 있음
+    labels = None
+    sidecar_path = label_sidecar_path(output_file)
+    if from_labels:
+        labels = load_label_sidecar(sidecar_path)
+    elif save_labels or patch is not None:
+        if patch is not None:
+            labels = defacer.predict_labels(defacer.sample_resize(cano_data.transpose(2, 1, 0)))
+        else:
+            labels = defacer.predict_labels(cano_data.transpose(2, 1, 0))
+        if save_labels:
+            save_label_sidecar(sidecar_path, labels)
 
-    print("🚀 Defacing Start")
-    print("   ⏳ Loading DL Model...")
-    defacer = Defacer()
+    boxes = defacer.deface_array(cano_data, where=(1, 1, 1, 1), labels=labels)
+    boxes = [canonical_box_to_original(b, ornt, data.shape) for b in boxes]
 
-    patient_groups = discover_patient_groups(input_path)
-    if not patient_groups:
-        print("❌ No NIfTI files found in input.")
-        return
+    if patch is not None:
+        patch.commit()
+    else:
+        nib.save(nib.Nifti1Image(data, orig_img.affine, orig_img.header), str(output_file))
+    return orig_img, boxes, data
 
-    success_count = 0
-    total_files = sum(len(v) for v in patient_groups.values())
 
-    for patient_id, nifti_files in patient_groups.items():
-        out_case_id = patient_id if patient_id != "_root" else "root"
-        patient_out_dir = output_path / out_case_id
-        patient_out_dir.mkdir(parents=True, exist_ok=True)
+def build_mask_from_boxes(shape, affine, boxes):
+    # 실제로 지운 박스 영역으로 마스크 생성 (원본/결과 전체 비교 불필요)
+    mask_data = np.zeros(shape[:3], dtype=np.uint8)
+    for b in boxes:
+        mask_data[b[0]:b[3], b[1]:b[4], b[2]:b[5]] = 1
+    return nib.Nifti1Image(mask_data, affine)
 
-        print(f"\n🔹 Processing: {patient_id} ({len(nifti_files)} files)")
 
-        reference_t1 = choose_reference_t1(nifti_files)
-        print(f"   🎯 Reference selected: {reference_t1.name}")
+# ------------------------------------------------------------
+# 작업 단위 (task_timeout 지정 시 BudgetedWorker 프로세스 안에서 실행)
+# ------------------------------------------------------------
 
-        mask_img = None
-        patient_errors = []
-        patient_done = 0
+def init_worker_defacer(**defacer_kwargs):
+    from defacer import Defacer
+    return Defacer(**defacer_kwargs)
 
+
+def dl_task(defacer, input_file, output_file, save_labels, from_labels, out_of_core, keep_data=True):
+    orig_img, boxes, data = run_dl_deface(defacer, input_file, output_file, save_labels=save_labels,
+                                          from_labels=from_labels, out_of_core=out_of_core)
+    # worker 프로세스에서는 결과 배열을 되돌려 보내지 않음 (QC 이미지는 결과 파일에서 다시 읽음)
+    return orig_img.shape, orig_img.affine, boxes, data if keep_data else None
+
+
+def mask_task(other_file, mask_img, output_path):
+    return apply_mask_to_other_sequence(other_file, mask_img, output_path).shape
+
+
+def worker_dl_task(*args):
+    return dl_task(worker_state(), *args, keep_data=False)
+
+
+def deface_patient(defacer, nifti_files, patient_out_dir, save_labels=False, redeface=False, qc_writer=None,
+                   out_of_core=False, metrics=None, worker=None, task_timeout=None, mask_threads=1):
+    """
+    반환: (완료 파일 수, 실패 파일명 목록, 시간 초과 파일명 목록)
+    worker(BudgetedWorker) 지정 시 파일별 작업을 worker 프로세스에서 task_timeout(초) 예산으로 실행하고,
+    초과하면 worker를 종료한 뒤 timeout으로 기록하고 다음 파일을 계속 처리합니다.
+    mask_threads > 1 이면 나머지 시퀀스 마스크 적용을 스레드로 동시에 실행하고 (로드/저장의 zlib, NumPy는
+    GIL을 놓음), 기준 시퀀스 추론 중에 앞쪽 mask_threads개를 미리 로드합니다. 결과/오류는 파일 순서대로 기록.
+    """
+    # metrics: 단계별(dl / mask / fallback_dl) 소요시간, 실패, 처리 voxel 수 기록 (run_metrics.py)
+    metrics = metrics if metrics is not None else RunMetrics("deface")
+    reference_t1 = choose_reference_t1(nifti_files)
+    print(f"   🎯 Reference selected: {reference_t1.name}")
+    siblings = [f for f in nifti_files if f != reference_t1]
+
+    dl_args = (save_labels, redeface, out_of_core)
+
+    def run_dl(input_file, output_file):
+        if worker is None:
+            return dl_task(defacer, input_file, output_file, *dl_args)
+        try:
+            return worker.call(worker_dl_task, (input_file, output_file) + dl_args, seconds=task_timeout)
+        except TaskTimeout:
+            # 강제 종료된 worker가 남긴 out_of_core 임시 복사본 정리 (memmap_copy)
+            temp_path = Path(str(output_file) + ".tmp")
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+
+    def run_mask(input_file, mask_img, output_file):
+        if worker is None:
+            return mask_task(input_file, mask_img, output_file)
+        return worker.call(mask_task, (input_file, mask_img, output_file), seconds=task_timeout)
+
+    # worker 프로세스 실행(task_timeout)은 작업 단위로 예산을 걸기 때문에 순차 실행 유지
+    pool = None
+    prefetched = {}
+    if worker is None and mask_threads > 1 and siblings:
+        pool = ThreadPoolExecutor(max_workers=mask_threads, thread_name_prefix="mask")
+        for f in siblings[:mask_threads]:
+            prefetched[f] = pool.submit(load_sequence, f)
+
+    mask_img = None
+    patient_errors = []
+    patient_timeouts = []
+    patient_done = 0
+
+    try:
         # 기준 시퀀스 DL 수행
         try:
-            final_t1_path = patient_out_dir / f"defaced_{reference_t1.name}"
-            defaced_t1_img, orig_t1_img = run_dl_deface(defacer, reference_t1, final_t1_path)
-            mask_img = build_mask_from_reference(orig_t1_img, defaced_t1_img)
+            final_t1_path = defaced_path(patient_out_dir, reference_t1, out_of_core)
+            with metrics.timed("dl"):
+                t1_shape, t1_affine, t1_boxes, t1_data = run_dl(reference_t1, final_t1_path)
+            metrics.add_volume(np.prod(t1_shape))
+            mask_img = build_mask_from_boxes(t1_shape, t1_affine, t1_boxes)
             print("   ✅ Reference defaced and mask extracted")
-            success_count += 1
+
+            # 환자별 QC contact sheet (박스 중심 3방향 slice), 백그라운드에서 저장
+            if qc_writer is not None:
+                if t1_data is None:
+                    def t1_volume():
+                        return np.asanyarray(nib.load(str(final_t1_path)).dataobj)
+                else:
+                    def t1_volume():
+                        return t1_data
+                qc_path = patient_out_dir / f"qc_{patient_out_dir.name}.png"
+                qc_writer.submit(qc_path, lambda: box_tiles(t1_volume(), t1_boxes), ncols=3)
             patient_done += 1
+        except TaskTimeout as e:
+            print(f"   ⏱️ Reference DL Timeout: {e}")
+            patient_errors.append(reference_t1.name)
+            patient_timeouts.append(reference_t1.name)
         except Exception as e:
             print(f"   ❌ Reference DL Error: {e}")
             patient_errors.append(reference_t1.name)
 
-        # 마스크 적용 or fallback DL
-        for nii_file in nifti_files:
-            if nii_file == reference_t1:
-                continue
+        # 스레드 실행: 모든 sibling을 먼저 제출하고 아래에서 파일 순서대로 결과 수집
+        mask_jobs = {}
+        if pool is not None and mask_img is not None:
+            def mask_job(nii_file, final_path):
+                with metrics.timed("mask"):
+                    loaded = prefetched[nii_file].result() if nii_file in prefetched else None
+                    return apply_mask_to_other_sequence(nii_file, mask_img, final_path, loaded).shape
 
-            final_path = patient_out_dir / f"defaced_{nii_file.name}"
+            for f in siblings:
+                mask_jobs[f] = pool.submit(mask_job, f, defaced_path(patient_out_dir, f, out_of_core))
+        else:
+            # 미리 로드한 데이터는 fallback DL에서 쓰지 않음
+            for fut in prefetched.values():
+                fut.cancel()
+            prefetched.clear()
+
+        # 마스크 적용 or fallback DL
+        for nii_file in siblings:
+            final_path = defaced_path(patient_out_dir, nii_file, out_of_core)
             try:
-                if mask_img is not None:
-                    apply_mask_to_other_sequence(nii_file, mask_img, final_path)
+                if nii_file in mask_jobs:
+                    out_shape = mask_jobs[nii_file].result()
+                    print(f"   ⚡ Mask Applied: {nii_file.name}")
+                elif mask_img is not None:
+                    with metrics.timed("mask"):
+                        out_shape = run_mask(nii_file, mask_img, final_path)
                     print(f"   ⚡ Mask Applied: {nii_file.name}")
                 else:
                     # 기준 생성 실패 시, 파일별 DL로 fallback
-                    run_dl_deface(defacer, nii_file, final_path)
+                    with metrics.timed("fallback_dl"):
+                        out_shape = run_dl(nii_file, final_path)[0]
                     print(f"   🧠 Fallback DL: {nii_file.name}")
+                metrics.add_volume(np.prod(out_shape))
 
-                success_count += 1
                 patient_done += 1
+            except TaskTimeout as e:
+                print(f"   ⏱️ Defacing Timeout ({nii_file.name}): {e}")
+                patient_errors.append(nii_file.name)
+                patient_timeouts.append(nii_file.name)
             except Exception as e:
                 print(f"   ❌ Defacing Error ({nii_file.name}): {e}")
                 patient_errors.append(nii_file.name)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
 
-        error_str = "; ".join(patient_errors)
-        if "case_id" in qc_df.columns and patient_id in qc_df["case_id"].values:
-            qc_df.loc[qc_df["case_id"] == patient_id, "defacing_target"] = len(nifti_files)
-            qc_df.loc[qc_df["case_id"] == patient_id, "defacing_done"] = patient_done
-            qc_df.loc[qc_df["case_id"] == patient_id, "error_files"] = error_str
-        else:
-            new_row = pd.DataFrame([
-                {
-                    "case_id": patient_id,
-                    "nifti_conversion": "",
-                    "defacing_target": len(nifti_files),
-                    "defacing_done": patient_done,
-                    "error_files": error_str,
-                }
-            ])
-            qc_df = pd.concat([qc_df, new_row], ignore_index=True)
-
-        qc_df.to_csv(qc_csv_path, index=False)
+    return patient_done, patient_errors, patient_timeouts
+
+
+def update_qc_defacing(qc_df, patient_id, target, done, error_str, timeout_str=""):
+    import pandas as pd
+
+    if "case_id" in qc_df.columns and patient_id in qc_df["case_id"].values:
+        qc_df.loc[qc_df["case_id"] == patient_id, "defacing_target"] = target
+        qc_df.loc[qc_df["case_id"] == patient_id, "defacing_done"] = done
+        qc_df.loc[qc_df["case_id"] == patient_id, "error_files"] = error_str
+        if timeout_str or "defacing_timeouts" in qc_df.columns:
+            qc_df.loc[qc_df["case_id"] == patient_id, "defacing_timeouts"] = timeout_str
+    else:
+        new_row = pd.DataFrame([
+            {
+                "case_id": patient_id,
+                "nifti_conversion": "",
+                "defacing_target": target,
+                "defacing_done": done,
+                "error_files": error_str,
+                "defacing_timeouts": timeout_str,
+            }
+        ])
+        qc_df = pd.concat([qc_df, new_row], ignore_index=True)
+    return qc_df
+
+
+def main(input_dir, output_dir, engine="keras", cache_dir=None, cache_max_mb=1024,
+         save_labels=False, redeface=False, box_wth=1.3, shield_range=(0.3, 0.7),
+         patients=None, defacer=None, jobs=1, mem_budget_gb=None, dry_run=False, fill_mode="zero",
+         qc_thumbnails=False, out_of_core=False, shard=None, metrics_file=None, metrics_interval=15.0,
+         task_timeout=None, mask_threads=2):
+    input_path = Path(input_dir)
+    output_path = Path(output_dir)
+
+    patient_groups = discover_patient_groups(input_path, patients, shard)
+    if shard is not None:
+        print(f"🧩 Shard {shard[0]}/{shard[1]}: {len(patient_groups)} patients")
+    if not patient_groups:
+        print("❌ No NIfTI files found in input.")
+        return
+
+    # 헤더만 읽어 환자별 비용 추정 -> 큰 환자부터 처리 (병렬 실행 시 꼬리 지연 방지)
+    # task_timeout(worker 프로세스) 실행 시 마스크 적용은 순차
+    if task_timeout:
+        mask_threads = 1
+    plans = plan_patients(patient_groups, choose_reference_t1, mask_threads)
+    if dry_run:
+        print_plan(plans, jobs)
+        return
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    import pandas as pd
+    from defacer import Defacer
+    from model.inference_engine import MicroBatcher
+
+    # shard 실행 시 shard별 QC 조각에 기록 (sharding.py merge 로 병합)
+    qc_csv_path = qc_report_path(output_path.parent, shard)
+    if qc_csv_path.exists():
+        qc_df = pd.read_csv(qc_csv_path)
+        for col in ["defacing_target", "defacing_done"]:
+            if col in qc_df.columns:
+                qc_df[col] = qc_df[col].fillna(0).astype(int)
+    else:
+        qc_df = pd.DataFrame(columns=["case_id", "nifti_conversion", "defacing_target", "defacing_done", "error_files"])
+
+
+    print("🚀 Defacing Start" + (" (re-deface from saved labels)" if redeface else ""))
+    defacer_kwargs = dict(engine=None if redeface else engine,
+                          cache_dir=cache_dir, cache_max_mb=cache_max_mb,
+                          box_wth=box_wth, shield_range=shield_range, fill_mode=fill_mode)
+
+    # task_timeout: 파일별 작업을 worker 프로세스(작업 스레드마다 1개, 각자 모델 로드)에서 실행하고
+    # 예산을 넘기면 worker를 종료 -> timeout으로 기록 후 계속 진행. 이 경우 현재 프로세스는 모델을 로드하지 않음
+    workers = None
+    if task_timeout:
+        print(f"   ⏱️ Task budget: {task_timeout:g}s per file ({max(1, jobs)} worker process(es))")
+        workers = queue.Queue()
+        for i in range(max(1, jobs)):
+            workers.put(BudgetedWorker(init_worker_defacer, defacer_kwargs, name=f"deface-worker-{i}"))
+        defacer = None
+    elif defacer is None:
+        if not redeface:
+            print("   ⏳ Loading DL Model...")
+        defacer = Defacer(**defacer_kwargs)
+
+    success_count = 0
+    total_files = sum(len(v) for v in patient_groups.values())
+    timeout_count = 0
+
+    # 병렬 실행 시 여러 스레드의 predict를 MicroBatcher로 모아 batch 실행 (엔진 자체도 스레드 공유 가능)
+    if (jobs > 1 and defacer is not None and defacer.engine is not None
+            and not isinstance(defacer.engine, MicroBatcher)):
+        defacer.engine = MicroBatcher(defacer.engine)
+
+    # 헤더 기반 메모리 추정 + 예산 내에서만 작업 시작
+    scheduler = None
+    monitor = RssMonitor()
+    if mem_budget_gb:
+        scheduler = MemoryScheduler(int(mem_budget_gb * (1 << 30)))
+        print(f"   🧮 Memory budget: {fmt_bytes(scheduler.budget)} ({jobs} workers)")
+    calibration = []
+    qc_writer = QCThumbnailWriter() if qc_thumbnails else None
+
+    # 실행 지표: 처리량/단계별 지연/추론 사용률/실패 (metrics_file 지정 시 Prometheus textfile로 주기적 저장)
+    metrics = RunMetrics("deface", metrics_file, interval=metrics_interval)
+    queue_state = {"pending": 0, "running": 0}
+    queue_lock = threading.Lock()  # 제출 스레드와 run_patient 스레드들이 함께 갱신
+
+    def update_queue(pending=0, running=0):
+        with queue_lock:
+            queue_state["pending"] += pending
+            queue_state["running"] += running
+
+    metrics.gauge("patients_pending", lambda: queue_state["pending"])
+    metrics.gauge("patients_running", lambda: queue_state["running"])
+    # 추론 시간은 실제 엔진(MicroBatcher 안쪽) 기준으로 측정 -> 실행 후 원래 엔진으로 복원
+    engine_holder = None
+    if defacer is not None and defacer.engine is not None:
+        engine_holder = defacer.engine if isinstance(defacer.engine, MicroBatcher) else defacer
+        engine_holder.engine = TimedEngine(engine_holder.engine, metrics)
+        if isinstance(defacer.engine, MicroBatcher):
+            metrics.gauge("inference_queue_depth", defacer.engine.qsize)
+
+    def run_patient(patient_id, nifti_files, estimate):
+        out_case_id = patient_id if patient_id != "_root" else "root"
+        patient_out_dir = output_path / out_case_id
+        patient_out_dir.mkdir(parents=True, exist_ok=True)
+
+        if scheduler is not None:
+            scheduler.acquire(estimate)
+        update_queue(pending=-1, running=1)
+        worker = workers.get() if workers is not None else None
+        try:
+            print(f"\n🔹 Processing: {patient_id} ({len(nifti_files)} files, est. {fmt_bytes(estimate)})")
+            monitor.begin(patient_id)
+            try:
+                with metrics.timed("patient"):
+                    result = deface_patient(defacer, nifti_files, patient_out_dir,
+                                            save_labels=save_labels, redeface=redeface,
+                                            qc_writer=qc_writer, out_of_core=out_of_core,
+                                            metrics=metrics, worker=worker, task_timeout=task_timeout,
+                                            mask_threads=mask_threads)
+            finally:
+                observed = monitor.end(patient_id)
+                update_queue(running=-1)
+            calibration.append((patient_id, estimate, observed))
+            return result
+        finally:
+            if worker is not None:
+                workers.put(worker)
+            if scheduler is not None:
+                scheduler.release(estimate)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = []
+        for plan in plans:
+            patient_id = plan["patient_id"]
+            nifti_files = patient_groups[patient_id]
+            update_queue(pending=1)
+            futures.append((patient_id, nifti_files,
+                            pool.submit(run_patient, patient_id, nifti_files, plan["mem_bytes"])))
+        for patient_id, nifti_files, future in futures:
+            try:
+                patient_done, patient_errors, patient_timeouts = future.result()
+            except Exception as e:
+                print(f"   ❌ Patient Error ({patient_id}): {e}")
+                patient_done, patient_errors, patient_timeouts = 0, [f.name for f in nifti_files], []
+            success_count += patient_done
+            timeout_count += len(patient_timeouts)
+
+            qc_df = update_qc_defacing(qc_df, patient_id, len(nifti_files), patient_done,
+                                       "; ".join(patient_errors), "; ".join(patient_timeouts))
+            qc_df.to_csv(qc_csv_path, index=False)
+    monitor.stop()
+    metrics.close()
+    worker_restarts = 0
+    if workers is not None:
+        while not workers.empty():
+            worker = workers.get()
+            worker_restarts += worker.restarts
+            worker.close()
+    if engine_holder is not None:
+        engine_holder.engine = engine_holder.engine.engine
+    if qc_writer is not None:
+        qc_writer.close()
+        print(f"\n🖼️ QC thumbnails: {qc_writer.written} saved" + (f", {qc_writer.failed} failed" if qc_writer.failed else ""))
 
     print(f"\n📋 QC report saved: {qc_csv_path}")
     print(f"🎉 Completed: {success_count}/{total_files} files")
+    if task_timeout:
+        print(f"⏱️ Budget overruns: {timeout_count} file(s) over {task_timeout:g}s "
+              f"({worker_restarts} worker restart(s))")
+    metrics.print_summary()
+    if defacer is not None and defacer.cache is not None:
+        print(f"♻️ Prediction cache: {defacer.cache.summary()}")
+
+    # 추정치 보정용: 병렬 실행 중에는 관측값에 다른 작업의 메모리가 섞일 수 있음 (--jobs 1에서 정확)
+    print(f"🧮 Memory: peak RSS {fmt_bytes(monitor.peak)}"
+          + (f", peak admitted estimate {fmt_bytes(scheduler.peak_admitted)}" if scheduler else ""))
+    for patient_id, estimate, observed in calibration:
+        ratio = observed / estimate if estimate else 0.0
+        print(f"   {patient_id}: est. {fmt_bytes(estimate)}, observed +{fmt_bytes(observed)} (x{ratio:.2f})")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", required=True, help="Path to NIfTI files")
     parser.add_argument("--output", required=True, help="Path to save defaced files")
+    parser.add_argument("--engine", default="keras",
+                        choices=["keras", "frozen", "frozen_fp16", "frozen_int8"],
+                        help="Inference engine (frozen 계열은 export_engine.py로 먼저 생성)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="추론 결과 캐시 폴더 (중복 영상은 predict 생략)")
+    parser.add_argument("--cache-max-mb", type=float, default=1024,
+                        help="캐시 최대 용량 (MB, 초과 시 LRU 삭제)")
+    parser.add_argument("--save-labels", action="store_true",
+                        help="128^3 예측 라벨맵을 결과 옆에 .labels.npz로 저장")
+    parser.add_argument("--redeface", action="store_true",
+                        help="모델 추론 없이 저장된 .labels.npz로 박스를 다시 만들어 결과를 재생성")
+    parser.add_argument("--box-scale", type=float, default=1.3, help="얼굴 박스 확장 배율")
+    parser.add_argument("--shield-range", type=float, nargs=2, default=(0.3, 0.7),
+                        metavar=("LOW", "HIGH"), help="뇌 내부 방어막 범위 (영상 크기 대비 비율)")
+    parser.add_argument("--fill-mode", default="zero", choices=["zero", "noise", "smooth"],
+                        help="얼굴 박스 채우기 방식 (기준 시퀀스 DL 결과에 적용)")
+    parser.add_argument("--qc-thumbnails", action="store_true",
+                        help="환자별 QC 이미지(qc_<환자>.png, 박스 위치 overlay) 저장")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="비압축 .nii 는 memmap으로 박스 영역만 수정 (전체 로드/재저장 없음)")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="i/N: 환자 폴더 이름 해시 기준 N개 중 i번째(0부터) shard만 처리")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Prometheus textfile 형식 실행 지표 저장 경로 (예: /var/lib/node_exporter/defacer.prom)")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="지표 파일 갱신 주기 (초)")
+    parser.add_argument("--task-timeout", type=float, default=None,
+                        help="파일별 defacing 시간 예산(초). 지정 시 worker 프로세스에서 실행하고 초과하면 종료 후 QC에 timeout 기록")
+    parser.add_argument("--jobs", type=int, default=1, help="동시에 처리할 환자 수")
+    parser.add_argument("--mask-threads", type=int, default=2,
+                        help="환자 안에서 나머지 시퀀스 마스크 적용을 동시에 실행할 스레드 수 (1이면 순차)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="헤더만 읽어 처리 순서/예상 시간/메모리 plan만 출력하고 종료")
+    parser.add_argument("--mem-budget-gb", type=float, default=None,
+                        help="병렬 작업의 추정 메모리 합 상한 (GB, NIfTI 헤더 기반 추정)")
     args = parser.parse_args()
-    main(args.input, args.output)
+    main(args.input, args.output, engine=args.engine, jobs=args.jobs, mem_budget_gb=args.mem_budget_gb,
+         dry_run=args.dry_run, fill_mode=args.fill_mode, qc_thumbnails=args.qc_thumbnails,
+         out_of_core=args.out_of_core, shard=args.shard,
+         metrics_file=args.metrics_file, metrics_interval=args.metrics_interval,
+         task_timeout=args.task_timeout, mask_threads=args.mask_threads,
+         cache_dir=args.cache_dir, cache_max_mb=args.cache_max_mb,
+         save_labels=args.save_labels, redeface=args.redeface,
+         box_wth=args.box_scale, shield_range=tuple(args.shield_range))
@@ -0,0 +1,229 @@
+"""
+실행 단위 집계 지표 (처리량, 단계별 지연시간, 추론 사용률, 단계별 실패 수)
+
+run_defacer.main / to3d.process_to_nifti 가 카운터와 단계별 소요시간을 기록하고,
+주기적으로 Prometheus textfile 형식(node_exporter textfile collector가 읽는 .prom 파일)으로 저장합니다.
+네트워크 서비스 없이 파일만 쓰며, 실행이 끝나면 같은 값을 요약으로 출력합니다.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from task_budget import TaskTimeout
+
+QUANTILES = (0.5, 0.95)
+
+
+class RunMetrics(object):
+    def __init__(self, job, path=None, interval=15.0):
+        self.job = job
+        self.prefix = f"mri_defacer_{job}_"
+        self.path = str(path) if path else None
+        self.interval = interval
+        self.started = time.time()
+
+        self.volumes = 0
+        self.voxels = 0
+        self.failures = {}      # stage -> count
+        self.timeouts = {}      # stage -> count (예산 초과로 종료된 작업)
+        self.latencies = {}     # stage -> [seconds]
+        self.inference_calls = 0
+        self.inference_seconds = 0.0
+        self.gauges = {}        # name -> callable (기록 시점에 값을 읽음)
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.path:
+            self._thread = threading.Thread(target=self._loop, name=f"metrics-{job}", daemon=True)
+            self._thread.start()
+
+    # ---------------- 기록 ----------------
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.latencies.setdefault(stage, []).append(seconds)
+
+    def timed(self, stage):
+        return _Timer(self, stage)
+
+    def add_volume(self, voxels=0):
+        with self._lock:
+            self.volumes += 1
+            self.voxels += int(voxels)
+
+    def fail(self, stage):
+        with self._lock:
+            self.failures[stage] = self.failures.get(stage, 0) + 1
+
+    def timeout(self, stage):
+        with self._lock:
+            self.timeouts[stage] = self.timeouts.get(stage, 0) + 1
+
+    def inference(self, seconds):
+        with self._lock:
+            self.inference_calls += 1
+            self.inference_seconds += seconds
+
+    def gauge(self, name, fn):
+        """queue depth 등 현재값 gauge: 파일을 쓸 때마다 fn()을 호출"""
+        self.gauges[name] = fn
+
+    # ---------------- 계산 ----------------
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            stages = {}
+            for stage, values in sorted(self.latencies.items()):
+                arr = np.asarray(values, dtype=np.float64)
+                stages[stage] = {
+                    "count": len(values),
+                    "sum": float(arr.sum()),
+                    "quantiles": {q: float(np.percentile(arr, q * 100)) for q in QUANTILES},
+                }
+            snap = {
+                "elapsed": elapsed,
+                "volumes": self.volumes,
+                "voxels": self.voxels,
+                "volumes_per_hour": self.volumes / elapsed * 3600.0,
+                "voxels_per_second": self.voxels / elapsed,
+                "inference_calls": self.inference_calls,
+                "inference_seconds": self.inference_seconds,
+                "inference_utilization": self.inference_seconds / elapsed,
+                "failures": dict(self.failures),
+                "timeouts": dict(self.timeouts),
+                "stages": stages,
+            }
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = float(fn())
+            except Exception:
+                continue
+        snap["gauges"] = gauges
+        return snap
+
+    # ---------------- 출력 ----------------
+
+    def render(self, snap=None):
+        snap = snap or self.snapshot()
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {p}{name} {help_text}")
+            lines.append(f"# TYPE {p}{name} {kind}")
+            for labels, value in samples:
+                label_str = "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+                lines.append(f"{p}{name}{label_str} {value:.6g}")
+
+        metric("start_time_seconds", "gauge", "Run start time (unix seconds).", [((), self.started)])
+        metric("elapsed_seconds", "gauge", "Seconds since run start.", [((), snap["elapsed"])])
+        metric("volumes_total", "counter", "Volumes written.", [((), snap["volumes"])])
+        metric("voxels_total", "counter", "Voxels in written volumes.", [((), snap["voxels"])])
+        metric("volumes_per_hour", "gauge", "Mean throughput since run start.", [((), snap["volumes_per_hour"])])
+        metric("voxels_per_second", "gauge", "Mean voxel throughput since run start.", [((), snap["voxels_per_second"])])
+        metric("failures_total", "counter", "Failed tasks by stage.",
+               [((("stage", s),), n) for s, n in sorted(snap["failures"].items())])
+        metric("timeouts_total", "counter", "Tasks killed for exceeding their time budget, by stage.",
+               [((("stage", s),), n) for s, n in sorted(snap["timeouts"].items())])
+
+        lines.append(f"# HELP {p}stage_seconds Task latency by stage.")
+        lines.append(f"# TYPE {p}stage_seconds summary")
+        for stage, st in snap["stages"].items():
+            for q, v in st["quantiles"].items():
+                lines.append(f'{p}stage_seconds{{stage="{stage}",quantile="{q}"}} {v:.6g}')
+            lines.append(f'{p}stage_seconds_sum{{stage="{stage}"}} {st["sum"]:.6g}')
+            lines.append(f'{p}stage_seconds_count{{stage="{stage}"}} {st["count"]}')
+
+        if snap["inference_calls"]:
+            metric("inference_calls_total", "counter", "Engine predict calls.", [((), snap["inference_calls"])])
+            metric("inference_seconds_total", "counter", "Seconds spent inside engine predict.",
+                   [((), snap["inference_seconds"])])
+            metric("inference_utilization", "gauge", "Fraction of wall time the engine was busy.",
+                   [((), snap["inference_utilization"])])
+        for name, value in sorted(snap["gauges"].items()):
+            metric(name, "gauge", name.replace("_", " ") + ".", [((), value)])
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """임시 파일에 쓴 뒤 rename (node_exporter가 쓰다 만 파일을 읽지 않도록)"""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                print(f"   ⚠️ Metrics write failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def print_summary(self):
+        snap = self.snapshot()
+        print(f"📈 Run metrics ({self.job}): {snap['volumes']} volumes in {snap['elapsed'] / 60:.1f} min "
+              f"-> {snap['volumes_per_hour']:.1f} volumes/h, {snap['voxels_per_second'] / 1e6:.2f} Mvoxel/s")
+        for stage, st in snap["stages"].items():
+            q = st["quantiles"]
+            print(f"   {stage:<10} n={st['count']:<5} p50 {q[0.5]:.2f}s  p95 {q[0.95]:.2f}s")
+        if snap["inference_calls"]:
+            print(f"   inference  {snap['inference_calls']} calls, {snap['inference_seconds']:.1f}s busy "
+                  f"({snap['inference_utilization'] * 100:.0f}% of wall time)")
+        if snap["failures"]:
+            print("   failures   " + ", ".join(f"{s}: {n}" for s, n in sorted(snap["failures"].items())))
+        if snap["timeouts"]:
+            print("   timeouts   " + ", ".join(f"{s}: {n}" for s, n in sorted(snap["timeouts"].items())))
+        if self.path:
+            print(f"   textfile   {self.path}")
+
+
+class _Timer(object):
+    """with metrics.timed("stage"): ... -> 성공 시 latency 기록, 예외 시 failure (예산 초과면 timeout) 기록"""
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.metrics.observe(self.stage, time.time() - self.start)
+        elif issubclass(exc_type, TaskTimeout):
+            self.metrics.timeout(self.stage)
+        else:
+            self.metrics.fail(self.stage)
+        return False
+
+
+class TimedEngine(object):
+    """엔진 predict 호출 시간을 metrics에 기록하는 얇은 wrapper (name/identity 그대로 전달)"""
+
+    def __init__(self, engine, metrics):
+        self.engine = engine
+        self.name = engine.name
+        self.identity = engine.identity
+        self.metrics = metrics
+
+    def predict(self, x):
+        start = time.time()
+        try:
+            return self.engine.predict(x)
+        finally:
+            self.metrics.inference(time.time() - start)
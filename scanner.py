@@ -0,0 +1,114 @@
+"""
+입력 폴더 탐색을 한 번만 하는 파일 목록(inventory).
+
+run_defacer.py / to3d.py 의 환자/파일 탐색은 모두 이 inventory를 사용합니다.
+- 폴더마다 os.scandir 1회 (rglob + 파일별 is_file/stat 없음, NFS에서 stat 폭주 방지)
+- 서로 독립인 하위 폴더 목록은 여러 스레드에서 동시에 읽음 (네트워크 저장소 지연을 겹쳐서 숨김)
+- 결과는 정렬된 경로 목록으로 보관, 이후 탐색 함수들은 파일 시스템을 다시 읽지 않음
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+SCAN_WORKERS = 8
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+
+
+def is_nifti(name):
+    return name.lower().endswith(NIFTI_SUFFIXES)
+
+
+def _list_dir(path):
+    """scandir 1회: (하위 폴더 경로, 파일 경로). 심볼릭 링크 폴더는 따라가지 않음"""
+    dirs, files = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry.path)
+            except OSError:
+                continue
+    return dirs, files
+
+
+class Inventory(object):
+    """
+    root 아래 파일 목록. 최상위 폴더(환자 폴더) 단위로 묶어 보관합니다.
+    select(name)이 False인 최상위 폴더는 탐색하지 않습니다 (특정 환자/shard만 처리할 때).
+    """
+
+    def __init__(self, root, select=None, workers=SCAN_WORKERS):
+        self.root = Path(root)
+        self.dirs = 0
+        self._patients = {}     # 최상위 폴더 이름 -> [파일 경로(str), ...]
+        self._root_files = []
+        start = time.time()
+        self._scan(select, workers)
+        self.seconds = time.time() - start
+
+    def _scan(self, select, workers):
+        root = str(self.root)
+        top_dirs, self._root_files = _list_dir(root)
+        self.dirs = 1
+        top_dirs = [d for d in top_dirs if select is None or select(os.path.basename(d))]
+        for d in top_dirs:
+            self._patients[os.path.basename(d)] = []
+
+        # 폴더 하나 = 작업 하나. 끝난 폴더의 하위 폴더를 바로 이어서 제출 (깊이와 관계없이 병렬)
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="scan") as pool:
+            pending = {pool.submit(_list_dir, d): os.path.basename(d) for d in top_dirs}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    patient = pending.pop(fut)
+                    try:
+                        subdirs, files = fut.result()
+                    except OSError:
+                        continue  # 탐색 중 사라졌거나 권한 없는 폴더
+                    self.dirs += 1
+                    self._patients[patient].extend(files)
+                    for sub in subdirs:
+                        pending[pool.submit(_list_dir, sub)] = patient
+
+        for files in self._patients.values():
+            files.sort()
+        self._root_files.sort()
+
+    # ---------------- 조회 ----------------
+
+    def patients(self):
+        """최상위 폴더 이름 (정렬)"""
+        return sorted(self._patients)
+
+    def has_patient(self, name):
+        return name in self._patients
+
+    def files(self, patient=None):
+        """patient 폴더 아래 모든 파일 (재귀, 정렬). patient=None 이면 root 아래 전체"""
+        if patient is not None:
+            return [Path(p) for p in self._patients.get(patient, [])]
+        paths = list(self._root_files)
+        for name in self.patients():
+            paths.extend(self._patients[name])
+        return [Path(p) for p in paths]
+
+    def root_files(self):
+        """root 바로 아래 파일"""
+        return [Path(p) for p in self._root_files]
+
+    def nifti_files(self, patient=None):
+        return [p for p in self.files(patient) if is_nifti(p.name)]
+
+    def file_count(self):
+        return len(self._root_files) + sum(len(v) for v in self._patients.values())
+
+    def summary(self):
+        return f"{self.file_count()} files in {self.dirs} folders ({self.seconds:.2f}s)"
+
+
+def scan_tree(root, select=None, workers=SCAN_WORKERS):
+    return Inventory(root, select=select, workers=workers)
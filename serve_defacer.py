@@ -0,0 +1,329 @@
+"""
+python serve_defacer.py serve --socket /tmp/defacer.sock --input-root ./processed/3d_input --output-root ./processed/defaced_output
+python serve_defacer.py submit --socket /tmp/defacer.sock --input a.nii.gz --output defaced_a.nii.gz
+python serve_defacer.py bench --socket /tmp/defacer.sock --input ./processed/3d_input --output ./processed/bench_output --concurrency 4
+
+TensorFlow/모델을 한 번만 로드해 두고 로컬 HTTP(TCP 또는 Unix socket)로 defacing 요청을 받는 상주 서비스.
+짧은 시간(--batch-window-ms) 안에 들어온 요청들의 predict는 하나의 batch로 묶어 실행합니다.
+
+접근 제한 (요청은 서비스 계정 권한으로 파일을 읽고 씀)
+- Unix socket은 소유자만 접근 가능(0600)하게 생성
+- /deface 의 input/output은 --input-root / --output-root 아래로 resolve 되는 경로만 허용
+- TCP는 인증이 없으므로 root를 지정하지 않으면 /deface 요청을 거부 (/upload는 임시 폴더만 사용하므로 허용)
+
+API
+- POST /deface            JSON {"input": "...", "output": "...", "save_labels": false}
+- POST /upload?name=x.nii.gz   body = NIfTI 파일 바이트 -> 응답 body = defaced NIfTI 바이트
+- GET  /stats
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+# ============================================================
+# Server
+# ============================================================
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        # 생성 시점부터 소유자만 접근 가능하도록 (bind 후 chmod 사이에 다른 사용자가 연결하지 못하게)
+        old_umask = os.umask(0o177)
+        try:
+            self.socket.bind(self.server_address)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.server_address, 0o600)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def is_inside(path, root):
+    """심볼릭 링크/.. 를 풀었을 때 path가 root 아래인지"""
+    path, root = os.path.realpath(str(path)), os.path.realpath(str(root))
+    return os.path.commonpath([path, root]) == root
+
+
+class DefacerService(object):
+    def __init__(self, engine="keras", batch_window=0.05, max_batch=4, max_jobs=8, cache_dir=None,
+                 input_root=None, output_root=None, allow_paths=True):
+        from defacer import Defacer
+        from model.inference_engine import MicroBatcher
+
+        print("   ⏳ Loading DL Model...")
+        self.defacer = Defacer(engine=engine, cache_dir=cache_dir)
+        self.defacer.engine = MicroBatcher(self.defacer.engine, window=batch_window, max_batch=max_batch)
+        self.slots = threading.BoundedSemaphore(max_jobs)
+        self.lock = threading.Lock()
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.started = time.time()
+        self.input_root = input_root
+        self.output_root = output_root
+        self.allow_paths = allow_paths
+
+    def check_paths(self, input_file, output_file):
+        """/deface 경로 검사. 허용 범위 밖이면 PermissionError"""
+        if not self.allow_paths:
+            raise PermissionError("path requests are disabled on TCP without --input-root/--output-root")
+        if self.input_root and not is_inside(input_file, self.input_root):
+            raise PermissionError(f"input outside {self.input_root}: {input_file}")
+        if self.output_root and not is_inside(output_file, self.output_root):
+            raise PermissionError(f"output outside {self.output_root}: {output_file}")
+
+    def deface(self, input_file, output_file, save_labels=False):
+        from run_defacer import run_dl_deface
+
+        start = time.time()
+        with self.slots:
+            try:
+                Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+                _, boxes, _ = run_dl_deface(self.defacer, Path(input_file), Path(output_file),
+                                         save_labels=save_labels)
+            except Exception:
+                with self.lock:
+                    self.jobs_failed += 1
+                raise
+        with self.lock:
+            self.jobs_done += 1
+        return {"success": True, "output": str(output_file), "boxes": boxes,
+                "elapsed": time.time() - start}
+
+    def stats(self):
+        batcher = self.defacer.engine
+        stats = {
+            "uptime": time.time() - self.started,
+            "jobs_done": self.jobs_done,
+            "jobs_failed": self.jobs_failed,
+            "batches": batcher.batches,
+            "batched_items": batcher.items,
+            "mean_batch_size": batcher.items / batcher.batches if batcher.batches else 0.0,
+        }
+        if self.defacer.cache is not None:
+            stats["cache_hits"] = self.defacer.cache.hits
+            stats["cache_misses"] = self.defacer.cache.misses
+        return stats
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code, body, content_type="application/json"):
+            if not isinstance(body, bytes):
+                body = json.dumps(body, default=int).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/stats":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"success": False, "msg": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            try:
+                if url.path == "/deface":
+                    job = json.loads(self._read_body().decode())
+                    service.check_paths(job["input"], job["output"])
+                    result = service.deface(job["input"], job["output"], job.get("save_labels", False))
+                    print(f"   ✅ {os.path.basename(job['input'])} ({result['elapsed']:.1f}s)")
+                    self._send(200, result)
+                elif url.path == "/upload":
+                    name = os.path.basename(parse_qs(url.query).get("name", ["upload.nii.gz"])[0])
+                    data = self._read_body()
+                    with tempfile.TemporaryDirectory() as temp_dir:
+                        in_file = Path(temp_dir) / name
+                        out_file = Path(temp_dir) / f"defaced_{name}"
+                        in_file.write_bytes(data)
+                        result = service.deface(in_file, out_file)
+                        print(f"   ✅ upload {name} ({result['elapsed']:.1f}s)")
+                        self._send(200, out_file.read_bytes(), "application/octet-stream")
+                else:
+                    self._send(404, {"success": False, "msg": "not found"})
+            except PermissionError as e:
+                print(f"   ⛔ Rejected ({url.path}): {e}")
+                self._send(403, {"success": False, "msg": str(e)})
+            except Exception as e:
+                print(f"   ❌ Defacing Error ({url.path}): {e}")
+                self._send(500, {"success": False, "msg": str(e)})
+
+    return Handler
+
+
+def serve(args):
+    print("🚀 Defacer service start")
+    roots = bool(args.input_root and args.output_root)
+    service = DefacerService(engine=args.engine, batch_window=args.batch_window_ms / 1000.0,
+                             max_batch=args.max_batch, max_jobs=args.max_jobs, cache_dir=args.cache_dir,
+                             input_root=args.input_root, output_root=args.output_root,
+                             allow_paths=bool(args.socket) or roots)
+    if not args.socket and not roots:
+        print("   ⚠️ TCP without --input-root/--output-root: /deface disabled (only /upload)")
+    handler = make_handler(service)
+    if args.socket:
+        server = UnixHTTPServer(args.socket, handler)
+        print(f"   👂 Listening on unix:{args.socket}")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        print(f"   👂 Listening on http://{args.host}:{args.port}")
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+# ============================================================
+# Client (stand-in for the PACS export hook)
+# ============================================================
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=3600):
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def connect(args):
+    if args.socket:
+        return UnixHTTPConnection(args.socket)
+    return http.client.HTTPConnection(args.host, args.port, timeout=3600)
+
+
+def request(args, method, path, body=None):
+    conn = connect(args)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read().decode())
+    finally:
+        conn.close()
+
+
+def submit(args, input_file, output_file):
+    job = {"input": str(Path(input_file).resolve()), "output": str(Path(output_file).resolve())}
+    status, result = request(args, "POST", "/deface", json.dumps(job))
+    if status != 200:
+        raise RuntimeError(result.get("msg", f"HTTP {status}"))
+    return result
+
+
+def bench(args):
+    from run_defacer import list_nifti_files
+
+    files = list_nifti_files(Path(args.input))
+    if args.max_files:
+        files = files[:args.max_files]
+    if not files:
+        print("❌ No NIfTI files found in input.")
+        return
+
+    output_path = Path(args.output)
+    jobs = list(files)
+    lock = threading.Lock()
+    latencies, failures = [], []
+
+    def worker():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                f = jobs.pop(0)
+            start = time.time()
+            try:
+                submit(args, f, output_path / f"defaced_{f.name}")
+                with lock:
+                    latencies.append(time.time() - start)
+            except Exception as e:
+                with lock:
+                    failures.append((f.name, str(e)))
+
+    print(f"🏁 Bench: {len(files)} files, concurrency {args.concurrency}")
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - start
+
+    if latencies:
+        print(f"   ⏱️ latency p50 {np.percentile(latencies, 50):.2f}s, "
+              f"p95 {np.percentile(latencies, 95):.2f}s, max {max(latencies):.2f}s")
+    print(f"   🚚 throughput {len(latencies) / wall:.3f} volumes/s ({wall:.1f}s wall)")
+    for name, msg in failures:
+        print(f"   ❌ {name}: {msg}")
+    _, stats = request(args, "GET", "/stats")
+    print(f"   📦 mean batch size {stats['mean_batch_size']:.2f} over {stats['batches']} batches")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Long-lived local defacing service")
+    parser.add_argument("--socket", default=None, help="Unix socket 경로 (지정하지 않으면 TCP)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    sub = parser.add_subparsers(dest="command")
+
+    p_serve = sub.add_parser("serve")
+    p_serve.add_argument("--engine", default="keras",
+                         choices=["keras", "frozen", "frozen_fp16", "frozen_int8"])
+    p_serve.add_argument("--batch-window-ms", type=float, default=50)
+    p_serve.add_argument("--max-batch", type=int, default=4)
+    p_serve.add_argument("--max-jobs", type=int, default=8, help="동시에 처리하는 최대 요청 수")
+    p_serve.add_argument("--cache-dir", default=None)
+    p_serve.add_argument("--input-root", default=None, help="/deface input으로 허용할 폴더 (이 아래 경로만)")
+    p_serve.add_argument("--output-root", default=None, help="/deface output으로 허용할 폴더 (이 아래 경로만)")
+
+    p_submit = sub.add_parser("submit")
+    p_submit.add_argument("--input", required=True)
+    p_submit.add_argument("--output", required=True)
+
+    p_bench = sub.add_parser("bench")
+    p_bench.add_argument("--input", required=True, help="Path to NIfTI files")
+    p_bench.add_argument("--output", required=True, help="Path to save defaced files")
+    p_bench.add_argument("--concurrency", type=int, default=4)
+    p_bench.add_argument("--max-files", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    elif args.command == "submit":
+        result = submit(args, args.input, args.output)
+        print(f"✅ {result['output']} ({len(result['boxes'])} boxes, {result['elapsed']:.1f}s)")
+    elif args.command == "bench":
+        bench(args)
+    else:
+        parser.print_help()
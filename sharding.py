@@ -0,0 +1,158 @@
+"""
+python to3d.py --input ./raw_data --output ./processed/3d_input --shard 0/4
+python run_defacer.py --input ./processed/3d_input --output ./processed/defaced_output --shard 0/4
+python sharding.py merge --qc-dir ./processed --input ./raw_data --shards 4
+
+공유 저장소/코디네이터 없이 여러 노드에서 코호트를 나눠 처리하기 위한 shard 지정.
+환자 폴더 이름의 SHA-1 해시로 shard를 정하므로 노드/실행 순서와 관계없이 항상 같은 환자가 같은 shard에 배정됩니다.
+각 shard는 자기 QC 조각(qc_report.shard<i>of<N>.csv)만 쓰고, merge 명령이 하나의 qc_report.csv로 합칩니다.
+"""
+
+import argparse
+import hashlib
+import re
+from pathlib import Path
+
+from dicom_archive import archive_stem, is_archive
+
+QC_COLUMNS = ["case_id", "nifti_conversion", "defacing_target", "defacing_done", "error_files"]
+FRAGMENT_PATTERN = re.compile(r"^qc_report\.shard(\d+)of(\d+)\.csv$")
+
+
+def parse_shard(spec):
+    """'i/N' (0 <= i < N) -> (i, N)"""
+    if spec is None:
+        return None
+    try:
+        index, count = (int(v) for v in str(spec).split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like i/N (e.g. 0/4): {spec}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must satisfy 0 <= i < N: {spec}")
+    return index, count
+
+
+def shard_of(patient_id, count):
+    digest = hashlib.sha1(str(patient_id).encode("utf-8")).hexdigest()
+    return int(digest, 16) % count
+
+
+def in_shard(patient_id, shard):
+    return shard is None or shard_of(patient_id, shard[1]) == shard[0]
+
+
+def qc_report_path(qc_dir, shard=None):
+    qc_dir = Path(qc_dir)
+    if shard is None:
+        return qc_dir / "qc_report.csv"
+    return qc_dir / f"qc_report.shard{shard[0]}of{shard[1]}.csv"
+
+
+def find_fragments(qc_dir):
+    fragments = []
+    for p in sorted(Path(qc_dir).iterdir()):
+        m = FRAGMENT_PATTERN.match(p.name)
+        if m:
+            fragments.append(((int(m.group(1)), int(m.group(2))), p))
+    return fragments
+
+
+def merge_fragments(qc_dir, expected_ids=None, shards=None):
+    """
+    QC 조각들을 합쳐 (merged_df, missing, duplicates, missing_shards) 반환.
+    - duplicates: 두 개 이상의 shard에 기록된 환자 {case_id: [shard, ...]} (첫 shard의 행을 사용)
+    - missing: expected_ids 중 어느 조각에도 없는 환자
+    - missing_shards: shards(N) 지정 시 조각 파일이 없는 shard 번호
+    """
+    import pandas as pd
+
+    frames = []
+    counts = set()
+    for (index, count), path in find_fragments(qc_dir):
+        df = pd.read_csv(path, dtype={"case_id": str})
+        df["shard"] = f"{index}/{count}"
+        frames.append(df)
+        counts.add(count)
+
+    if frames:
+        all_rows = pd.concat(frames, ignore_index=True)
+    else:
+        all_rows = pd.DataFrame(columns=QC_COLUMNS + ["shard"])
+
+    duplicates = {}
+    for case_id, rows in all_rows.groupby("case_id", sort=True):
+        shard_list = sorted(rows["shard"].unique())
+        if len(shard_list) > 1:
+            duplicates[case_id] = shard_list
+
+    merged = all_rows.sort_values(["case_id", "shard"]).drop_duplicates("case_id", keep="first")
+    merged = merged.reset_index(drop=True)
+    merged["qc_flag"] = ""
+    for case_id, shard_list in duplicates.items():
+        merged.loc[merged["case_id"] == case_id, "qc_flag"] = "duplicate (" + ", ".join(shard_list) + ")"
+
+    missing = []
+    if expected_ids is not None:
+        seen = set(merged["case_id"])
+        missing = sorted(set(expected_ids) - seen)
+        if missing:
+            expected_shard = (lambda c: f"{shard_of(c, shards)}/{shards}") if shards else (lambda c: "")
+            merged = pd.concat([merged, pd.DataFrame([
+                {"case_id": c, "shard": expected_shard(c), "qc_flag": "missing"} for c in missing
+            ])], ignore_index=True)
+
+    missing_shards = []
+    if shards:
+        present = {int(s.split("/")[0]) for s in all_rows["shard"].unique() if s.endswith(f"/{shards}")}
+        missing_shards = [i for i in range(shards) if i not in present]
+        if counts - {shards}:
+            print(f"⚠️ Fragments with other shard counts found: {sorted(counts - {shards})}")
+
+    return merged, missing, duplicates, missing_shards
+
+
+def merge_command(args):
+    qc_dir = Path(args.qc_dir)
+    expected_ids = None
+    if args.input:
+        # to3d와 같이 zip/tar export도 환자 입력 (환자ID = 확장자를 뺀 파일 이름)
+        expected_ids = sorted({p.name if p.is_dir() else archive_stem(p) for p in Path(args.input).iterdir()
+                               if p.is_dir() or (p.is_file() and is_archive(p.name))})
+
+    merged, missing, duplicates, missing_shards = merge_fragments(qc_dir, expected_ids, args.shards)
+    output = Path(args.output) if args.output else qc_report_path(qc_dir)
+    merged.to_csv(output, index=False)
+
+    print(f"📋 Merged QC report: {output} ({len(merged)} patients)")
+    for i in missing_shards:
+        print(f"   ❌ Missing fragment: shard {i}/{args.shards}")
+    for case_id, shard_list in duplicates.items():
+        print(f"   ⚠️ Duplicate: {case_id} processed by shards {', '.join(shard_list)}")
+    for case_id in missing:
+        print(f"   ❌ Missing: {case_id}")
+    if not (missing or duplicates or missing_shards):
+        print("   ✅ Every patient appears exactly once")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard helpers for multi-node runs")
+    sub = parser.add_subparsers(dest="command")
+
+    p_merge = sub.add_parser("merge", help="shard별 QC 조각을 하나의 qc_report.csv로 병합")
+    p_merge.add_argument("--qc-dir", required=True, help="qc_report.shard*of*.csv 가 있는 폴더 (예: ./processed)")
+    p_merge.add_argument("--input", default=None, help="원본 환자 폴더 경로 (누락 환자 확인용)")
+    p_merge.add_argument("--shards", type=int, default=None, help="전체 shard 수 (누락된 조각 확인용)")
+    p_merge.add_argument("--output", default=None, help="병합 결과 경로 (기본: <qc-dir>/qc_report.csv)")
+
+    p_which = sub.add_parser("which", help="환자가 배정되는 shard 출력")
+    p_which.add_argument("--shards", type=int, required=True)
+    p_which.add_argument("patient_ids", nargs="+")
+
+    args = parser.parse_args()
+    if args.command == "merge":
+        merge_command(args)
+    elif args.command == "which":
+        for patient_id in args.patient_ids:
+            print(f"{patient_id}\t{shard_of(patient_id, args.shards)}/{args.shards}")
+    else:
+        parser.print_help()
@@ -0,0 +1,109 @@
+"""
+python stress_session.py --threads 16 --calls 4
+python stress_session.py --threads 32 --calls 2 --batch-window-ms 50 --max-batch 4
+python stress_session.py --threads 8 --calls 4 --max-concurrent 2 --io-mb 64
+
+InferenceSession(model/inference_engine.py) 하나를 여러 스레드가 동시에 호출하는 부하 테스트.
+- 입력마다 단일 스레드로 먼저 계산한 기준 결과와 비교 (다른 요청 결과가 섞이거나 값이 달라지면 실패)
+- 호출 사이에 NumPy 작업(--io-mb)을 섞어 실제 파이프라인처럼 I/O 스레드와 추론이 겹치도록 함
+- 예외, 결과 불일치, 지연시간(p50/p95), 처리량 출력. 하나라도 실패하면 exit code 1
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from model.inference_engine import InferenceSession
+
+
+def make_inputs(n, seed):
+    rng = np.random.RandomState(seed)
+    return [rng.rand(1, 128, 128, 128, 1).astype(np.float32) for _ in range(n)]
+
+
+def busy_numpy(mb, rng):
+    """nibabel 로드/리샘플 대신 GIL을 놓는 NumPy 연산으로 CPU/메모리 부하"""
+    if mb <= 0:
+        return
+    a = rng.rand(int(mb * (1 << 20) / 8))
+    np.sort(a)
+
+
+def main(threads, calls, inputs, max_concurrent, batch_window, max_batch, io_mb, atol):
+    print(f"🧵 Stress: {threads} threads x {calls} calls, {inputs} distinct inputs")
+    session = InferenceSession(max_concurrent=max_concurrent, batch_window=batch_window, max_batch=max_batch)
+    xs = make_inputs(inputs, seed=0)
+
+    # 기준 결과: 한 스레드에서 순서대로 (batch 없이)
+    start = time.time()
+    expected = [session.run(x) for x in xs]
+    serial = (time.time() - start) / len(xs)
+    print(f"   ⏱️ serial predict {serial:.2f}s per call")
+
+    lock = threading.Lock()
+    latencies, errors, mismatches = [], [], []
+    barrier = threading.Barrier(threads)
+
+    def worker(tid):
+        rng = np.random.RandomState(tid)
+        barrier.wait()  # 모든 스레드가 동시에 시작
+        for c in range(calls):
+            k = (tid + c) % len(xs)
+            busy_numpy(io_mb, rng)
+            t0 = time.time()
+            try:
+                y = session.predict(xs[k])
+            except Exception as e:
+                with lock:
+                    errors.append((tid, c, f"{type(e).__name__}: {e}"))
+                continue
+            elapsed = time.time() - t0
+            diff = float(np.max(np.abs(y - expected[k])))
+            with lock:
+                latencies.append(elapsed)
+                if y.shape != expected[k].shape or diff > atol:
+                    mismatches.append((tid, c, k, diff))
+
+    workers = [threading.Thread(target=worker, args=(t,), name=f"stress-{t}") for t in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.time() - start
+
+    total = threads * calls
+    if latencies:
+        print(f"   ⏱️ latency p50 {np.percentile(latencies, 50):.2f}s, p95 {np.percentile(latencies, 95):.2f}s, "
+              f"max {max(latencies):.2f}s")
+    print(f"   🚚 throughput {len(latencies) / wall:.2f} calls/s ({wall:.1f}s wall, "
+          f"x{serial * len(latencies) / max(wall, 1e-9):.2f} vs serial)")
+    if session._batcher is not None and session._batcher.batches:
+        b = session._batcher
+        print(f"   📦 mean batch size {b.items / b.batches:.2f} over {b.batches} batches")
+    for tid, c, msg in errors[:10]:
+        print(f"   ❌ thread {tid} call {c}: {msg}")
+    for tid, c, k, diff in mismatches[:10]:
+        print(f"   ❌ thread {tid} call {c}: input {k} max|diff| {diff:.2e}")
+
+    failed = len(errors) + len(mismatches)
+    print("🎉 PASS" if not failed else f"❌ FAIL ({len(errors)} errors, {len(mismatches)} mismatches / {total} calls)")
+    session.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent callers on one shared InferenceSession")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--calls", type=int, default=4, help="스레드당 predict 호출 수")
+    parser.add_argument("--inputs", type=int, default=4, help="서로 다른 입력 수 (스레드들이 돌아가며 사용)")
+    parser.add_argument("--max-concurrent", type=int, default=1, help="동시에 실행할 sess.run 수")
+    parser.add_argument("--batch-window-ms", type=float, default=0, help="0보다 크면 내부 batch 사용")
+    parser.add_argument("--max-batch", type=int, default=4)
+    parser.add_argument("--io-mb", type=float, default=16, help="호출 사이 스레드별 NumPy 작업 크기 (MB)")
+    parser.add_argument("--atol", type=float, default=1e-4, help="batch 실행 시 부동소수 오차 허용치")
+    args = parser.parse_args()
+    raise SystemExit(main(args.threads, args.calls, args.inputs, args.max_concurrent,
+                          args.batch_window_ms / 1000.0, args.max_batch, args.io_mb, args.atol))
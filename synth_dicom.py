@@ -0,0 +1,397 @@
+"""
+python synth_dicom.py --output ./bench/raw_synth
+python synth_dicom.py --output ./bench/raw_synth --patients 8 --series 4 --slices 96 --size 256 \
+    --syntaxes explicit implicit big deflated rle --missing-slices 1 --duplicates 0.2 --mixed --junk 3
+
+벤치마크/회귀 확인용 합성 DICOM 코호트 생성기 (환자 데이터 없이 to3d.py 전체 경로를 재현).
+환자 폴더 아래에 장비 export와 비슷한 구조(301/, 501/ ... + 확장자 없는 IM00001 파일)로 MR 시리즈를 쓰고,
+실제 입력에서 보던 문제를 선택적으로 섞습니다.
+- missing slices : 시리즈 중간 slice 묶음 누락 (dicom2nifti 실패 -> 구조 모드 경로)
+- duplicates     : 일부 instance를 다른 폴더(SA<환자ID>/)로 재-export (SOPInstanceUID 중복)
+- mixed          : 한 폴더에 다른 시리즈(localizer)가 섞이고, 첫 시리즈는 dual-echo (echo 분리 경로)
+- junk           : DICOM이 아닌 파일 (.DS_Store, Thumbs.db, 텍스트, 잘린 DICOM)
+생성 결과의 기대값(시리즈별 결과, 중복 수 등)은 <output>/manifest.json 에 기록됩니다 (bench_to3d.py 가 사용).
+"""
+
+import argparse
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileDataset
+try:
+    from pydicom.dataset import FileMetaDataset
+except ImportError:  # pydicom < 2.0
+    FileMetaDataset = Dataset
+from pydicom.filebase import DicomBytesIO, DicomFileLike
+from pydicom.filewriter import write_dataset, write_file_meta_info
+from pydicom.uid import (PYDICOM_IMPLEMENTATION_UID, DeflatedExplicitVRLittleEndian, ExplicitVRBigEndian,
+                         ExplicitVRLittleEndian, ImplicitVRLittleEndian, RLELossless, generate_uid)
+
+MR_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.4"
+
+# 이름 -> transfer syntax UID
+SYNTAXES = {
+    "explicit": ExplicitVRLittleEndian,
+    "implicit": ImplicitVRLittleEndian,
+    "big": ExplicitVRBigEndian,
+    "deflated": DeflatedExplicitVRLittleEndian,
+    "rle": RLELossless,
+}
+
+# (SeriesDescription, 조직 대비: 배경/피질/중심 신호, TE)
+SERIES_TYPES = [
+    ("T1_SAG_MPRAGE", (0, 700, 450), 3.0),
+    ("T2_AX", (0, 350, 900), 90.0),
+    ("FLAIR_AX", (0, 600, 300), 120.0),
+    ("PD_AX", (0, 800, 700), 15.0),
+    ("T2STAR_AX", (0, 400, 500), 20.0),
+    ("SWI_AX", (0, 300, 600), 25.0),
+]
+
+JUNK_FILES = [
+    (".DS_Store", b"\x00\x00\x00\x01Bud1" + b"\x00" * 512),
+    ("Thumbs.db", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\x00" * 1024),
+    ("export_log.txt", b"PACS export finished\r\n"),
+    ("VERSION", b"1.0\n"),
+]
+
+
+# ============================================================
+# 영상 (phantom) 생성
+# ============================================================
+
+def phantom_volume(slices, size, contrast, rng):
+    """머리 모양 타원체 (바깥 껍질 + 안쪽 영역) + 잡음, uint16 (slices, size, size)"""
+    background, shell, core = contrast
+    z, y, x = np.meshgrid(np.linspace(-1, 1, slices), np.linspace(-1, 1, size), np.linspace(-1, 1, size),
+                          indexing="ij")
+    r = (x / 0.75) ** 2 + (y / 0.9) ** 2 + (z / 0.95) ** 2
+    vol = np.full(r.shape, float(background), dtype=np.float32)
+    vol[r < 1.0] = shell
+    vol[r < 0.7] = core
+    noise = rng.normal(0, 12, size=r.shape).astype(np.float32) * (r < 1.0)
+    return np.clip(vol + noise, 0, 4095).astype(np.uint16)
+
+
+# ============================================================
+# RLE Lossless 인코딩 (PS3.5 Annex G)
+# ============================================================
+
+def _packbits(row):
+    """한 행의 byte를 PackBits로 인코딩 (반복 구간은 replicate, 나머지는 literal 128 byte 단위)"""
+    a = np.frombuffer(row, dtype=np.uint8)
+    n = len(a)
+    change = np.flatnonzero(a[1:] != a[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    lengths = np.diff(np.concatenate((starts, [n])))
+
+    out = bytearray()
+
+    def literal(lo, hi):
+        for i in range(lo, hi, 128):
+            chunk = a[i:min(i + 128, hi)]
+            out.append(len(chunk) - 1)
+            out.extend(chunk.tobytes())
+
+    lit_start = 0
+    for start, length in zip(starts[lengths >= 2], lengths[lengths >= 2]):
+        literal(lit_start, start)
+        value, remaining = int(a[start]), int(length)
+        while remaining > 0:
+            k = min(remaining, 128)
+            if k == 1:
+                out.extend((0, value))
+            else:
+                out.extend((257 - k, value))
+            remaining -= k
+        lit_start = start + length
+    literal(lit_start, n)
+    return bytes(out)
+
+
+def rle_encode_frame(frame):
+    """uint16 2D -> RLE frame (byte plane 2개: 상위 byte segment 먼저, 행 단위 인코딩)"""
+    planes = [(frame >> 8).astype(np.uint8), (frame & 0xFF).astype(np.uint8)]
+    segments = []
+    for plane in planes:
+        seg = b"".join(_packbits(r.tobytes()) for r in plane)
+        if len(seg) % 2:
+            seg += b"\x00"
+        segments.append(seg)
+
+    offsets, pos = [], 64
+    for seg in segments:
+        offsets.append(pos)
+        pos += len(seg)
+    header = struct.pack("<16I", len(segments), *(offsets + [0] * (15 - len(offsets))))
+    return header + b"".join(segments)
+
+
+def encapsulate(frame_bytes):
+    """단일 frame 캡슐화: 빈 Basic Offset Table item + frame item (sequence delimiter는 pydicom이 씀)"""
+    if len(frame_bytes) % 2:
+        frame_bytes += b"\x00"
+    item = struct.pack("<HHI", 0xFFFE, 0xE000, 0)
+    item += struct.pack("<HHI", 0xFFFE, 0xE000, len(frame_bytes)) + frame_bytes
+    return item
+
+
+# ============================================================
+# DICOM 쓰기
+# ============================================================
+
+def build_slice(info, index, frame, syntax):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MR_IMAGE_STORAGE
+    meta.MediaStorageSOPInstanceUID = info["sop_uids"][index]
+    meta.TransferSyntaxUID = syntax
+    meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b"\x00" * 128)
+    ds.SOPClassUID = MR_IMAGE_STORAGE
+    ds.SOPInstanceUID = info["sop_uids"][index]
+    ds.Modality = "MR"
+    ds.Manufacturer = "SYNTHETIC"
+    ds.ImageType = ["ORIGINAL", "PRIMARY", "M", "ND"]
+    ds.PatientID = info["patient_id"]
+    ds.PatientName = info["patient_id"]
+    ds.StudyInstanceUID = info["study_uid"]
+    ds.SeriesInstanceUID = info["series_uid"]
+    ds.FrameOfReferenceUID = info["frame_uid"]
+    ds.SeriesDescription = info["description"]
+    ds.SeriesNumber = info["series_number"]
+    ds.AcquisitionNumber = 1
+    ds.InstanceNumber = index + 1
+    if info.get("echo"):
+        ds.EchoNumbers = info["echo"]
+    ds.EchoTime = info["te"]
+    ds.RepetitionTime = 2000.0
+
+    spacing = info["spacing"]
+    rows, cols = frame.shape
+    ds.ImageOrientationPatient = info["orientation"]
+    ds.ImagePositionPatient = [v + info["normal"][k] * info["positions"][index] * spacing[2]
+                               for k, v in enumerate(info["origin"])]
+    ds.SliceLocation = ds.ImagePositionPatient[2]
+    ds.PixelSpacing = [spacing[0], spacing[1]]
+    ds.SliceThickness = spacing[2]
+    ds.SpacingBetweenSlices = spacing[2]
+
+    ds.Rows = rows
+    ds.Columns = cols
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.RescaleIntercept = 0
+    ds.RescaleSlope = 1
+
+    ds.is_little_endian = syntax != ExplicitVRBigEndian
+    ds.is_implicit_VR = syntax == ImplicitVRLittleEndian
+    if syntax == RLELossless:
+        ds.PixelData = encapsulate(rle_encode_frame(frame))
+        ds.data_element("PixelData").VR = "OB"
+        ds.data_element("PixelData").is_undefined_length = True
+    else:
+        ds.PixelData = frame.astype(">u2" if syntax == ExplicitVRBigEndian else "<u2").tobytes()
+        ds.data_element("PixelData").VR = "OW"
+    return ds
+
+
+def write_dicom(ds, path):
+    if ds.file_meta.TransferSyntaxUID != DeflatedExplicitVRLittleEndian:
+        ds.save_as(str(path), write_like_original=False)
+        return
+
+    # Deflated: meta 정보는 그대로, dataset 본문만 raw deflate
+    body = DicomBytesIO()
+    body.is_little_endian = True
+    body.is_implicit_VR = False
+    write_dataset(body, ds)
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(body.getvalue()) + compressor.flush()
+    if len(deflated) % 2:
+        deflated += b"\x00"
+    with open(str(path), "wb") as f:
+        f.write(ds.preamble + b"DICM")
+        write_file_meta_info(DicomFileLike(f), ds.file_meta)
+        f.write(deflated)
+
+
+# ============================================================
+# 코호트 생성
+# ============================================================
+
+def series_info(patient_id, study_uid, frame_uid, number, description, te, slices, size, echo=None):
+    fov = 240.0
+    spacing = (fov / size, fov / size, 1.5)
+    return {
+        "patient_id": patient_id,
+        "study_uid": study_uid,
+        "frame_uid": frame_uid,
+        "series_uid": generate_uid(),
+        "series_number": number,
+        "description": description,
+        "te": te,
+        "echo": echo,
+        "spacing": spacing,
+        "orientation": [1, 0, 0, 0, 1, 0],
+        "normal": [0, 0, 1],
+        "origin": [-fov / 2, -fov / 2, -slices * spacing[2] / 2],
+        "positions": list(range(slices)),
+        "sop_uids": [generate_uid() for _ in range(slices)],
+    }
+
+
+def write_series(info, volume, folder, syntax, keep, first_file=1):
+    """keep 인덱스의 slice만 folder에 씀. 반환: 쓴 파일 경로 목록"""
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for n, i in enumerate(keep):
+        path = folder / f"IM{first_file + n:05d}"
+        write_dicom(build_slice(info, i, volume[i], syntax), path)
+        paths.append(path)
+    return paths
+
+
+def generate_patient(root, patient_id, args, rng):
+    patient_dir = root / patient_id
+    study_uid, frame_uid = generate_uid(), generate_uid()
+    record = {"patient_id": patient_id, "series": [], "duplicates": 0, "junk": 0}
+    written = []
+
+    n_series = min(args.series, len(SERIES_TYPES))
+    gap_series = set(rng.choice(n_series, size=min(args.missing_slices, n_series), replace=False).tolist())
+
+    for s in range(n_series):
+        description, contrast, te = SERIES_TYPES[s]
+        syntax_name = args.syntaxes[s % len(args.syntaxes)]
+        syntax = SYNTAXES[syntax_name]
+        number = (s + 3) * 100 + 1
+        folder = patient_dir / str(number)
+
+        keep = list(range(args.slices))
+        missing = 0
+        if s in gap_series:
+            # 뒤쪽 1/3 지점에서 slice 묶음 누락 -> 간격 불일치로 dicom2nifti 실패, 앞쪽 연속 구간은 구조 가능
+            start = args.slices * 2 // 3
+            missing = max(2, args.slices // 10)
+            keep = keep[:start] + keep[start + missing:]
+
+        echoes = [1, 2] if (args.mixed and s == 0) else [None]
+        series_uid = None
+        first_file = 1
+        for echo in echoes:
+            info = series_info(patient_id, study_uid, frame_uid, number, description,
+                               te * (echo or 1), args.slices, args.size, echo)
+            # dual-echo는 같은 SeriesInstanceUID, echo별로 다른 instance
+            series_uid = series_uid or info["series_uid"]
+            info["series_uid"] = series_uid
+            volume = phantom_volume(args.slices, args.size, tuple(int(c * (0.6 if echo == 2 else 1.0)) for c in contrast), rng)
+            written += write_series(info, volume, folder, syntax, keep, first_file)
+            first_file += len(keep)
+            record["series"].append({
+                "folder": str(number),
+                "description": description,
+                "echo": echo,
+                "syntax": syntax_name,
+                "slices": len(keep),
+                "missing_slices": missing,
+                # deflated: dicom2nifti가 지연 읽기(defer)로 파일을 다시 열지 못해 구조 모드로 변환됨
+                "expected": "rescued" if missing or syntax_name == "deflated" else "converted",
+            })
+
+    if args.mixed:
+        # 첫 시리즈 폴더에 다른 촬영(localizer 3장)이 섞여 export된 경우 -> 별도 폴더로 분리, slice 부족으로 변환 실패
+        info = series_info(patient_id, study_uid, frame_uid, 1, "LOCALIZER", 5.0, 3, args.size)
+        volume = phantom_volume(3, args.size, (0, 500, 500), rng)
+        written += write_series(info, volume, patient_dir / "301", ExplicitVRLittleEndian, range(3),
+                                first_file=9001)
+        record["series"].append({"folder": "301", "description": "LOCALIZER", "echo": None,
+                                 "syntax": "explicit", "slices": 3, "missing_slices": 0, "expected": "failed"})
+
+    if args.duplicates > 0:
+        # 재-export: 같은 파일(SOPInstanceUID 동일)이 다른 폴더/이름으로 한 번 더 들어옴
+        n_dup = int(round(len(written) * args.duplicates))
+        picks = sorted(rng.choice(len(written), size=n_dup, replace=False).tolist())
+        dup_dir = patient_dir / f"SA{patient_id}"
+        dup_dir.mkdir(parents=True, exist_ok=True)
+        for k, i in enumerate(picks):
+            with open(str(written[i]), "rb") as src, open(str(dup_dir / f"{k + 1:08d}.dcm"), "wb") as dst:
+                dst.write(src.read())
+        record["duplicates"] = n_dup
+
+    for j in range(args.junk):
+        name, payload = JUNK_FILES[j % len(JUNK_FILES)]
+        folder = patient_dir / ("" if j % 2 == 0 else str((j % n_series + 3) * 100 + 1))
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / (name if j < len(JUNK_FILES) else f"{j}_{name}")).write_bytes(payload)
+        record["junk"] += 1
+    if args.junk and written:
+        # 잘린 DICOM (헤더 일부만 남은 전송 실패 파일)
+        # 헤더 앞부분만 읽혀 UnknownSeries 폴더 하나로 분류되고 변환은 실패
+        with open(str(written[0]), "rb") as f:
+            (patient_dir / "truncated.dcm").write_bytes(f.read(200))
+        record["junk"] += 1
+        record["series"].append({"folder": "", "description": "UnknownSeries", "echo": None, "syntax": "",
+                                 "slices": 1, "missing_slices": 0, "expected": "failed"})
+
+    files = [os.path.join(r, f) for r, _, fs in os.walk(str(patient_dir)) for f in fs]
+    record["files"] = len(files)
+    record["bytes"] = sum(os.path.getsize(f) for f in files)
+    return record
+
+
+def generate_cohort(output, patients=4, series=3, slices=64, size=256, syntaxes=("explicit",),
+                    missing_slices=0, duplicates=0.0, mixed=False, junk=0, seed=0):
+    args = argparse.Namespace(series=series, slices=slices, size=size, syntaxes=list(syntaxes),
+                              missing_slices=missing_slices, duplicates=duplicates, mixed=mixed, junk=junk)
+    for name in args.syntaxes:
+        if name not in SYNTAXES:
+            raise ValueError(f"unknown transfer syntax '{name}' (choose from {', '.join(SYNTAXES)})")
+
+    root = Path(output)
+    root.mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)
+
+    print(f"🧪 Synthetic cohort: {patients} patients x {series} series x {slices} slices ({size}x{size})")
+    manifest = {"pydicom": pydicom.__version__, "settings": dict(vars(args), patients=patients, seed=seed),
+                "patients": []}
+    for p in range(patients):
+        patient_id = f"SYN{p + 1:04d}"
+        record = generate_patient(root, patient_id, args, rng)
+        manifest["patients"].append(record)
+        print(f"   ✅ {patient_id}: {record['files']} files, {record['bytes'] / float(1 << 20):.1f} MB"
+              + (f", {record['duplicates']} duplicates" if record["duplicates"] else ""))
+
+    with open(str(root / "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"🎉 Written to {root} (manifest.json)")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic DICOM cohort generator for to3d benchmarks")
+    parser.add_argument("--output", required=True, help="생성할 raw data 폴더 (환자 폴더들 + manifest.json)")
+    parser.add_argument("--patients", type=int, default=4)
+    parser.add_argument("--series", type=int, default=3, help=f"환자당 시리즈 수 (최대 {len(SERIES_TYPES)})")
+    parser.add_argument("--slices", type=int, default=64, help="시리즈당 slice 수")
+    parser.add_argument("--size", type=int, default=256, help="slice 크기 (size x size)")
+    parser.add_argument("--syntaxes", nargs="+", default=["explicit"], choices=sorted(SYNTAXES),
+                        help="시리즈마다 돌아가며 사용할 transfer syntax")
+    parser.add_argument("--missing-slices", type=int, default=0, help="환자당 slice 묶음이 빠진 시리즈 수")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="다른 폴더로 한 번 더 export할 instance 비율")
+    parser.add_argument("--mixed", action="store_true", help="폴더에 다른 시리즈 섞기 + 첫 시리즈를 dual-echo로")
+    parser.add_argument("--junk", type=int, default=0, help="환자당 DICOM이 아닌 파일 수 (+ 잘린 DICOM 1개)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_cohort(args.output, args.patients, args.series, args.slices, args.size, args.syntaxes,
+                    args.missing_slices, args.duplicates, args.mixed, args.junk, args.seed)
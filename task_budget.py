@@ -0,0 +1,128 @@
+"""
+작업별 wall-clock 예산 (hung worker watchdog)
+
+변환/defacing 작업을 별도 worker 프로세스에서 실행하고, 예산(초)을 넘기면 프로세스를 강제 종료한 뒤
+TaskTimeout을 발생시킵니다. 호출한 쪽은 timeout으로 기록하고 다음 작업을 계속 진행하면 됩니다.
+worker는 재사용되며(모델 등 초기화 비용은 한 번만), 종료된 경우 다음 작업 때 다시 시작됩니다.
+"""
+
+import multiprocessing as mp
+import sys
+import time
+
+_state = None
+
+
+class TaskTimeout(Exception):
+    """작업이 예산 시간을 넘겨 worker가 종료됨"""
+
+
+def worker_state():
+    """worker 프로세스 안에서 init_fn 결과 (예: 모델이 로드된 Defacer)"""
+    return _state
+
+
+def _worker_loop(conn, init_fn, init_kwargs):
+    global _state
+    try:
+        _state = init_fn(**init_kwargs) if init_fn is not None else None
+        conn.send(("ready", None))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, args, kwargs = task
+        try:
+            result = ("ok", fn(*args, **kwargs))
+        except Exception as e:
+            result = ("error", f"{type(e).__name__}: {e}")
+        sys.stdout.flush()
+        conn.send(result)
+
+
+class BudgetedWorker(object):
+    """
+    작업을 전용 프로세스에서 실행. call(fn, args, seconds=...)이 예산을 넘기면 프로세스를 kill 하고 TaskTimeout.
+    fn/args는 pickle 가능해야 합니다 (모듈 최상위 함수).
+    """
+
+    def __init__(self, init_fn=None, init_kwargs=None, name="task-worker", startup_timeout=None):
+        self.init_fn = init_fn
+        self.init_kwargs = init_kwargs or {}
+        self.name = name
+        self.startup_timeout = startup_timeout
+        self.restarts = 0
+        self._ctx = mp.get_context("spawn")
+        self._proc = None
+        self._conn = None
+
+    def _start(self):
+        parent, child = self._ctx.Pipe()
+        self._proc = self._ctx.Process(target=_worker_loop, args=(child, self.init_fn, self.init_kwargs),
+                                       name=self.name, daemon=True)
+        self._proc.start()
+        child.close()
+        self._conn = parent
+        # 초기화(모델 로드 등)는 작업 예산에 포함하지 않음
+        if self.startup_timeout is not None and not parent.poll(self.startup_timeout):
+            self._kill()
+            raise TaskTimeout(f"{self.name} did not start within {self.startup_timeout:.0f}s")
+        status, payload = self._recv()
+        if status != "ready":
+            self._kill()
+            raise RuntimeError(f"{self.name} failed to start: {payload}")
+
+    def _recv(self):
+        try:
+            return self._conn.recv()
+        except EOFError:
+            code = self._proc.exitcode if self._proc is not None else None
+            self._kill()
+            raise RuntimeError(f"{self.name} exited unexpectedly (exit code {code})")
+
+    def _kill(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.join(5)
+            if self._proc.is_alive():
+                self._proc.kill()
+                self._proc.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._proc = None
+        self._conn = None
+
+    def call(self, fn, args=(), kwargs=None, seconds=None):
+        if self._proc is None or not self._proc.is_alive():
+            if self._proc is not None:
+                self.restarts += 1
+                self._kill()
+            self._start()
+
+        start = time.time()
+        self._conn.send((fn, tuple(args), kwargs or {}))
+        if seconds and not self._conn.poll(seconds):
+            self._kill()
+            self.restarts += 1
+            raise TaskTimeout(f"exceeded {seconds:g}s budget (killed after {time.time() - start:.1f}s)")
+
+        status, payload = self._recv()
+        if status != "ok":
+            raise RuntimeError(payload)
+        return payload
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.send(None)
+                self._proc.join(5)
+            except (OSError, EOFError):
+                pass
+        self._kill()
@@ -1,20 +1,27 @@
 """
 python to3d.py --input ./raw_data --output ./processed/3d_input
+python to3d.py --input ./raw_data --output ./processed/3d_input --uncompressed   # 중간 결과를 .nii 로 (run_defacer가 memmap으로 읽음)
+python to3d.py --input ./raw_data --output ./processed/3d_input --shard 0/4   # 여러 노드로 나눠 실행
 """
 
+import io
 import os
 import shutil
 import re
+import time
 import argparse
 import pydicom
-import dicom2nifti
-import dicom2nifti.convert_dicom as convert_dicom
 import numpy as np
 import logging
 from pathlib import Path
-import pandas as pd
+from sharding import in_shard, parse_shard, qc_report_path
+from scanner import scan_tree
+from dicom_archive import DicomArchive, archive_stem, is_archive
+from run_metrics import RunMetrics
+from task_budget import BudgetedWorker, TaskTimeout
 
-# 불필요한 경고 메시지 숨김
+# pandas, dicom2nifti 는 변환 단계에서 import (--help 등이 바로 실행되도록). 확인: python check_startup.py
+# 불필요한 경고 메시지 숨김 (logger는 이름으로 설정되므로 import 전에 지정해도 적용됨)
 logging.getLogger('dicom2nifti').setLevel(logging.CRITICAL)
 
 # ============================================================
@@ -28,10 +35,120 @@ def safe_name(name: str) -> str:
     name = re.sub(r'[^A-Za-z0-9_\-]', '_', name)
     return name
 
-def organize_dicom_folder(src_dir: Path, temp_base: Path) -> Path:
+def _header_value(ds, keyword):
+    value = ds.get(keyword, None)
+    return "" if value is None else str(value)
+
+def _split_by(files, keyword):
+    """
+    EchoNumbers/AcquisitionNumber 값으로 나눔. 값이 하나뿐이거나, 나눈 묶음 중 파일 1개짜리가 있으면
+    (slice마다 번호가 붙는 장비) 나누지 않음
+    """
+    groups = {}
+    for item in files:
+        groups.setdefault(item[1][keyword], []).append(item)
+    if len(groups) < 2 or min(len(g) for g in groups.values()) < 2:
+        return [("", files)]
+    return sorted(groups.items(), key=lambda kv: (len(kv[0]), kv[0]))
+
+def group_series(files):
+    """
+    (path, meta) 목록을 촬영(acquisition) 단위로 묶고 폴더 이름을 붙임.
+    - 묶음 기준: SeriesInstanceUID (+ EchoNumbers / AcquisitionNumber 분리)
+    - 이름: safe_name(SeriesDescription). 같은 이름이 여러 촬영이면 SeriesNumber/echo/acq 접미사로 구분
+    반환: [(폴더 이름, [path, ...]), ...]
+    """
+    by_series = {}
+    for path, meta in files:
+        # SeriesInstanceUID가 없으면 기존처럼 SeriesDescription으로 묶음
+        key = meta["SeriesInstanceUID"] or f"desc:{meta['SeriesDescription']}"
+        by_series.setdefault(key, []).append((path, meta))
+
+    acquisitions = []
+    for key, items in by_series.items():
+        meta = items[0][1]
+        for echo, echo_items in _split_by(items, "EchoNumbers"):
+            for acq, acq_items in _split_by(echo_items, "AcquisitionNumber"):
+                acquisitions.append({
+                    "desc": safe_name(meta["SeriesDescription"]),
+                    "series_number": meta["SeriesNumber"],
+                    "echo": echo,
+                    "acq": acq,
+                    "uid": key,
+                    "files": [p for p, _ in acq_items],
+                })
+
+    # 실행마다 같은 이름이 붙도록 정렬 (SeriesNumber -> UID -> echo -> acq)
+    def order(a):
+        number = int(a["series_number"]) if a["series_number"].isdigit() else float("inf")
+        return (number, a["uid"], len(a["echo"]), a["echo"], len(a["acq"]), a["acq"])
+    acquisitions.sort(key=order)
+
+    name_count = {}
+    for a in acquisitions:
+        name_count[a["desc"]] = name_count.get(a["desc"], 0) + 1
+
+    named, used = [], set()
+    for a in acquisitions:
+        name = a["desc"]
+        if name_count[name] > 1:
+            # 설명이 같은 다른 촬영(예: T1_SAG 반복 촬영)과 구분
+            parts = [name]
+            if a["series_number"]:
+                parts.append(f"s{safe_name(a['series_number'])}")
+            if a["echo"]:
+                parts.append(f"e{safe_name(a['echo'])}")
+            if a["acq"]:
+                parts.append(f"a{safe_name(a['acq'])}")
+            name = "_".join(parts)
+        base, i = name, 2
+        while name in used:
+            name = f"{base}_{i}"
+            i += 1
+        used.add(name)
+        named.append((name, a["files"]))
+    return named
+
+def _header_meta(ds):
+    # 시리즈 명칭 추출 (없으면 Unknown), 촬영 구분용 UID/번호
+    return {
+        "SeriesDescription": _header_value(ds, "SeriesDescription") or "UnknownSeries",
+        "SeriesInstanceUID": _header_value(ds, "SeriesInstanceUID"),
+        "SeriesNumber": _header_value(ds, "SeriesNumber"),
+        "EchoNumbers": _header_value(ds, "EchoNumbers"),
+        "AcquisitionNumber": _header_value(ds, "AcquisitionNumber"),
+    }
+
+def _keep_instance(chosen, key, ref, meta, rank):
+    """
+    instance key별로 남길 파일 하나를 chosen[key] = (ref, meta, rank 또는 None)에 기록. 중복이면 True.
+    rank(ref)는 중복일 때만 호출 (작을수록 우선, 파일마다 stat 하지 않음)
+    """
+    if key not in chosen:
+        chosen[key] = (ref, meta, None)
+        return False
+    prev_ref, prev_meta, prev_rank = chosen[key]
+    if prev_rank is None:
+        prev_rank = rank(prev_ref)
+    new_rank = rank(ref)
+    if new_rank < prev_rank:
+        chosen[key] = (ref, meta, new_rank)
+    else:
+        chosen[key] = (prev_ref, prev_meta, prev_rank)
+    return True
+
+def _duplicate_rank(f, src_dir):
+    """중복 instance 중 남길 파일 우선순위: 파일 크기가 큰 쪽(잘린 사본 제외) -> 상대 경로 사전순"""
+    return (-f.stat().st_size, str(f.relative_to(src_dir)))
+
+def organize_dicom_folder(src_dir: Path, temp_base: Path, files=None):
     """
     [핵심] 원본 폴더(SA..., 301, 501 등)를 읽어 
-    실제 촬영 명칭(SeriesDescription)으로 된 임시 폴더로 정리합니다.
+    촬영(SeriesInstanceUID, echo/acquisition) 단위의 임시 폴더로 정리합니다.
+    폴더 이름은 실제 촬영 명칭(SeriesDescription)을 사용하고, 같은 명칭의 다른 촬영은 접미사로 구분합니다.
+    같은 SOPInstanceUID가 여러 번 export된 경우(예: 301/ 과 재-export된 SA.../) 한 파일만 복사합니다.
+    files: 환자 폴더 아래 파일 목록 (scanner inventory). 없으면 여기서 탐색
+    반환: (정리된 환자 폴더, 제외된 중복 instance 수)
     """
     # 임시 정리 폴더: temp/환자ID
     patient_id = src_dir.name
@@ -40,45 +157,116 @@ def organize_dicom_folder(src_dir: Path, temp_base: Path) -> Path:
 
     print(f"   Note: 정리 중... {src_dir.name}")
     
-    # 재귀적으로 모든 파일 탐색 (.dcm 확장자가 없어도 읽어봄)
-    for f in src_dir.rglob("*"):
-        if not f.is_file(): continue
-        
+    # 1) 헤더만 읽어 instance별로 남길 파일 결정 (중복 파일은 복사/픽셀 읽기 모두 생략)
+    chosen = {}  # instance key -> (path, meta, 중복 비교용 rank 또는 None)
+    duplicates = 0
+    if files is None:
+        files = scan_tree(src_dir).files()
+    # 모든 파일을 읽어봄 (.dcm 확장자가 없어도), 실행마다 같은 결과가 나오도록 정렬
+    for f in sorted(files):
         try:
             # 픽셀 데이터 제외하고 헤더만 빠르게 읽기
             ds = pydicom.dcmread(str(f), stop_before_pixels=True)
-            
-            # 시리즈 명칭 추출 (없으면 Unknown)
-            series_desc = ds.get("SeriesDescription", "UnknownSeries")
-            safe_desc = safe_name(series_desc)
-            
-            # 목표 폴더: temp/환자ID/T1_Axial 등
-            target_dir = dest_parent / safe_desc
-            target_dir.mkdir(exist_ok=True)
-            
-            # 파일 복사
-            shutil.copy2(str(f), str(target_dir / f.name))
-            
         except Exception:
             continue # DICOM 아닌 파일은 무시
 
-    return dest_parent
+        # SOPInstanceUID가 없는 파일은 중복 판단 없이 그대로 유지
+        key = str(ds.get("SOPInstanceUID", "")) or f"path:{f}"
+        duplicates += _keep_instance(chosen, key, f, _header_meta(ds), lambda p: _duplicate_rank(p, src_dir))
+
+    # 2) 남은 파일만 촬영 단위 폴더로 복사
+    for series_name, series_files in group_series([(f, meta) for f, meta, _ in chosen.values()]):
+        # 목표 폴더: temp/환자ID/T1_Axial 등
+        target_dir = dest_parent / series_name
+        target_dir.mkdir(exist_ok=True)
+        
+        used_names = set()
+        for f in series_files:
+            # 파일 복사 (다른 원본 폴더의 같은 파일명은 번호를 붙여 덮어쓰기 방지)
+            name, n = f.name, 1
+            while name in used_names:
+                name = f"{f.name}_{n}"
+                n += 1
+            used_names.add(name)
+            shutil.copy2(str(f), str(target_dir / name))
+
+    if duplicates:
+        print(f"   Note: 중복 instance {duplicates}개 제외 (SOPInstanceUID 기준)")
+    return dest_parent, duplicates
+
+def organize_archive(archive):
+    """
+    열려 있는 DicomArchive(환자 zip/tar export)를 풀지 않고 정리. 멤버마다 pixel data 직전까지만 읽어
+    organize_dicom_folder와 같은 기준으로 중복 제거 + 촬영 단위로 묶습니다. 멤버 내용은 보관하지 않음.
+    반환: ([(시리즈 이름, [멤버 이름, ...]), ...], 제외된 중복 instance 수)
+    """
+    print(f"   Note: 정리 중... {archive.path.name} (archive)")
+
+    headers = []
+    for name, fp in archive.iter_open():
+        try:
+            ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        except Exception:
+            continue # DICOM 아닌 멤버는 무시
+        key = str(ds.get("SOPInstanceUID", "")) or f"path:{name}"
+        headers.append((name, key, _header_meta(ds), archive.size(name)))
+
+    # 폴더와 같은 tie-break (크기가 큰 쪽 -> 이름 사전순), 실행마다 같은 결과가 나오도록 이름순 처리
+    sizes = {name: size for name, _, _, size in headers}
+    chosen = {}
+    duplicates = 0
+    for name, key, meta, _ in sorted(headers, key=lambda h: h[0]):
+        duplicates += _keep_instance(chosen, key, name, meta, lambda n: (-sizes[n], n))
+
+    series = group_series([(name, meta) for name, meta, _ in chosen.values()])
+    if duplicates:
+        print(f"   Note: 중복 instance {duplicates}개 제외 (SOPInstanceUID 기준)")
+    return series, duplicates
+
+def iter_archive_series(archive, series):
+    """
+    organize_archive 결과의 시리즈별 멤버 내용을 (시리즈 이름, [bytes, ...])로 하나씩 넘김.
+    - zip: 시리즈 순서대로 해당 멤버만 읽음
+    - tar: 앞에서부터 한 번만 훑으며 (압축 해제 1회), 멤버가 모두 모인 시리즈부터 바로 넘기고 버림
+      (남길 멤버만 보관, 시리즈가 archive 안에서 섞여 있지 않으면 메모리는 시리즈 하나 크기)
+    """
+    if not archive.sequential:
+        for series_name, members in series:
+            payloads = dict((name, fp.read()) for name, fp in archive.iter_open(members))
+            yield series_name, [payloads[n] for n in members]
+        return
+
+    owner = {name: i for i, (_, members) in enumerate(series) for name in members}
+    missing = [len(members) for _, members in series]
+    payloads = [{} for _ in series]
+    for name, fp in archive.iter_open(list(owner)):
+        i = owner[name]
+        payloads[i][name] = fp.read()
+        missing[i] -= 1
+        if not missing[i]:
+            series_name, members = series[i]
+            data, payloads[i] = payloads[i], None
+            yield series_name, [data[n] for n in members]
 
 # ============================================================
 # [Logic 2] 구조대 (Rescuer)
 # 역할: 일반 변환 실패 시, 슬라이스 위치를 분석해 가장 긴 연속 구간을 살려냄
 # ============================================================
 
-def attempt_rescue_conversion(series_folder_path, temp_output_dir):
+def attempt_rescue_conversion(series_folder_path, temp_output_dir, compress=True, datasets=None):
     """
     [핵심] dicom2nifti가 포기한 데이터를 살려내는 함수
     Z축(높이) 위치를 분석하여 끊기지 않고 연속된 슬라이스 뭉치를 찾아냅니다.
+    datasets: 이미 메모리에 읽은 pydicom dataset 목록 (archive 변환), 주어지면 폴더 대신 사용
     """
     print("      -> 🚑 구조 모드(Rescue Mode) 진입...")
     dicom_slices = []
     
     # 1. 폴더 내 파일들의 위치 정보 수집
-    for filename in os.listdir(series_folder_path):
+    for ds in datasets or []:
+        if 'ImagePositionPatient' in ds:
+            dicom_slices.append({'ds': ds, 'pos': ds.ImagePositionPatient, 'inst': ds.InstanceNumber})
+    for filename in (os.listdir(series_folder_path) if datasets is None else []):
         filepath = os.path.join(series_folder_path, filename)
         try:
             dcm = pydicom.dcmread(filepath, stop_before_pixels=True)
@@ -131,12 +319,13 @@ def attempt_rescue_conversion(series_folder_path, temp_output_dir):
     if len(longest_group) > 10:
         print(f"      -> ✅ 연속된 {len(longest_group)}개 슬라이스 구조 성공! 변환 시도.")
         try:
-            dicom_objects = [pydicom.dcmread(s['path']) for s in longest_group]
-            temp_nii_name = "rescued_temp.nii.gz"
+            dicom_objects = [s['ds'] if 'ds' in s else pydicom.dcmread(s['path']) for s in longest_group]
+            temp_nii_name = "rescued_temp.nii.gz" if compress else "rescued_temp.nii"
             temp_nii_path = os.path.join(temp_output_dir, temp_nii_name)
             
             # 로우레벨 변환 함수 호출
-            convert_dicom.dicom_array_to_nifti(dicom_objects, temp_nii_path, reorient=True)
+            import dicom2nifti.convert_dicom as convert_dicom
+            convert_dicom.dicom_array_to_nifti(dicom_objects, temp_nii_path, reorient_nifti=True)
             return temp_nii_path
         except Exception as e:
             print(f"      -> ❌ 구조 중 에러 발생: {e}")
@@ -149,13 +338,109 @@ def attempt_rescue_conversion(series_folder_path, temp_output_dir):
 # [Main] 실행 파이프라인
 # ============================================================
 
-def process_to_nifti(input_root, output_root):
+def remove_stray_outputs(out_dir, patient_id):
+    # dicom2nifti/구조 모드가 남긴 랜덤 이름 파일 삭제 (환자ID가 포함된 최종 파일만 남김)
+    for pattern in ("*.nii.gz", "*.nii"):
+        for gf in Path(out_dir).glob(pattern):
+            if patient_id not in gf.name:
+                gf.unlink()
+
+def convert_series(series_dir, final_path, patient_id, save_name, compress=True):
+    """
+    시리즈 폴더 하나를 final_path로 변환. 반환: "converted" | "rescued" | None(실패)
+    compress=False 이면 비압축 .nii 로 저장 (final_path/save_name도 .nii 여야 함)
+    (series_timeout 지정 시 BudgetedWorker 프로세스 안에서 실행됨)
+    """
+    import dicom2nifti
+
+    try:
+        # 1차 시도: 표준 변환 (dicom2nifti)
+        # 임시로 저장할 곳
+        dicom2nifti.convert_directory(str(series_dir), str(final_path.parent), 
+                                    compression=compress, reorient=True)
+        
+        # dicom2nifti는 랜덤한 이름(예: 4_series.nii.gz)으로 저장하므로
+        # 방금 생성된 파일을 찾아 내가 원하는 이름으로 변경해야 함
+        generated_files = sorted(list(final_path.parent.glob("*.nii.gz" if compress else "*.nii")), 
+                               key=os.path.getmtime, reverse=True)
+        
+        found = False
+        for gf in generated_files:
+            # 파일명이 내가 지정한 save_name과 다르고, 환자ID가 포함 안 된(랜덤생성된) 파일 찾기
+            if gf.name != save_name and patient_id not in gf.name:
+                gf.rename(final_path)
+                found = True
+                break
+        
+        # 남은 랜덤 생성 파일들 삭제 (중복 방지)
+        remove_stray_outputs(final_path.parent, patient_id)
+        
+        if found:
+            print("✅ Success")
+            return "converted"
+        else:
+            raise Exception("변환된 파일을 찾을 수 없음")
+
+    except Exception:
+        # 2차 시도: 실패 시 구조대 호출
+        rescued_file = attempt_rescue_conversion(str(series_dir), str(final_path.parent), compress=compress)
+        if rescued_file:
+            os.rename(rescued_file, final_path)
+            print("✅ Success (Rescued)")
+            return "rescued"
+        else:
+            print("❌ Failed")
+            return None
+
+def convert_archive_series(payloads, final_path, compress=True):
+    """
+    archive 안 시리즈 하나(iter_archive_series가 읽은 멤버 내용)를 final_path로 변환.
+    반환: "converted" | "rescued" | None(실패). archive를 다시 열지 않고, 디스크에는 결과 NIfTI만 씀
+    """
+    import dicom2nifti.convert_dicom as convert_dicom
+
+    datasets = [pydicom.dcmread(io.BytesIO(data)) for data in payloads]
+
+    # 환자ID가 없는 임시 이름으로 쓰고 끝난 뒤 rename
+    # (timeout으로 중단되면 remove_stray_outputs가 지우므로, 잘린 파일이 다음 실행에서 '이미 존재'로 스킵되지 않음)
+    temp_path = final_path.parent / ("archive_series_tmp" + (".nii.gz" if compress else ".nii"))
+    try:
+        # 1차 시도: 표준 변환 (dicom2nifti)
+        convert_dicom.dicom_array_to_nifti(datasets, str(temp_path), reorient_nifti=True)
+        os.replace(str(temp_path), str(final_path))
+        print("✅ Success")
+        return "converted"
+    except Exception:
+        if temp_path.exists():
+            temp_path.unlink()
+        # 2차 시도: 실패 시 구조대 호출
+        rescued_file = attempt_rescue_conversion(None, str(final_path.parent), compress=compress, datasets=datasets)
+        if rescued_file:
+            os.rename(rescued_file, final_path)
+            print("✅ Success (Rescued)")
+            return "rescued"
+        print("❌ Failed")
+        return None
+
+def nifti_voxels(nifti_path):
+    """변환 결과의 voxel 수 (헤더만 읽음, 처리량 지표용)"""
+    import nibabel as nib
+    try:
+        return int(np.prod(nib.load(str(nifti_path)).shape))
+    except Exception:
+        return 0
+
+def process_to_nifti(input_root, output_root, patients=None, shard=None, metrics_file=None, metrics_interval=15.0,
+                     series_timeout=None, compress=True):
+    import pandas as pd
+
     input_path = Path(input_root)
     output_path = Path(output_root)
     output_path.mkdir(parents=True, exist_ok=True)
 
     # ========== [QC] CSV 초기화 ==========
-    qc_csv_path = output_path.parent / "qc_report.csv"
+    # shard 실행 시 shard별 QC 조각에 기록 (sharding.py merge 로 병합)
+    qc_csv_path = qc_report_path(output_path.parent, shard)
     if qc_csv_path.exists():
         qc_df = pd.read_csv(qc_csv_path)
     else:
@@ -170,28 +455,66 @@ def process_to_nifti(input_root, output_root):
     print(f"   Input: {input_path}")
     print(f"   Output: {output_path}")
 
+    # 실행 지표 (시리즈 변환 처리량/지연/실패), metrics_file 지정 시 Prometheus textfile로 주기적 저장
+    metrics = RunMetrics("to3d", metrics_file, interval=metrics_interval)
+
     # 1. 환자 폴더 순회
-    # 예: SA00013..., SA00031... 폴더들을 찾음
-    patient_folders = sorted([p for p in input_path.iterdir() if p.is_dir()])
+    # 예: SA00013..., SA00031... 폴더들을 찾음 (patients/shard 지정 시 해당 환자만)
+    # 입력 트리는 여기서 한 번만 탐색하고, 환자별 DICOM 정리에는 이 파일 목록을 사용
+    wanted = set(patients) if patients is not None else None
+    inventory = scan_tree(input_path, select=lambda name: (wanted is None or name in wanted)
+                          and in_shard(name, shard))
+    metrics.observe("scan", inventory.seconds)
+    patient_sources = [(name, input_path / name) for name in inventory.patients()]
+    # zip/tar export도 환자 입력으로 처리 (환자ID = 확장자를 뺀 파일 이름, 압축은 풀지 않음)
+    # 같은 ID의 폴더가 있으면 폴더를 사용
+    archives = {}
+    for f in inventory.root_files():
+        patient_id = archive_stem(f)
+        if (is_archive(f.name) and not inventory.has_patient(patient_id)
+                and (wanted is None or patient_id in wanted) and in_shard(patient_id, shard)):
+            archives[patient_id] = f
+    patient_sources = sorted(patient_sources + list(archives.items()))
+    print(f"   Scan: {inventory.summary()}" + (f", {len(archives)} archives" if archives else ""))
+    if shard is not None:
+        print(f"   Shard: {shard[0]}/{shard[1]} ({len(patient_sources)} patients)")
+    remaining = {"patients": len(patient_sources)}
+    metrics.gauge("patients_pending", lambda: remaining["patients"])
+
+    # series_timeout: 시리즈별 변환 시간 예산(초). 비정상 시리즈가 전체 ingest를 멈추지 않도록 격리 실행
+    series_worker = None
+    if series_timeout:
+        series_worker = BudgetedWorker(name="to3d-worker")
+        print(f"   Series budget: {series_timeout:g}s")
     
-    for patient_dir in patient_folders:
-        patient_id = patient_dir.name
+    for patient_id, patient_src in patient_sources:
+        remaining["patients"] -= 1
         print(f"\n🔹 Processing Patient: {patient_id}")
 
         # ========== [QC] 카운터 초기화 ==========
         series_total = 0
         convert_success = 0
+        series_timeouts = []
         # =======================================
         
         # [Step 1] 복잡한 폴더 구조(301, 501...)를 깔끔하게(T1, FLAIR...) 정리
-        organized_patient_dir = organize_dicom_folder(patient_dir, temp_workspace)
+        # archive는 환자당 한 번만 열고, 복사 없이 시리즈별 멤버 목록만 만듦 (내용은 Step 2에서 시리즈 단위로 읽음)
+        archive = None
+        with metrics.timed("organize"):
+            if patient_id in archives:
+                archive = DicomArchive(patient_src)
+                archive_series, duplicates_dropped = organize_archive(archive)
+                series_sources = iter_archive_series(archive, archive_series)
+            else:
+                organized_patient_dir, duplicates_dropped = organize_dicom_folder(patient_src, temp_workspace,
+                                                                                  inventory.files(patient_id))
+                series_sources = [(d.name, d) for d in organized_patient_dir.iterdir() if d.is_dir()]
         
-        # [Step 2] 정리된 폴더별로 NIfTI 변환 수행
-        for series_dir in organized_patient_dir.iterdir():
-            if not series_dir.is_dir(): continue
-            
-            series_name = series_dir.name  # 예: T1_Axial
-            save_name = f"{patient_id}_{series_name}.nii.gz"
+        # [Step 2] 정리된 시리즈별로 NIfTI 변환 수행
+        for series_name, series_src in series_sources:
+            # series_name 예: T1_Axial
+            # compress=False: 중간 결과를 비압축 .nii 로 저장 (디스크 대신 run_defacer 읽기 속도 우선)
+            save_name = f"{patient_id}_{series_name}" + (".nii.gz" if compress else ".nii")
             final_path = output_path / patient_id / save_name
             
             # 이미 변환된 파일 있으면 스킵
@@ -205,65 +528,67 @@ def process_to_nifti(input_root, output_root):
             # 환자별 결과 폴더 생성
             final_path.parent.mkdir(parents=True, exist_ok=True)
 
-            print(f"   - Converting: {series_name} ... ", end="")
+            print(f"   - Converting: {series_name} ... ", end="", flush=True)
+            series_start = time.time()
             
+            if patient_id in archives:
+                convert_fn, convert_args = convert_archive_series, (series_src, final_path, compress)
+            else:
+                convert_fn, convert_args = convert_series, (series_src, final_path, patient_id, save_name, compress)
             try:
-                # 1차 시도: 표준 변환 (dicom2nifti)
-                # 임시로 저장할 곳
-                dicom2nifti.convert_directory(str(series_dir), str(final_path.parent), 
-                                            compression=True, reorient=True)
-                
-                # dicom2nifti는 랜덤한 이름(예: 4_series.nii.gz)으로 저장하므로
-                # 방금 생성된 파일을 찾아 내가 원하는 이름으로 변경해야 함
-                generated_files = sorted(list(final_path.parent.glob("*.nii.gz")), 
-                                       key=os.path.getmtime, reverse=True)
-                
-                found = False
-                for gf in generated_files:
-                    # 파일명이 내가 지정한 save_name과 다르고, 환자ID가 포함 안 된(랜덤생성된) 파일 찾기
-                    if gf.name != save_name and patient_id not in gf.name:
-                        gf.rename(final_path)
-                        found = True
-                        break
-                
-                # 남은 랜덤 생성 파일들 삭제 (중복 방지)
-                for gf in final_path.parent.glob("*.nii.gz"):
-                    if patient_id not in gf.name:
-                        gf.unlink()  # 삭제
-                
-                if found:
-                    print("✅ Success")
-                    convert_success += 1  # [QC]
-                else:
-                    raise Exception("변환된 파일을 찾을 수 없음")
-
-            except Exception:
-                # 2차 시도: 실패 시 구조대 호출
-                rescued_file = attempt_rescue_conversion(str(series_dir), str(final_path.parent))
-                if rescued_file:
-                    os.rename(rescued_file, final_path)
-                    print("✅ Success (Rescued)")
-                    convert_success += 1  # [QC]
+                # 시간 예산 지정 시 worker 프로세스에서 변환 (예산 초과 시 강제 종료 후 다음 시리즈로)
+                if series_worker is not None:
+                    status = series_worker.call(convert_fn, convert_args, seconds=series_timeout)
                 else:
-                    print("❌ Failed")
+                    status = convert_fn(*convert_args)
+            except TaskTimeout as e:
+                print(f"⏱️ Timeout ({e})")
+                remove_stray_outputs(final_path.parent, patient_id)
+                series_timeouts.append(series_name)
+                metrics.timeout("convert")
+                continue
+            except Exception as e:
+                print(f"❌ Failed ({e})")
+                status = None
+
+            if status is not None:
+                convert_success += 1  # [QC]
+                metrics.observe("convert" if status == "converted" else "rescue", time.time() - series_start)
+                metrics.add_volume(nifti_voxels(final_path))
+            else:
+                metrics.fail("convert")
+
+        if archive is not None:
+            archive.close()
 
         # ========== [QC] CSV 업데이트 (환자 하나 완료 시마다) ==========
         nifti_conversion = f"{convert_success}/{series_total}"
         
+        timeout_str = "; ".join(series_timeouts)
+        
         if patient_id in qc_df["case_id"].values:
             qc_df.loc[qc_df["case_id"] == patient_id, "nifti_conversion"] = nifti_conversion
+            if timeout_str or "conversion_timeouts" in qc_df.columns:
+                qc_df.loc[qc_df["case_id"] == patient_id, "conversion_timeouts"] = timeout_str
+            qc_df.loc[qc_df["case_id"] == patient_id, "duplicates_dropped"] = duplicates_dropped
         else:
             new_row = pd.DataFrame([{
                 "case_id": patient_id,
                 "nifti_conversion": nifti_conversion,
                 "defacing_target": "",
                 "defacing_done": "",
-                "error_files": ""
+                "error_files": "",
+                "conversion_timeouts": timeout_str,
+                "duplicates_dropped": duplicates_dropped
             }])
             qc_df = pd.concat([qc_df, new_row], ignore_index=True)
         
+        # NaN이 섞인 열은 float(40.0)로 저장되므로 정수 열로 변환 (값이 없는 환자는 빈 칸)
+        qc_df["duplicates_dropped"] = qc_df["duplicates_dropped"].astype("Int64")
         qc_df.to_csv(qc_csv_path, index=False)
-        print(f"   📊 [QC] {patient_id}: {nifti_conversion} → CSV 업데이트")
+        print(f"   📊 [QC] {patient_id}: {nifti_conversion}"
+              + (f" (timeout: {timeout_str})" if timeout_str else "")
+              + (f" (중복 {duplicates_dropped}개 제외)" if duplicates_dropped else "") + " → CSV 업데이트")
         # =============================================================
 
     # [Cleanup] 임시 폴더 삭제
@@ -273,13 +598,31 @@ def process_to_nifti(input_root, output_root):
     except:
         pass
 
+    metrics.close()
+    if series_worker is not None:
+        series_worker.close()
     print(f"\n🎉 모든 변환 작업 완료! 저장 위치: {output_path}")
+    if series_timeout:
+        overruns = sum(metrics.timeouts.values())
+        print(f"⏱️ Budget overruns: {overruns} series over {series_timeout:g}s")
+    metrics.print_summary()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="DICOM to NIfTI Converter with Rescue Mode")
     parser.add_argument("--input", required=True, help="Raw Data 폴더 경로 (예: raw_data)")
     parser.add_argument("--output", required=True, help="결과 NIfTI 저장 경로 (예: nifti_output)")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="i/N: 환자 폴더 이름 해시 기준 N개 중 i번째(0부터) shard만 처리")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Prometheus textfile 형식 실행 지표 저장 경로 (예: /var/lib/node_exporter/to3d.prom)")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="지표 파일 갱신 주기 (초)")
+    parser.add_argument("--uncompressed", action="store_true",
+                        help="NIfTI를 비압축 .nii 로 저장 (디스크 사용량 증가, run_defacer가 memmap으로 바로 읽음)")
+    parser.add_argument("--series-timeout", type=float, default=None,
+                        help="시리즈별 변환 시간 예산(초). 초과 시 변환 프로세스를 종료하고 QC에 timeout 기록")
     
     args = parser.parse_args()
     
-    process_to_nifti(args.input, args.output)
\ No newline at end of file
+    process_to_nifti(args.input, args.output, shard=args.shard,
+                     metrics_file=args.metrics_file, metrics_interval=args.metrics_interval,
+                     series_timeout=args.series_timeout, compress=not args.uncompressed)
\ No newline at end of file
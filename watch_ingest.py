@@ -0,0 +1,193 @@
+"""
+python watch_ingest.py --input ./raw_data --nifti ./processed/3d_input --output ./processed/defaced_output
+
+raw_data 폴더를 주기적으로 확인해서 새로 들어오거나 바뀐 환자 폴더만 변환(to3d) + defacing(run_defacer) 합니다.
+zip/tar export 파일도 to3d와 같이 환자 입력으로 처리합니다 (환자ID = 확장자를 뺀 파일 이름, 같은 ID의 폴더가 있으면 폴더 우선).
+
+- 처리된 환자는 환자/시리즈 폴더 mtime만 stat (폴더 안 항목이 추가/삭제/이름 변경되면 mtime이 바뀜)
+  -> 주기당 비용은 폴더 수에 비례, 파일 수와 무관
+- 전체 트리는 새 환자, 폴더 mtime이 바뀐 환자, 아직 처리 전(pending)인 환자만 다시 읽음
+- pending 환자는 파일별 (크기, mtime)을 인덱스 파일(_watch_index.json)에 저장해서 비교
+- 마지막 변경 후 --quiet 초 동안 변화가 없는(복사가 끝난) 환자만 처리 (제자리에서 복사 중인 파일도 크기/mtime으로 감지)
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+from dicom_archive import archive_stem, is_archive
+
+
+def scan_patient(patient_dir):
+    """
+    환자 폴더 아래 (모든 파일의 {상대경로: [크기, mtime]}, 하위 폴더의 {상대경로: mtime}).
+    복사 중인 파일은 폴더 mtime/파일 수가 그대로여도 크기/mtime이 바뀌므로 quiet 판단에 사용합니다.
+    """
+    files, dirs = {}, {}
+    stack = ["."]
+    while stack:
+        rel = stack.pop()
+        try:
+            with os.scandir(os.path.join(patient_dir, rel)) as it:
+                for entry in it:
+                    name = os.path.normpath(os.path.join(rel, entry.name))
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs[name] = entry.stat(follow_symlinks=False).st_mtime
+                            stack.append(name)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files[name] = [st.st_size, st.st_mtime]
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return files, dirs
+
+
+def dirs_unchanged(patient_dir, dirs):
+    """처리된 환자: 기록해 둔 시리즈 폴더 mtime이 모두 그대로인지 (폴더당 stat 1회)"""
+    for rel, mtime in dirs.items():
+        try:
+            if os.stat(os.path.join(patient_dir, rel)).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+class WatchIndex(object):
+    def __init__(self, path):
+        self.path = Path(path)
+        self.patients = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.patients = json.load(f).get("patients", {})
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"patients": self.patients}, f)
+        os.replace(str(tmp_path), str(self.path))
+
+    def update(self, input_path, now):
+        """변경 감지. 새로 바뀐 환자 수를 반환"""
+        changed = 0
+        top = {}
+        archives = {}   # 환자ID -> ({".": [크기, mtime]}, {}) (archive는 파일 하나이므로 stat이 곧 전체 목록)
+        with os.scandir(str(input_path)) as it:
+            for e in it:
+                try:
+                    if e.is_dir():
+                        top[e.name] = e.stat().st_mtime
+                    elif e.is_file() and is_archive(e.name):
+                        st = e.stat()
+                        archives[archive_stem(e.name)] = ({".": [st.st_size, st.st_mtime]}, {})
+                except OSError:
+                    continue
+        for name in set(archives) & set(top):
+            del archives[name]  # 같은 ID의 폴더가 있으면 폴더 우선
+        top.update((name, files["."][1]) for name, (files, _) in archives.items())
+
+        for name in sorted(top):
+            prev = self.patients.get(name)
+            patient_dir = str(input_path / name)
+            if prev is not None and "mtime" not in prev:
+                # 이전 형식 인덱스: {상대경로: [mtime, 파일 수, 하위 폴더]}, 최상위 폴더는 "."
+                old_dirs = prev.get("dirs", {})
+                prev["mtime"] = old_dirs.get(".", [None])[0]
+                prev["dirs"] = {rel: v[0] for rel, v in old_dirs.items() if rel != "."}
+                prev["files"] = {}
+            if prev is not None and "dirs" not in prev:
+                # 시리즈 폴더 mtime이 없는 인덱스: 이번에 한 번 기록 (변경으로 보지 않음)
+                prev["dirs"] = {} if name in archives else scan_patient(patient_dir)[1]
+            if (prev is not None and prev["status"] == "done" and prev["mtime"] == top[name]
+                    and dirs_unchanged(patient_dir, prev["dirs"])):
+                continue  # 처리 완료 + 변화 없음: 파일 목록을 읽지 않음
+
+            files, dirs = archives[name] if name in archives else scan_patient(patient_dir)
+            if (prev is None or prev["mtime"] != top[name] or files != prev["files"]
+                    or dirs != prev["dirs"]):
+                self.patients[name] = {"mtime": top[name], "dirs": dirs, "files": files,
+                                       "status": "pending", "changed_at": now}
+                changed += 1
+
+        # 사라진 환자 폴더는 인덱스에서 제거
+        for name in set(self.patients) - set(top):
+            del self.patients[name]
+        return changed
+
+    def ready(self, now, quiet):
+        return sorted(name for name, e in self.patients.items()
+                      if e["status"] == "pending" and now - e["changed_at"] >= quiet)
+
+    def mark_done(self, names):
+        for name in names:
+            if name in self.patients:
+                # 완료된 환자는 폴더 mtime만 비교하므로 파일 목록은 보관하지 않음
+                self.patients[name].update(status="done", files={})
+
+
+def run_cycle(index, args, state):
+    now = time.time()
+    changed = index.update(Path(args.input), now)
+    ready = index.ready(now, args.quiet)
+    pending = sum(1 for e in index.patients.values() if e["status"] == "pending")
+    print(f"🔁 [{time.strftime('%H:%M:%S')}] {len(index.patients)} patients, "
+          f"{changed} changed, {pending} pending, {len(ready)} ready")
+
+    if ready and not args.baseline:
+        from to3d import process_to_nifti
+        import run_defacer
+
+        try:
+            process_to_nifti(args.input, args.nifti, patients=ready)
+            if not args.convert_only:
+                if state.get("defacer") is None:
+                    from defacer import Defacer
+                    print("   ⏳ Loading DL Model...")
+                    state["defacer"] = Defacer(engine=args.engine)
+                run_defacer.main(args.nifti, args.output, patients=ready, defacer=state["defacer"])
+        except Exception as e:
+            # 다음 주기에 다시 시도 (pending 유지)
+            print(f"   ❌ Ingest Error: {e}")
+            index.save()
+            return
+
+    index.mark_done(ready)
+    index.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental ingest: watch raw_data for new patient folders")
+    parser.add_argument("--input", required=True, help="Raw Data 폴더 경로 (예: raw_data)")
+    parser.add_argument("--nifti", required=True, help="변환된 NIfTI 저장 경로 (예: processed/3d_input)")
+    parser.add_argument("--output", required=True, help="Defacing 결과 저장 경로 (예: processed/defaced_output)")
+    parser.add_argument("--index", default=None, help="인덱스 파일 경로 (기본: <nifti>/../_watch_index.json)")
+    parser.add_argument("--interval", type=float, default=60, help="폴링 주기 (초)")
+    parser.add_argument("--quiet", type=float, default=300, help="마지막 변경 후 이 시간(초) 동안 변화가 없어야 처리")
+    parser.add_argument("--engine", default="keras",
+                        choices=["keras", "frozen", "frozen_fp16", "frozen_int8"])
+    parser.add_argument("--convert-only", action="store_true", help="NIfTI 변환만 수행 (defacing 생략)")
+    parser.add_argument("--baseline", action="store_true",
+                        help="현재 있는 폴더를 처리하지 않고 '완료'로만 기록 (기존 아카이브 등록용)")
+    parser.add_argument("--once", action="store_true", help="한 번만 확인하고 종료")
+    args = parser.parse_args()
+
+    if args.baseline:
+        args.quiet = 0
+        args.once = True
+
+    index_path = args.index or str(Path(args.nifti).parent / "_watch_index.json")
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    index = WatchIndex(index_path)
+    state = {}
+
+    print(f"👀 Watching {args.input} (interval {args.interval:.0f}s, quiet {args.quiet:.0f}s)")
+    while True:
+        run_cycle(index, args, state)
+        if args.once:
+            break
+        time.sleep(args.interval)